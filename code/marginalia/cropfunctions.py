@@ -4,10 +4,10 @@ Created on Thu Jun 27 13:31:02 2019
 
 @author: mtjansen
 """
+import os
 from collections import Counter
 
 from PIL import Image, ImageChops, ImageStat
-from scipy.ndimage import interpolation as inter
 import numpy as np
 
 
@@ -63,6 +63,8 @@ def strip_list(list_of_bboxes, pos):
 def find_score(arr, angle):
     """Determine score for a given rotation angle.
     """
+    # scipy is slow to import, so only load it when deskewing
+    from scipy.ndimage import interpolation as inter
     data = inter.rotate(arr, angle, reshape=False, order=0)
     hist = np.sum(data, axis=1)
     score = np.sum((hist[1:] - hist[:-1]) ** 2)
@@ -307,4 +309,51 @@ def simp_bd(band_dict, diff, side, width, pad=10, allow=(0.1, 0.3), freq=0.8,
         if side == "left":
             return 0
         elif side == "right":
-            return width
\ No newline at end of file
+            return width
+
+
+def page_marginalia(r):
+    """Finds skew angle, background color and text bounding box for one page
+
+    Parameters:
+    r (dict): Page record with "folder", "filename", "side" and 
+        "start_section" keys (see marginalia_determination.py), and 
+        optionally "root", the directory the folders are in
+    
+    Returns:
+    list: filename, angle, side, cut, backR, backG, backB, bbox1, bbox2, 
+        bbox3, bbox4
+    """
+    f = os.path.join(r.get("root", ""),r["folder"],r["filename"])
+    orig = Image.open(f)
+    
+    side = r["side"]
+        
+    ang = rotation_angle(orig)
+    
+    if r["start_section"]:
+        diff, background, orig_bbox = trim(orig, angle=ang, find_top=False)
+    else:
+        diff, background, orig_bbox = trim(orig, angle=ang)
+
+    if "196" in r["folder"] or "195" in r["folder"]:
+        total_bbox = orig_bbox
+        cut = None
+    else:
+        bheight = 50
+        band_dict = get_bands(diff, bheight=bheight) 
+        
+        width = diff.size[0]
+        cut = simp_bd(band_dict=band_dict, diff=diff, side=side, width=width,
+                      pad=10, freq =0.9)
+    
+        out_bbox = [0, 0] + list(diff.size)
+        side_dict = {"left":0, "right":2}
+        out_bbox[side_dict[side]] = cut
+        
+        total_bbox = combine_bbox(orig_bbox,out_bbox)
+    
+    meta_list = [r["filename"], ang, side, cut]
+    meta_list.extend(background)
+    meta_list.extend(total_bbox)
+    return meta_list
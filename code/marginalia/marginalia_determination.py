@@ -8,14 +8,7 @@ Created on Thu Jun 27 13:30:26 2019
 import sys
 import os
 import csv
-import shutil
 import time
-import random
-
-from collections import Counter
-from PIL import Image, ImageChops, ImageStat
-from scipy.ndimage import interpolation as inter
-import numpy as np
 
 sys.path.append(os.path.abspath(r"C:\Users\mtjansen\Desktop\OnTheBooks"))
 from cropfunctions import *
@@ -51,42 +44,29 @@ master = [m for m in master if "186465" not in m["filename"]]
 batch = master[80000:]
 meta = []
 
+#Shared work queue directory to process pages on other machines (see 
+#workqueue.py), or None to process them here
+queue_dir = None
+
+if queue_dir is not None:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from workqueue import workQueue, collect
+    queue = workQueue(queue_dir)
+    tids = []
+    for r in batch:
+        #The image's size and modification time are part of the task (and so
+        #its id), so a page is processed again when its image changes
+        st = os.stat(os.path.join(r["folder"], r["filename"]))
+        task = dict(r, root=os.getcwd(), size=st.st_size, mtime=st.st_mtime)
+        tids.append(queue.put("marginalia", task))
+    results = collect(queue, tids)
+else:
+    results = (page_marginalia(r) for r in batch)
+
 img_ct = 0
 start = time.time()
-for r in batch:
+for meta_list in results:
     #t0 = time.time()
-    f = os.path.join(r["folder"],r["filename"])
-    orig = Image.open(f)
-    
-    side = r["side"]
-        
-    ang = rotation_angle(orig)
-    
-    if r["start_section"]:
-        diff, background, orig_bbox = trim(orig, angle=ang, find_top=False)
-    else:
-        diff, background, orig_bbox = trim(orig, angle=ang)
-
-    if "196" in r["folder"] or "195" in r["folder"]:
-        total_bbox = orig_bbox
-        cut = None
-    else:
-        bheight = 50
-        band_dict = get_bands(diff, bheight=bheight) 
-        
-        width = diff.size[0]
-        cut = simp_bd(band_dict=band_dict, diff=diff, side=side, width=width,
-                      pad=10, freq =0.9)
-    
-        out_bbox = [0, 0] + list(diff.size)
-        side_dict = {"left":0, "right":2}
-        out_bbox[side_dict[side]] = cut
-        
-        total_bbox = combine_bbox(orig_bbox,out_bbox)
-    
-    meta_list = [r["filename"], ang, side, cut]
-    meta_list.extend(background)
-    meta_list.extend(total_bbox)
     meta.append(meta_list)
     img_ct +=1
     #print (r["filename"], time.time() - t0)
@@ -17,9 +17,10 @@ import csv
 
 #get ocr functions
 sys.path.insert(0, "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/OCR/")
-from ocr_func import cutMarg, OCRtestImg, testList
+from ocr_func import cutMarg, OCRtestImg, OCRstripImg, getStrips, testList, getTesseract
+from ocr_ledger import fingerprint
 
-def adjRec(vol, dirpath, masterlist, margdata, n):
+def adjRec(vol, dirpath, masterlist, margdata, n, strips = 0):
     
     """
 
@@ -35,6 +36,10 @@ def adjRec(vol, dirpath, masterlist, margdata, n):
     margdata (str)   : The direct file path for the csv with marginalia data
     
     n (int)          : The sample size to use for testing
+    
+    strips (int)     : If greater than 0, adjustments are ranked by OCRing this
+                       many text-dense strips per page instead of full pages
+                       (see OCRstripImg and stripReport in ocr_func.py)
 
     """
 
@@ -56,6 +61,7 @@ def adjRec(vol, dirpath, masterlist, margdata, n):
     #Get images for files in sample, cut margins and make a test list
     imgs = []
     results = []
+    boxes = {}
     
     for img in pool:
         
@@ -78,10 +84,14 @@ def adjRec(vol, dirpath, masterlist, margdata, n):
         imgs.append(img)
         
         #perform an OCR test on the new image and add the results to the list
-        results.append(OCRtestImg(img))
+        if strips > 0:
+            boxes[name] = getStrips(img, n = strips)
+            results.append(OCRstripImg(img, boxes = boxes[name]))
+        else:
+            results.append(OCRtestImg(img))
         
     #create a testList object with the  images and results
-    testSample = testList(imgs, results)
+    testSample = testList(imgs, results, strips = boxes if strips > 0 else None)
     
     #set up a dict of reccommended adjustments and perform tests
     adjustments = { "volume": vol, "color": 1.0, "invert": False, 
@@ -134,39 +144,87 @@ def adjRec(vol, dirpath, masterlist, margdata, n):
     return adjustments    
 
 
+def inputFingerprint(vol, csv, dirpath):
+
+    """
+
+    Fingerprint of a volume's inputs for adjRec: its rows in the merged
+    master list and marginalia data, the size and modification time of its
+    images and the tesseract version. Queue task ids include it, so a
+    volume is tested again when any of these change.
+
+    vol (str)        : The volume name (see adjRec)
+
+    csv (data frame) : The master list merged with the marginalia data, as
+                       in adjRec
+
+    dirpath (str)    : The directory path for the folder where ALL volumes are located
+
+    """
+
+    imgdir = os.path.normpath(os.path.join(dirpath, vol + "_jp2"))
+    images = []
+    for f in sorted(os.listdir(imgdir)):
+        st = os.stat(os.path.join(imgdir, f))
+        images.append([f, st.st_size, st.st_mtime])
+
+    rows = csv[csv["filename"].str.startswith(vol)].to_csv(index = False)
+
+    return fingerprint(rows, images, str(getTesseract().get_tesseract_version()))
+
+
 ###########  Set up locations  ###############################################
     
 dirpath = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/1865-1968 jp2 files/"        
 masterlist = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/xmljpegmerge_official.csv"
 margdata = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/marginalia_metadata_part2_fix.csv"
+queueDir = None     #shared work queue directory to test volumes on other machines, or None
 
 
-###########  Reccommend Adjustments for a Single Volume  ######################
+def main():
 
-adj1943 = adjRec("sessionlawsresol1943nort", dirpath, masterlist, margdata, 10)
+    ###########  Reccommend Adjustments for a Single Volume  ######################
 
+    adj1943 = adjRec("sessionlawsresol1943nort", dirpath, masterlist, margdata, 10)
 
-###########  Create a CSV with Adjustment Specs for all Volumes  ############## 
 
-savfile = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/output/adjustments.csv"
+    ###########  Create a CSV with Adjustment Specs for all Volumes  ############## 
 
-for folder in os.listdir(dirpath):
-    
-    if folder == ".DS_Store":
-        continue
-    
-    #get volume
-    vol = folder.replace("_jp2", "")
-    print ("Testing " + vol + "...")
-    
-    #peform adjustment tests 
-    adjRow = adjRec(vol, dirpath, masterlist, margdata, 10)
-    
-    #record adjustments
-    with open(savfile, "a") as f:
-        w = csv.DictWriter(f, adjRow.keys())
-        if f.tell() == 0:
-            w.writeheader()
-            w.writerow(adjRow)
-        else: 
-            w.writerow(adjRow)
\ No newline at end of file
+    savfile = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/output/adjustments.csv"
+
+    vols = [folder.replace("_jp2", "") for folder in os.listdir(dirpath) if folder != ".DS_Store"]
+
+    if queueDir is not None:
+        #test volumes on workers on other machines (see workqueue.py)
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+        from workqueue import workQueue, collect
+        queue = workQueue(queueDir)
+
+        #task ids change with the volume's inputs, so a finished test isn't
+        #reused after its images or metadata change
+        mastercsv = pandas.read_csv(masterlist)
+        margcsv = pandas.read_csv(margdata)
+        mastercsv["filename"] = mastercsv["filename"] + ".jp2"
+        merged = mastercsv.merge(margcsv, left_on="filename", right_on="file")
+        rows = collect(queue, [queue.put("adjrec", {"vol" : vol, "n" : 10,
+                                                    "inputs" : inputFingerprint(vol, merged, dirpath)})
+                               for vol in vols])
+    else:
+        rows = (adjRec(vol, dirpath, masterlist, margdata, 10) for vol in vols)
+
+    for vol, adjRow in zip(vols, rows):
+
+        print ("Tested " + vol)
+
+        #record adjustments
+        with open(savfile, "a") as f:
+            w = csv.DictWriter(f, adjRow.keys())
+            if f.tell() == 0:
+                w.writeheader()
+                w.writerow(adjRow)
+            else: 
+                w.writerow(adjRow)
+
+
+if __name__ == "__main__":
+    main()
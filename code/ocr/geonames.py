@@ -8,32 +8,109 @@ Created on Fri May 31 16:46:58 2019
 Digital Research Services
 University Libraries
 UNC Chapel Hill
+
+Build a word list of place names for one state from the geonames dump, to
+add to the spell checker dictionary.
+
+The dump is read in chunks, keeping only the name and state columns, so the
+whole file is never in memory. Names are tokenized with a regular expression
+and counted per chunk. Tokens of letters only are kept (no punctuation,
+digits or hyphenated names, as with nltk's word_tokenize and isalpha()),
+along with their number of occurrences.
+
+Two files are written:
+    geonames.txt    : the unique tokens, most common first, separated by
+                      spaces (read by SpellChecker.word_frequency.load_text_file)
+    geonames.json   : each token and its number of occurrences (read by
+                      lexicon.loadLexicon)
+
+Usage:
+    python geonames.py --state NC --dump US/US.txt --out geonames
 """
 
+import argparse
+import csv
+import json
 import pandas as pandas
-from nltk import word_tokenize
 
-#Read in the tab delimited file from http://download.geonames.org/export/dump/US.zip
+#the tab delimited file from http://download.geonames.org/export/dump/US.zip
 #File was downloaded 5/31/19, 4:41 PM
-gn = pandas.read_csv("/Users/tuesday/Documents/_Projects/Research/OnTheBooks/US/US.txt", sep ="\t", header = None)
-
-#Filter records for North Carolina 
-ncgn = gn[gn.loc[:,10] == "NC"]
-
-#Dump all geonames into a single string
-geonames = ""
-for index,row in ncgn.iterrows():
-    if type(row[2]) is str: 
-        geonames = geonames + " " + row[2]
-
-#Tokenize geonames. Remove punctuation, duplicates and single letters. Make lowercase.
-geotokens = word_tokenize(geonames)
-geotokens = [token for token in geotokens if token.isalpha()]
-geotokens = list(dict.fromkeys(geotokens))
-geotokens = [token for token in geotokens if len(token) > 1]
-geotokens = [token.lower() for token in geotokens]
-
-#Create text file to add to Spell Checker
-with open("/Users/tuesday/Documents/_Projects/Research/OnTheBooks/geonames.txt", "w") as file:
-    for token in geotokens:
-        file.write(token + " ")
\ No newline at end of file
+dumpFile = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/US/US.txt"
+outFile = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/geonames"
+
+#columns in the dump: ascii name and state (admin1) code
+nameCol = 2
+stateCol = 10
+
+#runs of two or more letters that aren't part of a longer word, number or
+#hyphenated name
+tokenPattern = r"(?<![\w'])(?<!\w-)[^\W\d_]{2,}(?!\w)(?!-\w)"
+
+
+def buildGeonames(dump, state, chunksize = 500000):
+
+    """
+
+    Count the tokens in a state's place names.
+
+    Arguments
+    --------------------------------------------------------------------------
+    dump (str)           : File path of the geonames dump.
+
+    state (str)          : Two letter state code, e.g. "NC".
+
+    chunksize (int)      : Rows to read at a time.
+
+    Returns
+    --------------------------------------------------------------------------
+    (series) Lowercase tokens and their counts, most common first.
+
+    """
+
+    counts = pandas.Series(dtype = "int64")
+
+    chunks = pandas.read_csv(dump, sep = "\t", header = None, usecols = [nameCol, stateCol],
+                             dtype = str, quoting = csv.QUOTE_NONE, keep_default_na = False,
+                             chunksize = chunksize)
+
+    for chunk in chunks:
+        names = chunk.loc[chunk[stateCol] == state, nameCol]
+        tokens = names.str.findall(tokenPattern).explode().dropna().str.lower()
+        counts = counts.add(tokens.value_counts(), fill_value = 0)
+
+    #most common first, then alphabetical, so output is the same from run to run
+    df = counts.astype("int64").rename("n").rename_axis("word").reset_index()
+    df = df.sort_values(["n", "word"], ascending = [False, True])
+    return pandas.Series(df["n"].to_numpy(), index = df["word"].to_numpy())
+
+
+def writeGeonames(counts, out):
+
+    """
+
+    Write the word list (out + ".txt") and the counts (out + ".json").
+
+    """
+
+    with open(out + ".txt", "w", encoding = "utf-8") as f:
+        f.write(" ".join(counts.index) + " ")
+
+    with open(out + ".json", "w", encoding = "utf-8") as f:
+        json.dump({w : int(n) for w, n in counts.items()}, f, indent = 0)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Build a place name word list from the geonames dump.")
+    parser.add_argument("--state", default = "NC", help = "two letter state code")
+    parser.add_argument("--dump", default = dumpFile, help = "geonames dump file (e.g. US.txt)")
+    parser.add_argument("--out", default = outFile, help = "output path without extension")
+    args = parser.parse_args()
+
+    counts = buildGeonames(args.dump, args.state)
+    writeGeonames(counts, args.out)
+    print("{} tokens from {} place names".format(counts.shape[0], args.state))
+
+
+if __name__ == "__main__":
+    main()
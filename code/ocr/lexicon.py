@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Word lists for readability scores and spelling corrections.
+
+Combines the SpellChecker English dictionary with NC geonames (see 
+geonames.py) and a list of legal terms found in the session laws, as one 
+dictionary of word frequencies. getCorrector() keeps a symmetric delete
+index (see symspell.py) of the combined list on disk, building it the first
+time it is needed and again whenever one of the word lists changes.
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import os
+import json
+import hashlib
+import spellchecker
+from spellchecker import SpellChecker
+from symspell import symSpell
+
+#files kept next to this script
+here = os.path.dirname(os.path.abspath(__file__))
+geonamesFile = os.path.join(here, "geonames.txt")
+legalFile = os.path.join(here, "legal_terms.txt")
+symspellDir = os.path.join(here, "symspell")
+
+#frequency given to legal terms, so they rank above rare dictionary words
+legalFreq = 1000
+
+corrector = None
+
+
+def readWords(path):
+
+    """
+
+    Read a whitespace separated word list.
+
+    """
+
+    with open(path, encoding = "utf-8") as f:
+        return f.read().split()
+
+
+def loadLexicon(geonames = geonamesFile, legal = legalFile):
+
+    """
+
+    Get the combined word list.
+
+    Arguments
+    --------------------------------------------------------------------------
+    geonames (str)       : Path to the geonames word list, or None to leave
+                           it out. A .json file from geonames.py adds each 
+                           place name token with its number of occurrences;
+                           a .txt word list adds each token once.
+
+    legal (str)          : Path to the legal terms list, or None to leave it
+                           out.
+
+    Returns
+    --------------------------------------------------------------------------
+    (dict) Lowercase words and their frequencies.
+
+    """
+
+    lexicon = dict(SpellChecker().word_frequency.dictionary)
+
+    if geonames is not None:
+        if geonames.endswith(".json"):
+            with open(geonames, encoding = "utf-8") as f:
+                counts = json.load(f)
+        else:
+            counts = dict.fromkeys(readWords(geonames), 1)
+        for word, n in counts.items():
+            lexicon[word] = lexicon.get(word, 0) + n
+
+    if legal is not None:
+        for word in readWords(legal):
+            lexicon[word] = lexicon.get(word, 0) + legalFreq
+
+    return lexicon
+
+
+def sourceHashes(geonames = geonamesFile, legal = legalFile):
+
+    """
+
+    Hashes of the word lists in the combined list: the SpellChecker version
+    for its English dictionary, and a SHA-1 checksum of each file.
+
+    """
+
+    hashes = {"spellchecker" : spellchecker.__version__}
+    for name, path in [("geonames", geonames), ("legal", legal)]:
+        with open(path, "rb") as f:
+            hashes[name] = hashlib.sha1(f.read()).hexdigest()
+    return hashes
+
+
+def getCorrector(path = symspellDir):
+
+    """
+
+    Get the symmetric delete corrector for the combined word list. The
+    index is loaded from path, or built and saved there if it doesn't exist
+    yet or was built from different word lists (see sourceHashes). The same
+    corrector is returned afterwards.
+
+    Returns
+    --------------------------------------------------------------------------
+    A symSpell object.
+
+    """
+
+    global corrector
+
+    if corrector is None:
+        sources = sourceHashes()
+        try:
+            corrector = symSpell.load(path)
+            if corrector.sources != sources:
+                corrector = None
+        except FileNotFoundError:
+            #not built yet, or being replaced by another process
+            corrector = None
+        if corrector is None:
+            corrector = symSpell.build(loadLexicon())
+            corrector.sources = sources
+            corrector.save(path)
+
+    return corrector
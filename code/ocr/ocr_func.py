@@ -11,25 +11,37 @@ UNC Chapel Hill
 """
 
 
-import pytesseract
-from PIL import Image, ImageEnhance, ImageOps, ImageFilter
-from spellchecker import SpellChecker
-from nltk import word_tokenize
+from PIL import Image, ImageEnhance, ImageOps, ImageFilter, ImageStat
 import os
-from tqdm import tqdm
-import pandas as pandas
 from random import sample
 from io import StringIO
-from numpy import random
 import csv
+import time
+from ocr_timing import stage
+
+#pytesseract (which loads pandas), pandas, numpy, spellchecker, nltk, tqdm 
+#and the correction index are only imported by the functions that use them, 
+#so the command line, worker processes and scripts that only cut and adjust
+#pages start faster
 
 #establish tesseract directory
-pytesseract.pytesseract.tesseract_cmd = r"/usr/local/Cellar/tesseract/4.0.0_1/bin/tesseract"
+tesseractCmd = r"/usr/local/Cellar/tesseract/4.0.0_1/bin/tesseract"
 
-#show more columns in dataframes
-pandas.set_option('display.max_columns', 999)
+def getTesseract():
+    
+    """
+    
+    Import pytesseract on first use and point it at tesseractCmd.
+    
+    """
+    
+    import pytesseract
+    pytesseract.pytesseract.tesseract_cmd = tesseractCmd
+    return pytesseract
 
-def cutMarg(img, rotate, left, up, right, lower, border, bkgcol):
+spellchecker = None
+
+def cutMarg(img, rotate, left, up, right, lower, border, bkgcol, mode = None):
     
     """
     
@@ -57,6 +69,12 @@ def cutMarg(img, rotate, left, up, right, lower, border, bkgcol):
     
     bkgcol (tuple)       : Tuple of RGB values to use as a background color
     
+    mode (str)           : If "L", the image is converted to 8-bit grayscale
+                           before it is rotated and cropped, which uses a third
+                           of the memory of RGB. Use when the image will be
+                           made black and white anyway (color = 0 in adjustImg).
+                           JPEGs are decoded straight to grayscale.
+    
     Returns
     --------------------------------------------------------------------------
     A PIL image object.
@@ -68,14 +86,28 @@ def cutMarg(img, rotate, left, up, right, lower, border, bkgcol):
     #if a filename is used for the image, load the image
     if type(img) == str:
         name = os.path.split(img)[1]
-        img = Image.open(img)
+        with stage("decode"):
+            img = Image.open(img)
+            if mode == "L":
+                img.draft("L", img.size)
+            img.load()
     else:
         name = img.info["name"]
     
+    #convert to grayscale before anything else. The background color is 
+    #converted the same way as the image.
+    if mode == "L":
+        with stage("grayscale"):
+            if img.mode != "L":
+                img = img.convert("L")
+            bkgcol = Image.new("RGB", (1, 1), tuple(bkgcol)).convert("L").getpixel((0, 0))
+    
     #rotate, crop, expand border and fill with color
-    img = img.rotate(rotate)
-    img = img.crop((left, up, right, lower))
-    img = ImageOps.expand(img, border = border, fill = bkgcol)
+    with stage("rotate"):
+        img = img.rotate(rotate)
+    with stage("crop"):
+        img = img.crop((left, up, right, lower))
+        img = ImageOps.expand(img, border = border, fill = bkgcol)
     
     #return image with name info
     img.info = {"name" : name}
@@ -84,7 +116,7 @@ def cutMarg(img, rotate, left, up, right, lower, border, bkgcol):
     
 def adjustImg(img,  color = 1.0, brightness = 1.0, contrast = 1.0, 
               autocontrast = 0, sharpness = 1.0, invert = False, blur = False, 
-              sharpen = False, smooth = False, xsmooth = False):
+              sharpen = False, smooth = False, xsmooth = False, binarize = 0):
     
     """
     
@@ -119,6 +151,11 @@ def adjustImg(img,  color = 1.0, brightness = 1.0, contrast = 1.0,
     smooth(bool)         : If True, applies SMOOTH filter.
      
     xsmooth(bool)        : If True, applies SMOOTH_MORE filter.
+    
+    binarize (int)       : If not 0, the image is converted to grayscale and 
+                           pixels at or above this level (1-255) are made 
+                           white and the rest black, after all other 
+                           adjustments.
 
     Returns
     --------------------------------------------------------------------------
@@ -135,40 +172,54 @@ def adjustImg(img,  color = 1.0, brightness = 1.0, contrast = 1.0,
     else:
         name = img.info["name"]
         
-    #Perform image adjustments.
-    if color != 1.0:    
-        enhancer = ImageEnhance.Color(img)
-        img = enhancer.enhance(color)
+    #Perform image adjustments. A grayscale image has no color to remove.
+    if color != 1.0 and img.mode != "L":    
+        with stage("color"):
+            enhancer = ImageEnhance.Color(img)
+            img = enhancer.enhance(color)
         
     if invert == True:    
-        img = ImageOps.invert(img)
+        with stage("invert"):
+            img = ImageOps.invert(img)
 
     if autocontrast != 0:    
-        img = ImageOps.autocontrast(img, cutoff = autocontrast)    
+        with stage("autocontrast"):
+            img = ImageOps.autocontrast(img, cutoff = autocontrast)    
         
     if brightness != 1.0:    
-        enhancer = ImageEnhance.Color(img)
-        img = enhancer.enhance(brightness)
+        with stage("brightness"):
+            enhancer = ImageEnhance.Color(img)
+            img = enhancer.enhance(brightness)
     
     if contrast != 1.0:    
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(contrast)
+        with stage("contrast"):
+            enhancer = ImageEnhance.Contrast(img)
+            img = enhancer.enhance(contrast)
         
     if blur == True:    
-        img = img.filter(ImageFilter.BLUR)
+        with stage("blur"):
+            img = img.filter(ImageFilter.BLUR)
 
     if sharpen == True:    
-        img = img.filter(ImageFilter.SHARPEN)
+        with stage("sharpen"):
+            img = img.filter(ImageFilter.SHARPEN)
  
     if sharpness != 1.0:    
-        enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(sharpness)
+        with stage("sharpness"):
+            enhancer = ImageEnhance.Sharpness(img)
+            img = enhancer.enhance(sharpness)
     
     if smooth == True:    
-        img = img.filter(ImageFilter.SMOOTH)
+        with stage("smooth"):
+            img = img.filter(ImageFilter.SMOOTH)
     
     if xsmooth == True:    
-        img = img.filter(ImageFilter.SMOOTH_MORE)
+        with stage("xsmooth"):
+            img = img.filter(ImageFilter.SMOOTH_MORE)
+    
+    if binarize != 0:
+        with stage("binarize"):
+            img = img.convert("L").point([0] * binarize + [255] * (256 - binarize))
     
     #Return the image with name info
     img.info = {"name" : name}
@@ -235,67 +286,412 @@ def OCRtestImg(img, alltext = False, correct = False, psm = 1, oem = 3):
         return "Invalid tesseract config."
     
     tconfig = pconfig + " " + oconfig
-    
+
     #Perform cropping, image adjustments and OCR
-    text = pytesseract.image_to_string(img, config = tconfig)
-    
+    with stage("tesseract"):
+        text = getTesseract().image_to_string(img, config = tconfig)
+
+    #create record for image
+    imgRecord = {"name" : img.info["name"]}
+    with stage("score"):
+        imgRecord.update(scoreText(text, correct = correct))
+
+    #add full OCR text if required
+    if alltext == True:
+        imgRecord["text"] = text.encode("utf-8", errors = "replace")
+
+    return(imgRecord)
+
+
+def getSpell():
+
+    """
+
+    Get the SpellChecker used for readability scores.
+
+    The combined word list from lexicon.py (English dictionary, NC geonames
+    and legal terms) is loaded the first time the function is called, so
+    pages are scored against the same words as in ocr_score.py. The same
+    SpellChecker is returned afterwards so the word lists aren't re-read
+    for every page.
+
+    Returns
+    --------------------------------------------------------------------------
+    A SpellChecker object.
+
+    """
+
+    global spellchecker
+
+    if spellchecker is None:
+
+        from spellchecker import SpellChecker
+        from lexicon import loadLexicon
+
+        spellchecker = SpellChecker(language = None)
+        spellchecker.word_frequency.load_json(loadLexicon())
+
+    return(spellchecker)
+
+
+def scoreText(text, correct = False):
+
+    """
+
+    Score the readability of OCR'd text.
+
+    Text is tokenized with NLTK and compared to the SpellChecker dictionary.
+    This is the scoring used by OCRtestImg, split out so that text from any
+    OCR run (full pages, strips, TSV output) is scored the same way.
+
+    Arguments
+    --------------------------------------------------------------------------
+    text (str)           : OCR'd text.
+
+    correct (bool)       : If True, a list of suggested corrections for
+                           unknown words is included in the record. The 
+                           corrections are in the same order as the unknown
+                           words, and a word with no correction within two
+                           edits is kept as it is.
+
+    Returns
+    --------------------------------------------------------------------------
+    (dict) Token count, unknown count, readability score and unknown words.
+
+    """
+
     #join hyphenated words that are split between lines
     text = text.replace("-\n","")
-    
+
     #tokenize text, remove punctuation and convert to utf-8
+    from nltk import word_tokenize
     tokens = word_tokenize(text)
     tokens = [token for token in tokens if token.isalpha()]
     tokens = [token.encode("utf-8", errors = "replace") for token in tokens]
-    
-    #add NC geonames to spellchecker dictionary
-    #(see geonames.py for script used to create the text file)
-    spell = SpellChecker()
-    spell.word_frequency.load_text_file("/Users/tuesday/Documents/_Projects/Research/OnTheBooks/OCR/geonames.txt")
-            
+
+    spell = getSpell()
+
     #get unknown words
     unknown = spell.unknown(tokens)
-    
-    #create list of replacements for unknown words
+
+    #create list of replacements for unknown words, all at once from the 
+    #precomputed index (see symspell.py)
     if correct == True:
-        
-        corrections = []
-        
-        for word in unknown:
-            try:
-                corrections.append(spell.correction(word))
-            except:
-                print("Ascii/unicode conversion issues came up but they were ignored.")
-        
+
+        from lexicon import getCorrector
+        corrections = getCorrector().correct(list(unknown))
         corrections = [word.encode("utf-8", errors = "replace") for word in corrections]
-        
+
     #Get readability score
     if len(unknown) != 0:
        readability = round(100 - (float(len(unknown))/float(len(tokens)) * 100), 3)
     else:
        readability = 100
-    
-    #create record for image
-    imgRecord = {
-            "name" : img.info["name"],
+
+    record = {
             "token_count" : len(tokens),
             "unknown_count" : len(unknown),
             "readability" : readability,
             "unknown_words" : list(unknown)
             }
-    
-    #add full OCR text if required
-    if alltext == True:
-        imgRecord["text"] = text.encode("utf-8", errors = "replace")
-        
+
     #add spell checker corrections if required
     if correct == True:
-        imgRecord["corrections"] = corrections
+        record["corrections"] = corrections
+
+    return(record)
+
+
+def getStrips(img, n = 6, bheight = 150, snap = 30, maxfill = 0.4):
+
+    """
+
+    Pick a fixed set of text-dense horizontal strips from a page.
+
+    Uses the same idea as get_bands in cropfunctions.py: the page is divided
+    into horizontal bands and the ink in each band is measured. The page is
+    then split into n zones from top to bottom and the band with the most ink
+    in each zone is kept, so the strips cover the whole page rather than
+    bunching up in one dense paragraph. Strip edges are moved to the lightest
+    row nearby so that lines of text are not cut in half.
+
+    No randomness is involved, so the same page always gives the same strips.
+    Strips should be picked once from the unadjusted image and reused for
+    every adjustment being compared.
+
+    Arguments
+    --------------------------------------------------------------------------
+    img (str, PIL image) : Either the file path of an image or a PIL image object
+
+    n (int)              : Number of strips to pick.
+
+    bheight (int)        : Height of each strip in pixels. Recommend using
+                           about three lines of text.
+
+    snap (int)           : Number of pixels a strip edge can move to find the
+                           gap between two lines.
+
+    maxfill (float)      : Bands with a greater share of ink pixels than this
+                           are skipped (rules, blots and dark page edges).
+
+    Returns
+    --------------------------------------------------------------------------
+    (list) Bounding boxes (left, upper, right, lower) for each strip,
+    ordered from top to bottom.
+
+    """
+
+    #if a filename is used for the image, load the image
+    if type(img) == str:
+        img = Image.open(img)
+
+    width, height = img.size
+    gray = img.convert("L")
+
+    #separate ink from background halfway between the background (median)
+    #and the darkest 1% of pixels
+    hist = gray.histogram()
+    total = sum(hist)
+    darkest = 0
+    count = 0
+    for level in range(0, 256):
+        count += hist[level]
+        if count >= total * 0.01:
+            darkest = level
+            break
+    cutoff = (ImageStat.Stat(gray).median[0] + darkest) / 2.0
+    ink = gray.point(lambda x: 255 if x < cutoff else 0)
+
+    #get the share of ink pixels in every row of the page
+    rows = [v / 255.0 for v in ink.resize((1, height), Image.BOX).getdata()]
+
+    #measure ink in each band
+    bands = []
+    for w in range(bheight, height + 1, bheight):
+        fill = sum(rows[w - bheight:w]) / bheight
+        if 0 < fill <= maxfill:
+            bands.append((w - bheight, fill))
+
+    if len(bands) == 0:
+        return [(0, 0, width, height)]
+
+    #keep the densest band in each zone
+    n = min(n, len(bands))
+    zone = float(height) / n
+    boxes = []
+    for z in range(0, n):
+        zbands = [b for b in bands if z * zone <= b[0] < (z + 1) * zone]
+        if len(zbands) == 0:
+            continue
+        top = max(zbands, key = lambda b: b[1])[0]
+
+        #move the edges to the lightest row nearby
+        upper = min(range(max(top - snap, 0), min(top + snap, height - 1) + 1),
+                    key = lambda r: rows[r])
+        bottom = top + bheight
+        lower = min(range(max(bottom - snap, upper + 1), min(bottom + snap, height - 1) + 1),
+                    key = lambda r: rows[r])
+        boxes.append((0, upper, width, lower))
+
+    return(boxes)
+
+
+def OCRstripImg(img, boxes = None, n = 6, bheight = 150, gap = 40, psm = 6, oem = 3):
+
+    """
+
+    Test the accuracy of OCR on a set of strips from an image.
+
+    A faster alternative to OCRtestImg for comparing adjustments. The strips
+    picked by getStrips are stacked into one image, separated by blank space,
+    and OCR'd in a single tesseract call as one block of text. The text is
+    scored with scoreText, so the record can be used anywhere an OCRtestImg
+    record is used.
+
+    Arguments
+    --------------------------------------------------------------------------
+    img (str, PIL image) : Either the file path of an image or a PIL image object.
+                           If a PIL object is used, the info attribute must
+                           contain a key called "name" assigned to a string
+                           value.
+
+    boxes (list)         : Strip bounding boxes from getStrips. If None, strips
+                           are picked from img.
+
+    n (int)              : Number of strips to pick if boxes is None.
+
+    bheight (int)        : Height of strips to pick if boxes is None.
+
+    gap (int)            : Pixels of blank space between stacked strips.
+
+    psm (int)            : Tesseract configuration for Page Segmentation Mode.
+                           The default of 6 treats the strips as one block.
+                           https://github.com/tesseract-ocr/tesseract/blob/master/doc/tesseract.1.asc
+
+    oem (int)            : Tesseract configuration for OCR Engine mode.
+                           https://github.com/tesseract-ocr/tesseract/blob/master/doc/tesseract.1.asc
+
+    Returns
+    --------------------------------------------------------------------------
+    (dict) The record for the image, with the strips used under "strips".
+
+    """
+
+    #if a filename is used for the image, load the image
+    if type(img) == str:
+        name = os.path.split(img)[1]
+        img = Image.open(img)
+        img.info = {"name" : name}
+    else:
+        name = img.info["name"]
+
+    # Set up tesseract config
+    if 0 <= psm <= 13 and 0 <= oem <= 3:
+        tconfig = "--psm " + str(psm) + " --oem " + str(oem)
+    else:
+        return "Invalid tesseract config."
+
+    if boxes is None:
+        boxes = getStrips(img, n = n, bheight = bheight)
+
+    #stack the strips on the page background color
+    strips = [img.crop(box) for box in boxes]
+    width = max([s.size[0] for s in strips])
+    height = sum([s.size[1] for s in strips]) + gap * (len(strips) + 1)
+    bkgcol = tuple(int(v) for v in ImageStat.Stat(img).median)
+    stack = Image.new(img.mode, (width, height), bkgcol if len(bkgcol) > 1 else bkgcol[0])
+    top = gap
+    for s in strips:
+        stack.paste(s, (0, top))
+        top += s.size[1] + gap
+
+    text = getTesseract().image_to_string(stack, config = tconfig)
+
+    imgRecord = {"name" : name}
+    imgRecord.update(scoreText(text))
+    imgRecord["strips"] = boxes
 
-    
     return(imgRecord)
-    
 
-def mkOCRtestList(pool, n):
+
+def stripReport(images, test = None, levels = [0,.25,.5,.75,1], n = 6, bheight = 150):
+
+    """
+
+    Validate strip scores from OCRstripImg against full page scores.
+
+    Every image is scored with both OCRtestImg and OCRstripImg, once without
+    adjustments or once for each level of an adjustment test, and the tesseract
+    time for each is recorded. The strips for each image are picked once from
+    the unadjusted image, the same way a testList does.
+
+    A report is returned with three items:
+
+    The first item is a table with full page and strip readability (and
+    time) for each image at each level.
+
+    The second item is a summary with the mean absolute difference between
+    the two scores, their correlation, the speedup and, for adjustment tests,
+    the best adjustment under each method.
+
+    The third item is True if the best adjustment is the same under both
+    methods.
+
+    Arguments
+    --------------------------------------------------------------------------
+    images (list)           : A list of PIL image objects with a "name" in
+                              the info attribute.
+
+    test (str)              : An image adjustment to test. If None, the
+                              images are only scored as they are.
+
+    levels (list)           : The levels at which a continuous adjustment
+                              will be tested. Ignored for boolean adjustments.
+
+    n (int)                 : Number of strips per image.
+
+    bheight (int)           : Height of each strip in pixels.
+
+    Returns
+    --------------------------------------------------------------------------
+    (dict) The results of the validation.
+
+    """
+
+    boolTests = ["invert", "blur", "sharpen", "smooth", "xsmooth"]
+
+    if test is None:
+        settings = [("none", {})]
+    elif test in boolTests:
+        settings = [(test + str(state), {test: state}) for state in [True, False]]
+    else:
+        settings = [(test + str(level), {test: level}) for level in levels]
+
+    rows = []
+
+    for img in images:
+
+        name = img.info["name"]
+        boxes = getStrips(img, n = n, bheight = bheight)
+
+        for header, kwargs in settings:
+
+            adjImg = adjustImg(img, **kwargs)
+
+            start = time.perf_counter()
+            page = OCRtestImg(adjImg)
+            pageTime = time.perf_counter() - start
+
+            start = time.perf_counter()
+            strip = OCRstripImg(adjImg, boxes = boxes)
+            stripTime = time.perf_counter() - start
+
+            img.info = {"name" : name}
+
+            rows.append({"name" : name,
+                         "adjustment" : header,
+                         "page_tokens" : page["token_count"],
+                         "page_unknown" : page["unknown_count"],
+                         "page_readability" : page["readability"],
+                         "strip_tokens" : strip["token_count"],
+                         "strip_unknown" : strip["unknown_count"],
+                         "strip_readability" : strip["readability"],
+                         "page_time" : round(pageTime, 3),
+                         "strip_time" : round(stripTime, 3)})
+
+    import pandas as pandas
+    table = pandas.DataFrame(rows)
+    table["difference"] = table["strip_readability"] - table["page_readability"]
+
+    #total readability for each level, calculated the same way as adjustTest
+    totals = table.groupby("adjustment", sort = False).sum(numeric_only = True)
+    pageTotal = (100 - totals["page_unknown"] / totals["page_tokens"].clip(lower = 1) * 100).round(3)
+    stripTotal = (100 - totals["strip_unknown"] / totals["strip_tokens"].clip(lower = 1) * 100).round(3)
+    pageBest = pageTotal.idxmax()
+    stripBest = stripTotal.idxmax()
+
+    summary = "\nSTRIP VALIDATION"
+    summary = summary + "\nmean absolute difference: " + str(round(table["difference"].abs().mean(), 3))
+    summary = summary + "\ncorrelation: " + str(round(table["page_readability"].corr(table["strip_readability"]), 3))
+    summary = summary + "\nspeedup: " + str(round(table["page_time"].sum() / max(table["strip_time"].sum(), 1e-9), 2)) + "x"
+    if test is not None:
+        summary = summary + "\nbest adjustment (page): " + pageBest
+        summary = summary + "\nbest adjustment (strips): " + stripBest
+
+    results = {
+    "table" : table,
+    "summary" : summary,
+    "agreement" : pageBest == stripBest
+    }
+
+    print ("\n\n")
+    print (results["table"])
+    print (results["summary"])
+
+    return results
+
+
+def mkOCRtestList(pool, n, strips = 0):
     
     """
     
@@ -310,6 +706,10 @@ def mkOCRtestList(pool, n):
     pool (list)             : A list of image file paths.
     
     n (int)                 : Sample size to be tested.
+    
+    strips (int)            : If greater than 0, images are scored on this
+                              many strips with OCRstripImg instead of on the
+                              full page.
                     
     
     Returns
@@ -321,16 +721,22 @@ def mkOCRtestList(pool, n):
     #create empty lists to store image records and image objects
     images = []
     results = []
+    boxes = {}
 
     #Create a sample of image objects
+    from tqdm import tqdm
     for filename in tqdm(sample(pool, n)):
         name = os.path.split(filename)[1]
         img = Image.open(filename)
         img.info = {"name" : name}
         images.append(img)
-        results.append(OCRtestImg(img))
+        if strips > 0:
+            boxes[name] = getStrips(img, n = strips)
+            results.append(OCRstripImg(img, boxes = boxes[name]))
+        else:
+            results.append(OCRtestImg(img))
 
-    testObj = testList(images, results)            
+    testObj = testList(images, results, strips = boxes if strips > 0 else None)            
     return(testObj)
 
 def OCRimg(img, savpath, append = True, psm = 1, oem = 3, adjdoc = True, **kwargs):
@@ -388,7 +794,7 @@ def OCRimg(img, savpath, append = True, psm = 1, oem = 3, adjdoc = True, **kwarg
     
     #open file and perform ocr    
     ocrf = open(savpath, **mode)
-    text = pytesseract.image_to_string(adjustImg(img, **kwargs), config = tconfig)
+    text = getTesseract().image_to_string(adjustImg(img, **kwargs), config = tconfig)
     ocrf.write(text.encode("utf-8", errors = "replace") + "\n\n")
     ocrf.close()
         
@@ -403,29 +809,22 @@ def OCRimg(img, savpath, append = True, psm = 1, oem = 3, adjdoc = True, **kwarg
         
     return
 
-def tsvOCR(img, savpath, tsvfile, p = 1, append = True, psm = 1, oem = 3):
+def OCRpage(img, psm = 1, oem = 3, correct = False):
     
     """
     
-    Run OCR on an image and produce a TSV file along with text. Can limit which 
-    files are added to the TSV by way of binomial sampling.
+    Run OCR on an image once and get everything needed from the page.
+    
+    A single tesseract image_to_data call is used for the word table, the 
+    page text and the readability score, so producing all of them doesn't 
+    take more than one engine run.
     
     Arguments
     --------------------------------------------------------------------------    
-    img (str, PIL image) : Either the file path of an image or a PIL image object
-    
-    savpath (str)        : The file path to save the text output.
-    
-    tsvfile (str)        : Name of a TSV file that will be produced in the same 
-                           directory as the text output. Ignored if not specified.
-
-    p                    : Probability to use for binomial sampling. If 1, no sample
-                           will be taken.                            
-
-    append (boolean)     : If true, text output is appended to the file specified 
-                           by savpath. If the file does not exist, it will be created.
-                           Note: this argument also applies to the TSV output if a
-                           TSV file is specified.
+    img (str, PIL image) : Either the file path of an image or a PIL image object.
+                           If a PIL object is used, the info attribute must
+                           contain a key called "name" assigned to a string
+                           value.
     
     psm (int)            : Tesseract configuration for Page Segmentation Mode. 
                           https://github.com/tesseract-ocr/tesseract/blob/master/doc/tesseract.1.asc
@@ -433,9 +832,18 @@ def tsvOCR(img, savpath, tsvfile, p = 1, append = True, psm = 1, oem = 3):
     oem (int)            : Tesseract configuration for OCR Engine mode. 
                           https://github.com/tesseract-ocr/tesseract/blob/master/doc/tesseract.1.asc 
     
+    correct (bool)       : If True, a list of suggested corrections for
+                           unknown words is included in the page record.
+    
     Returns
     --------------------------------------------------------------------------
-    none
+    (dict) The page record. Includes the same keys as an OCRtestImg record
+    along with:
+        "words"     : tesseract's TSV data as a data frame (boxes, confidence
+                      and block/paragraph/line/word numbers)
+        "text"      : the page text, with paragraphs and lines rebuilt from
+                      the TSV data
+        "mean_conf" : the mean confidence of recognized words
     
     """
     
@@ -458,82 +866,297 @@ def tsvOCR(img, savpath, tsvfile, p = 1, append = True, psm = 1, oem = 3):
         return "Invalid tesseract config."
     
     tconfig = pconfig + " " + oconfig
-
-    #determine mode to save files
-    if append == True:
-        mode = {"mode": "a"}
-    else:
-        mode = {"mode": "w"}
         
     #Get TSV data
-    tsvs = pytesseract.image_to_data(img, config = tconfig)
+    with stage("tesseract"):
+        tsvs = getTesseract().image_to_data(img, config = tconfig)
+    with stage("tsv_parse"):
+        tdf = readTSV(tsvs)
+
+        #Turn TSV data into text
+        text = tsvText(tdf)
+    
+    #get the confidence of recognized words
+    words = tdf[(tdf["conf"] >= 0) & tdf["text"].notna()]
+    if words.shape[0] > 0:
+        meanConf = round(float(words["conf"].mean()), 3)
+    else:
+        meanConf = 0
+    
+    #create record for page
+    pageRecord = {"name" : name}
+    with stage("score"):
+        pageRecord.update(scoreText(text, correct = correct))
+    pageRecord["mean_conf"] = meanConf
+    pageRecord["text"] = text
+    pageRecord["words"] = tdf
+    
+    return(pageRecord)
+
+
+def readTSV(tsvs):
+    
+    """
+    
+    Read tesseract's TSV output into a data frame.
+    
+    Uses pandas' C parser. Quoting is turned off because tesseract doesn't quote
+    its fields, so a word like '"The' is read as it is. Only empty fields are
+    read as missing, so words like "NA" or "null" are kept as text.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    tsvs (str)           : TSV output from pytesseract.image_to_data
+    
+    Returns
+    --------------------------------------------------------------------------
+    A pandas data frame.
+    
+    """
+    
+    import pandas as pandas
     tdf = pandas.read_csv(StringIO(tsvs), 
                           sep = "\t", 
-                          engine = "python",
-                          error_bad_lines = False)
+                          quoting = csv.QUOTE_NONE,
+                          keep_default_na = False,
+                          na_values = [""],
+                          dtype = {"text" : str},
+                          on_bad_lines = "skip")
+    
+    return(tdf)
 
-    #Turn TSV data into text
-    par = 0
-    line = 0
-    text = ""
+
+def tsvText(tdf):
+    
+    """
+    
+    Rebuild page text from tesseract's TSV data.
+    
+    Words are joined with spaces, each new line starts with a line break and 
+    each new paragraph with a blank line.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    tdf (data frame)     : TSV data from readTSV
+    
+    Returns
+    --------------------------------------------------------------------------
+    (str) The page text.
+    
+    """
+    
+    words = tdf[tdf["text"].notna()]
+    
+    #mark words that start a new paragraph or a new line
+    newPar = words["par_num"] != words["par_num"].shift(1, fill_value = 0)
+    newLine = ~newPar & (words["line_num"] != words["line_num"].shift(1, fill_value = 0))
     
-    for row in tdf.itertuples():
-        token = str(row.text)
+    import pandas as pandas
+    breaks = pandas.Series("", index = words.index)
+    breaks[newLine] = "\n"
+    breaks[newPar] = "\n\n"
+    
+    return((breaks + words["text"] + " ").str.cat())
 
-        #adjust tokens
-        if token == "nan":
-            continue
-        if row.par_num != par:
-            par = row.par_num
-            line = row.line_num
-            token = "\n\n" + token + " "
-        elif row.line_num != line:
-            line = row.line_num
-            token = "\n" + token + " "
-        else:
-            token = token + " "
-                    
-        #compile text
-        text = text + token
+
+class ocrWriter():
+    
+    """
+    
+    Buffered writer for a section's text and TSV output.
+    
+    tsvOCR used to reopen the text and TSV files for every page. An ocrWriter
+    keeps both files open for a whole section and writes pages in batches. 
+    The TSV file is only opened when there are rows to write, so a section
+    without any leaves no empty TSV behind. Whether it needs a header is 
+    decided once, when it is opened.
+    
+    ocr_use.py writes each page to its own shards (ocr_ledger.shardWriter)
+    instead, so an ocrWriter only batches pages when a script passes one to
+    tsvOCR itself; otherwise writePage opens one for each page.
+    
+    Can be used as a context manager, which flushes and closes the files at 
+    the end.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    savpath (str)        : The file path to save the text output.
+    
+    tsvfile (str)        : Name of a TSV file that will be produced in the same 
+                           directory as the text output.
+    
+    append (boolean)     : If true, output is appended to existing files.
+    
+    batch (int)          : Number of pages to hold before writing to disk.
+    
+    """
+    
+    def __init__(self, savpath, tsvfile, append = True, batch = 25):
         
-    #write text to file    
-    ocrf = open(savpath, **mode)
-    ocrf.write(text)
-    ocrf.close()
+        mode = "a" if append == True else "w"
+        dirpath = os.path.split(savpath)[0]
+        
+        self.mode = mode
+        self.txtf = open(savpath, mode)
+        self.tsvpath = os.path.normpath(os.path.join(dirpath, tsvfile))
+        self.tsvf = None
+        self.header = True
+        self.batch = batch
+        self.texts = []
+        self.tables = []
+        
+    def write(self, text, tdf):
+        
+        """
+        
+        Add a page's text and TSV rows. Empty data frames are skipped.
+        
+        """
+        
+        self.texts.append(text)
+        if tdf.shape[0] != 0:
+            self.tables.append(tdf)
+        if len(self.texts) >= self.batch:
+            self.flush()
+            
+    def flush(self):
+        
+        """
+        
+        Write buffered pages to disk.
+        
+        """
+        
+        if len(self.texts) > 0:
+            self.txtf.write("".join(self.texts))
+            self.texts = []
+        
+        if len(self.tables) > 0:
+            import pandas as pandas
+            if self.tsvf is None:
+                self.tsvf = open(self.tsvpath, self.mode)
+                self.header = self.tsvf.tell() == 0
+            pandas.concat(self.tables).to_csv(self.tsvf, index = False, sep = "\t", 
+                                              header = self.header)
+            self.header = False
+            self.tables = []
+            self.tsvf.flush()
+        
+        self.txtf.flush()
+        
+    def close(self):
+        
+        """
+        
+        Flush buffered pages and close the files.
+        
+        """
+        
+        self.flush()
+        self.txtf.close()
+        if self.tsvf is not None:
+            self.tsvf.close()
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+
+def tsvOCR(img, savpath, tsvfile, p = 1, append = True, psm = 1, oem = 3, writer = None):
+    
+    """
+    
+    Run OCR on an image and produce a TSV file along with text. Can limit which 
+    files are added to the TSV by way of binomial sampling.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    img (str, PIL image) : Either the file path of an image or a PIL image object
+    
+    savpath (str)        : The file path to save the text output.
+    
+    tsvfile (str)        : Name of a TSV file that will be produced in the same 
+                           directory as the text output. Ignored if not specified.
+
+    p                    : Probability to use for binomial sampling. If 1, no sample
+                           will be taken.                            
+
+    append (boolean)     : If true, text output is appended to the file specified 
+                           by savpath. If the file does not exist, it will be created.
+                           Note: this argument also applies to the TSV output if a
+                           TSV file is specified.
+    
+    psm (int)            : Tesseract configuration for Page Segmentation Mode. 
+                          https://github.com/tesseract-ocr/tesseract/blob/master/doc/tesseract.1.asc
+                         
+    oem (int)            : Tesseract configuration for OCR Engine mode. 
+                          https://github.com/tesseract-ocr/tesseract/blob/master/doc/tesseract.1.asc 
+    
+    writer (ocrWriter)   : An open ocrWriter for the section. If given, output is
+                           buffered by the writer and savpath, tsvfile and append
+                           are ignored.
+    
+    Returns
+    --------------------------------------------------------------------------
+    (dict) The page record from OCRpage, which includes the page's 
+    readability and mean confidence.
+    
+    """
+    
+    #OCR the page
+    page = OCRpage(img, psm = psm, oem = oem)
+    if type(page) == str:
+        return page
+    
+    writePage(page, savpath, tsvfile, p = p, append = append, writer = writer)
+    
+    return(page)
+
+
+def writePage(page, savpath, tsvfile, p = 1, append = True, writer = None):
+    
+    """
+    
+    Write the text and TSV output for a page record from OCRpage. This is the
+    output half of tsvOCR, for when pages are OCR'd in one place (such as a 
+    worker process) and written in another.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    page (dict)          : A page record from OCRpage.
+    
+    savpath, tsvfile, p, append, writer : See tsvOCR.
+    
+    Returns
+    --------------------------------------------------------------------------
+    none
+    
+    """
     
     #Drop TSV columns we don't need
-    tdf = tdf.drop(columns = ["level", "page_num", "block_num", "par_num", "line_num", "word_num"])
+    tdf = page["words"].drop(columns = ["level", "page_num", "block_num", "par_num", "line_num", "word_num"])
 
     #Sample TSV data    
     if p != 1:
-        samp = random.binomial(size = tdf.count()[0], n = 1, p = p)
+        from numpy import random
+        tdf = tdf[random.binomial(size = tdf.shape[0], n = 1, p = p) == 1]
     
-        r = 0
-        for s in samp:
-            if s == 0:
-                tdf = tdf.drop(r)
-            r += 1    
+    #add a column for the image name
+    tdf = tdf.assign(name = page["name"])
     
-    #if we aren't left with an empty data frame
-    if tdf.count()[0] != 0:
-        
-        #add a column for the image name
-        tdf["name"] = name
-        
-        #determine if a header is needed
-        dirpath = os.path.split(savpath)[0]
-        if append == True and os.path.exists(os.path.normpath(os.path.join(dirpath, tsvfile))) == True:   
-            header = False
+    #write text and TSV data
+    with stage("write"):
+        if writer is None:
+            with ocrWriter(savpath, tsvfile, append = append) as w:
+                w.write(page["text"], tdf)
         else:
-            header = True
-        
-        #write data to TSV file
-        tsvf = open(os.path.normpath(os.path.join(dirpath, tsvfile)), **mode)
-        tdf.to_csv(tsvf, index = False, sep = "\t", header = header)
-        tsvf.close()
+            writer.write(page["text"], tdf)
     
     return
 
+
 class testList():
     
     """
@@ -559,6 +1182,10 @@ class testList():
                                OCR accuracy that have been returned by the 
                                OCRtestImg function.
     
+    strips (dict)            : Strip bounding boxes from getStrips for each
+                               image name, or None. If set, images are scored
+                               with OCRstripImg instead of OCRtestImg.
+    
     Methods
     --------------------------------------------------------------------------    
     
@@ -570,7 +1197,7 @@ class testList():
                                
     """
     
-    def __init__(self, images, results):
+    def __init__(self, images, results, strips = None):
         
         """
         
@@ -584,11 +1211,30 @@ class testList():
                                 dictionaries are records with information about 
                                 OCR accuracy that have been returned by the 
                                 OCRtestImg function.
+        
+        strips (dict)         : Strip bounding boxes from getStrips for each
+                                image name. If None, full pages are scored.
                                 
         """
         
         self.images = images
         self.results = results
+        self.strips = strips
+    
+    
+    def OCRtest(self, img):
+        
+        """
+        
+        Score an image with OCRtestImg, or with OCRstripImg on the image's
+        strips if the testList uses strips.
+        
+        """
+        
+        if self.strips is None:
+            return OCRtestImg(img)
+        else:
+            return OCRstripImg(img, boxes = self.strips[img.info["name"]])
     
     
     def adjustTest(self, test, levels=[0,.25,.5,.75,1]):
@@ -660,7 +1306,7 @@ class testList():
                     
                     #run image test, record unknown tokens
                     name = img.info["name"]
-                    corImg = OCRtestImg(adjustImg(img, **{test: level}))
+                    corImg = self.OCRtest(adjustImg(img, **{test: level}))
                     resultsC.append(len(corImg["unknown_words"]))
                     img.info = {"name" : name}
                     
@@ -682,7 +1328,7 @@ class testList():
                     
                     #run image test, record unknown tokens
                     name = img.info["name"]
-                    corImg = OCRtestImg(adjustImg(img, **{test: state}))
+                    corImg = self.OCRtest(adjustImg(img, **{test: state}))
                     resultsC.append(len(corImg["unknown_words"]))
                     img.info = {"name" : name}                    
                 
@@ -706,6 +1352,7 @@ class testList():
 
         #create table and rename rows
         resultsT["totaltok"] = totaltok
+        import pandas as pandas
         resultsT = pandas.DataFrame(resultsT)
         resultsT = resultsT.rename(index = names)
         
@@ -776,8 +1423,8 @@ class testList():
             img = adjustImg(img, **kwargs)
             img.info = {"name" : name}
             newimgs.append(img)
-            newresults.append(OCRtestImg(img))
+            newresults.append(self.OCRtest(img))
         
         #Return a new testList object
-        testObj = testList(newimgs, newresults)
+        testObj = testList(newimgs, newresults, strips = self.strips)
         return(testObj)
\ No newline at end of file
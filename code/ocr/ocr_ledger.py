@@ -0,0 +1,497 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Job ledger for ocr_use.py.
+
+Keeps a record of every page committed to a section's .txt and _data.tsv
+output in a SQLite file, so an interrupted OCR run can be restarted without
+duplicating or losing pages.
+
+Each page is first written to its own shard files (one .txt and one .tsv),
+which are created under a temporary name and then renamed, so a shard is
+either complete or missing. Shards are then appended to the section
+outputs in page order. The size of the outputs after each append is stored
+in the ledger in the same transaction that marks the page as committed.
+When a section is reopened, anything past the recorded size (a partial
+append from a crash) is cut off before work continues.
+
+Each page is also stored with a fingerprint of its inputs (image checksum,
+margin cuts, image adjustments, tesseract version and config). When the
+inputs change for some pages, only those pages need to be OCR'd again.
+splice() rebuilds the section outputs with the new pages in place of the
+old ones, copying the other pages from the recorded byte ranges. It also
+puts the pages in the section's current page order and drops pages that
+are no longer in it.
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import os
+import sqlite3
+import json
+import hashlib
+
+
+class shardWriter():
+
+    """
+
+    Writes one page's text and TSV rows to shard files. Has the same write
+    method as ocr_func.ocrWriter, so it can be passed to writePage.
+
+    Each file is written under a temporary name and renamed into place, so
+    a shard is never left half written.
+
+    Arguments
+    --------------------------------------------------------------------------
+    shardDir (str)       : Directory for the volume's shards.
+
+    name (str)           : The image name for the page.
+
+    """
+
+    def __init__(self, shardDir, name):
+
+        if os.path.exists(shardDir) == False:
+            os.makedirs(shardDir, exist_ok = True)
+
+        self.shards = (os.path.join(shardDir, name + ".txt"),
+                       os.path.join(shardDir, name + ".tsv"))
+
+    def write(self, text, tdf):
+
+        """
+
+        Write the page's shards.
+
+        """
+
+        txtpath, tsvpath = self.shards
+
+        with open(txtpath + ".tmp", "w", encoding = "utf-8") as f:
+            f.write(text)
+        tdf.to_csv(tsvpath + ".tmp", index = False, sep = "\t", encoding = "utf-8")
+
+        os.replace(txtpath + ".tmp", txtpath)
+        os.replace(tsvpath + ".tmp", tsvpath)
+
+
+class ocrLedger():
+
+    """
+
+    SQLite record of committed pages and section output sizes.
+
+    Attributes
+    --------------------------------------------------------------------------
+
+    path (str)               : File path of the SQLite database.
+
+    Methods
+    --------------------------------------------------------------------------
+
+    openSection              : Cut a section's outputs back to their last
+                               committed size and open them for appending.
+
+    recover                  : Bring a section's outputs back to their last
+                               committed state.
+
+    committed                : Names of pages already committed to a section.
+
+    commit                   : Append a page's shards to its section outputs
+                               and record it.
+
+    splice                   : Rebuild a section's outputs with new versions
+                               of some pages, in a new page order.
+
+    fingerprints             : Input fingerprints of a section's pages.
+
+    sequences                : Recorded positions of a section's pages.
+
+    sections                 : Sections with committed pages in a volume.
+
+    imageHash                : Checksum of an image file.
+
+    pages                    : Committed page records for a volume.
+
+    closeSection             : Close a section's outputs.
+
+    close                    : Close open outputs and the database.
+
+    """
+
+    def __init__(self, path):
+
+        """
+
+        Arguments
+        -----------------------------------------------------------------------
+
+        path (str)            : File path of the SQLite database. Created if
+                                it does not exist.
+
+        """
+
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS outputs (
+                vol TEXT, sec TEXT, txt_size INTEGER, tsv_size INTEGER,
+                pending INTEGER DEFAULT 0,
+                PRIMARY KEY (vol, sec));
+            CREATE TABLE IF NOT EXISTS pages (
+                vol TEXT, sec TEXT, name TEXT, seq INTEGER, status TEXT,
+                txt_start INTEGER, txt_end INTEGER,
+                tsv_start INTEGER, tsv_end INTEGER,
+                token_count INTEGER, unknown_count INTEGER,
+                readability REAL, mean_conf REAL, fingerprint TEXT,
+                PRIMARY KEY (vol, sec, name));
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha1 TEXT);
+            """)
+        self.db.commit()
+        self.files = {}
+
+    def recover(self, vol, sec, txtpath, tsvpath):
+
+        """
+
+        Bring a section's outputs back to their last committed state. A
+        splice that was recorded but not finished is finished, and anything
+        past the committed size is cut off.
+
+        """
+
+        row = self.db.execute("SELECT txt_size, tsv_size, pending FROM outputs WHERE vol = ? AND sec = ?",
+                              (vol, sec)).fetchone()
+        if row is None:
+            row = (0, 0, 0)
+            with self.db:
+                self.db.execute("INSERT INTO outputs VALUES (?, ?, 0, 0, 0)", (vol, sec))
+
+        #a recorded splice is rolled forward; an unrecorded one is dropped
+        for path in (txtpath, tsvpath):
+            if os.path.exists(path + ".splice"):
+                if row[2] == 1:
+                    os.replace(path + ".splice", path)
+                else:
+                    os.remove(path + ".splice")
+        if row[2] == 1:
+            with self.db:
+                self.db.execute("UPDATE outputs SET pending = 0 WHERE vol = ? AND sec = ?", (vol, sec))
+
+        #anything past the committed size was written after the last commit.
+        #A TSV without committed rows is removed, as the section has none yet
+        for path, size in zip((txtpath, tsvpath), row[:2]):
+            if path == tsvpath and size == 0:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            f = open(path, "ab")
+            f.truncate(size)
+            f.close()
+
+    def openSection(self, vol, sec, txtpath, tsvpath):
+
+        """
+
+        Recover a section's outputs and open them for appending. Must be 
+        called before pages are committed to the section. The TSV is only
+        opened once a page has rows for it, so a section without any
+        leaves no empty TSV behind.
+
+        """
+
+        self.recover(vol, sec, txtpath, tsvpath)
+        tsvf = open(tsvpath, "ab") if os.path.exists(tsvpath) else None
+        self.files[(vol, sec)] = [open(txtpath, "ab"), tsvf, tsvpath]
+
+    def committed(self, vol, sec):
+
+        """
+
+        Names of pages already committed to a section.
+
+        """
+
+        rows = self.db.execute("SELECT name FROM pages WHERE vol = ? AND sec = ? AND status = 'committed'",
+                               (vol, sec))
+        return set(r[0] for r in rows)
+
+    def commit(self, vol, sec, seq, page, shards, fingerprint = None):
+
+        """
+
+        Append a page's shards to its section outputs, then record the page
+        and the new output sizes in one transaction. The shards are removed
+        once the page is recorded.
+
+        Arguments
+        --------------------------------------------------------------------------
+
+        vol, sec (str)        : The volume and section type.
+
+        seq (int)             : The page's position in the section.
+
+        page (dict)           : The page's quality stats (name, token_count,
+                                unknown_count, readability, mean_conf).
+
+        shards (tuple)        : File paths of the page's text and TSV shards.
+
+        fingerprint (str)     : Fingerprint of the page's inputs.
+
+        """
+
+        txtf, tsvf, tsvpath = self.files[(vol, sec)]
+
+        with open(shards[0], "rb") as f:
+            text = f.read()
+        with open(shards[1], "rb") as f:
+            tsv = f.read()
+
+        #the TSV is opened by the first page with rows, which keeps the
+        #header; later pages drop theirs
+        rows = tsv[tsv.find(b"\n") + 1:]
+        if tsvf is None and rows != b"":
+            tsvf = open(tsvpath, "ab")
+            self.files[(vol, sec)][1] = tsvf
+        if tsvf is not None and tsvf.tell() != 0:
+            tsv = rows
+
+        txtStart = txtf.tell()
+        tsvStart = 0 if tsvf is None else tsvf.tell()
+        for f, data in ((txtf, text), (tsvf, tsv)):
+            if f is not None:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        txtEnd = txtf.tell()
+        tsvEnd = 0 if tsvf is None else tsvf.tell()
+
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, 'committed', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (vol, sec, page["name"], seq,
+                             txtStart, txtEnd, tsvStart, tsvEnd,
+                             page["token_count"], page["unknown_count"],
+                             page["readability"], page["mean_conf"], fingerprint))
+            self.db.execute("UPDATE outputs SET txt_size = ?, tsv_size = ? WHERE vol = ? AND sec = ?",
+                            (txtEnd, tsvEnd, vol, sec))
+
+        for path in shards:
+            os.remove(path)
+
+    def splice(self, vol, sec, txtpath, tsvpath, pages, names):
+
+        """
+
+        Rebuild a section's outputs with new versions of some pages. Pages 
+        that aren't replaced are copied from their recorded byte ranges in 
+        the old outputs. Pages are written in the order of names and get
+        their position in it as their seq; committed pages that aren't in
+        names are dropped.
+
+        The new outputs are written next to the old ones, recorded in the 
+        ledger, and then renamed into place. If this is interrupted after 
+        the ledger is updated, recover() finishes the renames.
+
+        Arguments
+        --------------------------------------------------------------------------
+
+        vol, sec, txtpath, tsvpath : See openSection.
+
+        pages (list)          : (seq, page, shards, fingerprint) for each new
+                                page. See commit.
+
+        names (list)          : Names of all the section's pages, in page
+                                order.
+
+        """
+
+        self.recover(vol, sec, txtpath, tsvpath)
+
+        new = {page["name"] : (seq, page, shards, fp) for seq, page, shards, fp in pages}
+        old = self.db.execute("""SELECT name, seq, txt_start, txt_end, tsv_start, tsv_end,
+                                 token_count, unknown_count, readability, mean_conf, fingerprint
+                                 FROM pages WHERE vol = ? AND sec = ? AND status = 'committed'""",
+                              (vol, sec)).fetchall()
+
+        old = {r[0] : r for r in old}
+
+        order = [(seq, name, None if name in new else old[name])
+                 for seq, name in enumerate(names) if name in new or name in old]
+
+        #a section without TSV rows yet has no TSV
+        if os.path.exists(tsvpath) == False:
+            open(tsvpath, "wb").close()
+
+        records = []
+        with open(txtpath, "rb") as oldTxt, open(tsvpath, "rb") as oldTsv, \
+             open(txtpath + ".splice", "wb") as txtf, open(tsvpath + ".splice", "wb") as tsvf:
+
+            header = oldTsv.readline()
+
+            for seq, name, row in order:
+
+                if row is not None:
+                    oldTxt.seek(row[2])
+                    text = oldTxt.read(row[3] - row[2])
+                    oldTsv.seek(row[4])
+                    tsv = oldTsv.read(row[5] - row[4])
+                    #the first page in the old output holds the header
+                    if row[4] == 0:
+                        tsv = tsv[tsv.find(b"\n") + 1:]
+                    stats = row[6:10]
+                    fp = row[10]
+                else:
+                    page, shards, fp = new[name][1:]
+                    with open(shards[0], "rb") as f:
+                        text = f.read()
+                    with open(shards[1], "rb") as f:
+                        tsv = f.read()
+                    nl = tsv.find(b"\n") + 1
+                    if header == b"":
+                        header = tsv[:nl]
+                    tsv = tsv[nl:]
+                    stats = (page["token_count"], page["unknown_count"],
+                             page["readability"], page["mean_conf"])
+
+                if tsvf.tell() == 0 and tsv != b"":
+                    tsvf.write(header)
+
+                txtStart = txtf.tell()
+                tsvStart = tsvf.tell()
+                txtf.write(text)
+                tsvf.write(tsv)
+                records.append((vol, sec, name, seq, txtStart, txtf.tell(), tsvStart, tsvf.tell()) 
+                               + tuple(stats) + (fp,))
+
+            for f in (txtf, tsvf):
+                f.flush()
+                os.fsync(f.fileno())
+            txtSize = txtf.tell()
+            tsvSize = tsvf.tell()
+
+        with self.db:
+            self.db.execute("DELETE FROM pages WHERE vol = ? AND sec = ?", (vol, sec))
+            self.db.executemany("INSERT INTO pages VALUES (?, ?, ?, ?, 'committed', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                records)
+            self.db.execute("UPDATE outputs SET txt_size = ?, tsv_size = ?, pending = 1 WHERE vol = ? AND sec = ?",
+                            (txtSize, tsvSize, vol, sec))
+
+        self.recover(vol, sec, txtpath, tsvpath)
+
+        for seq, page, shards, fp in pages:
+            for path in shards:
+                os.remove(path)
+
+    def fingerprints(self, vol, sec):
+
+        """
+
+        Fingerprints of the pages committed to a section, by page name.
+
+        """
+
+        rows = self.db.execute("SELECT name, fingerprint FROM pages WHERE vol = ? AND sec = ? AND status = 'committed'",
+                               (vol, sec))
+        return dict(rows.fetchall())
+
+    def sequences(self, vol, sec):
+
+        """
+
+        Recorded positions (seq) of the pages committed to a section, by page
+        name.
+
+        """
+
+        rows = self.db.execute("SELECT name, seq FROM pages WHERE vol = ? AND sec = ? AND status = 'committed'",
+                               (vol, sec))
+        return dict(rows.fetchall())
+
+    def sections(self, vol):
+
+        """
+
+        Section types with committed pages in a volume.
+
+        """
+
+        rows = self.db.execute("SELECT DISTINCT sec FROM pages WHERE vol = ? AND status = 'committed'", (vol,))
+        return set(r[0] for r in rows)
+
+    def imageHash(self, path):
+
+        """
+
+        SHA-1 checksum of an image file. Checksums are kept in the ledger 
+        and reused while the file's size and modification time are the same.
+
+        """
+
+        st = os.stat(path)
+        row = self.db.execute("SELECT size, mtime, sha1 FROM images WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime:
+            return row[2]
+
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+                            (path, st.st_size, st.st_mtime, h.hexdigest()))
+        return h.hexdigest()
+
+    def pages(self, vol):
+
+        """
+
+        Committed page records for a volume, in section and page order.
+
+        """
+
+        rows = self.db.execute("""SELECT name, sec, token_count, unknown_count, readability, mean_conf
+                                  FROM pages WHERE vol = ? AND status = 'committed'
+                                  ORDER BY sec, seq""", (vol,))
+        keys = ["name", "section", "token_count", "unknown_count", "readability", "mean_conf"]
+        return [dict(zip(keys, r)) for r in rows]
+
+    def closeSection(self, vol, sec):
+
+        """
+
+        Close a section's outputs.
+
+        """
+
+        for f in self.files.pop((vol, sec), [])[:2]:
+            if f is not None:
+                f.close()
+
+    def close(self):
+
+        """
+
+        Close open outputs and the database.
+
+        """
+
+        for key in list(self.files.keys()):
+            self.closeSection(*key)
+        self.db.close()
+
+
+def fingerprint(*parts):
+
+    """
+
+    SHA-1 fingerprint of a page's inputs. Parts can be anything json can 
+    write (numbers from data frames are written as strings if needed).
+
+    """
+
+    return hashlib.sha1(json.dumps(parts, sort_keys = True, default = str).encode("utf-8")).hexdigest()
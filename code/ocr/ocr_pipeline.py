@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Staged thread pipeline for ocr_use.py.
+
+Pages move through a chain of stages (for example: decode, cut and adjust,
+then OCR), each run by its own pool of threads and connected by bounded
+queues. A full queue blocks the stage feeding it, and the number of pages
+in the pipeline at once is capped, so a slow stage holds back the stages
+before it instead of letting prepared images pile up in memory. Results
+are handed back in the order pages went in.
+
+Threads work here because the slow parts release the GIL: PIL decodes
+and transforms images in C, and pytesseract waits on a tesseract
+subprocess.
+
+Each stage keeps track of the time its threads spend working, waiting for
+input and waiting for room in the next queue. A stage that is busy most
+of the time while the others wait is the bottleneck.
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import queue
+import threading
+import time
+
+
+class pipeStage():
+
+    """
+
+    One stage of an ocrPipeline.
+
+    Arguments
+    --------------------------------------------------------------------------
+    name (str)           : Name of the stage, used in the report.
+
+    func (function)      : Function to run on each page. The first stage is
+                           called with the page task, later stages with the
+                           task and the result of the stage before.
+
+    threads (int)        : Number of threads running the stage.
+
+    depth (int)          : Size of the stage's input queue.
+
+    """
+
+    def __init__(self, name, func, threads = 1, depth = 4):
+
+        self.name = name
+        self.func = func
+        self.threads = threads
+        self.inq = queue.Queue(depth)
+        self.lock = threading.Lock()
+        self.items = 0
+        self.busy = 0.0
+        self.waitIn = 0.0
+        self.waitOut = 0.0
+
+    def record(self, busy, waitIn, waitOut):
+
+        with self.lock:
+            self.items += 1
+            self.busy += busy
+            self.waitIn += waitIn
+            self.waitOut += waitOut
+
+
+class ocrPipeline():
+
+    """
+
+    Runs page tasks through a chain of pipeStages.
+
+    Arguments
+    --------------------------------------------------------------------------
+    stages (list)        : pipeStage objects, in the order pages go through.
+
+    window (int)         : Most pages in the pipeline at once, including
+                           finished pages waiting to be handed back in order.
+
+    Methods
+    --------------------------------------------------------------------------
+    run                  : Yield (task, result) pairs in task order.
+
+    report               : Time spent by each stage.
+
+    """
+
+    def __init__(self, stages, window = 16):
+
+        self.stages = stages
+        self.window = window
+        self.outq = queue.Queue()
+        self.elapsed = 0.0
+        self.write = pipeStage("write", None)
+
+    def work(self, n, stage, outq, alive):
+
+        """
+
+        Thread loop for a stage. Items are (index, task, value) tuples. An
+        exception is passed along in place of a value so it can be raised
+        in the main thread.
+
+        """
+
+        first = n == 0
+
+        while True:
+
+            t0 = time.perf_counter()
+            item = stage.inq.get()
+            t1 = time.perf_counter()
+
+            #pass the stop signal to the other threads of this stage. The
+            #last one to stop passes it to the next stage.
+            if item is None:
+                stage.inq.put(None)
+                with stage.lock:
+                    alive[n] -= 1
+                    last = alive[n] == 0
+                if last:
+                    outq.put(None)
+                return
+
+            i, task, value = item
+            if not isinstance(value, Exception):
+                try:
+                    value = stage.func(task) if first else stage.func(task, value)
+                except Exception as e:
+                    value = e
+            t2 = time.perf_counter()
+
+            outq.put((i, task, value))
+            t3 = time.perf_counter()
+
+            stage.record(t2 - t1, t1 - t0, t3 - t2)
+
+    def feed(self, tasks, slots):
+
+        """
+
+        Put tasks into the first stage, waiting for a free slot in the
+        window for each one.
+
+        """
+
+        inq = self.stages[0].inq
+        for i, task in enumerate(tasks):
+            slots.acquire()
+            inq.put((i, task, task))
+        inq.put(None)
+
+    def run(self, tasks):
+
+        """
+
+        Run tasks through the pipeline.
+
+        Arguments
+        --------------------------------------------------------------------------
+        tasks (iterable)     : Page tasks.
+
+        Returns
+        --------------------------------------------------------------------------
+        (generator) (task, result) pairs, in the same order as tasks. If a
+        stage raised an exception for a page, it is raised here when that
+        page comes up.
+
+        """
+
+        start = time.perf_counter()
+        slots = threading.Semaphore(self.window)
+        alive = [s.threads for s in self.stages]
+        threads = [threading.Thread(target = self.feed, args = (tasks, slots), daemon = True)]
+
+        for n, stage in enumerate(self.stages):
+            outq = self.stages[n + 1].inq if n + 1 < len(self.stages) else self.outq
+            for t in range(stage.threads):
+                threads.append(threading.Thread(target = self.work, args = (n, stage, outq, alive),
+                                                daemon = True))
+
+        for t in threads:
+            t.start()
+
+        #hand back results in order, holding any that finish early
+        held = {}
+        nxt = 0
+        done = False
+        while not done:
+
+            t0 = time.perf_counter()
+            item = self.outq.get()
+            t1 = time.perf_counter()
+            self.write.waitIn += t1 - t0
+
+            if item is None:
+                done = True
+            else:
+                held[item[0]] = item
+
+            while nxt in held:
+                i, task, value = held.pop(nxt)
+                nxt += 1
+                slots.release()
+                if isinstance(value, Exception):
+                    raise value
+                t2 = time.perf_counter()
+                yield task, value
+                self.write.record(time.perf_counter() - t2, 0, 0)
+
+        self.elapsed += time.perf_counter() - start
+
+    def report(self):
+
+        """
+
+        Time spent by each stage, as a data frame. Utilization is the share
+        of the stage's available thread time spent working.
+
+        """
+
+        rows = []
+        for stage in self.stages + [self.write]:
+            rows.append({"stage" : stage.name,
+                         "threads" : stage.threads,
+                         "pages" : stage.items,
+                         "busy_s" : round(stage.busy, 2),
+                         "wait_input_s" : round(stage.waitIn, 2),
+                         "wait_output_s" : round(stage.waitOut, 2),
+                         "utilization" : round(stage.busy / (stage.threads * self.elapsed), 3)
+                                         if self.elapsed > 0 else 0})
+        import pandas as pandas
+        return pandas.DataFrame(rows)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Re-OCR low confidence lines.
+
+Finds the lines in a section's _data.tsv output whose mean word confidence
+is below a threshold, crops each one from the cut page, and OCRs the crop
+again with a few alternative image adjustments and page segmentation
+modes. The variant with the highest mean confidence replaces the line's
+words if it beats the original and keeps at least minCoverage of the
+line's characters. Without the coverage check, a variant that drops the
+hard words of a line (or reads only one of them) would win on confidence
+alone. Only the bad lines go through tesseract
+again, so this costs a small fraction of re-running the volume.
+
+Lines are found from the TSV's structure rows. Tesseract writes a row with
+a confidence of -1 for each block, paragraph and line, and a line's row
+comes right before its words and has the line's bounding box. This needs
+TSVs written without sampling (p = 1 in tsvOCR).
+
+Cut pages are read from the cache written by ocr_use.py when cacheCuts is
+on, or cut again from the page image otherwise.
+
+Output is written next to the section TSV as (volume)_(section)_data_repaired.tsv,
+with provenance columns:
+    source      : "ocr" for original rows, "repair" for replaced words
+    repair_adj  : the adjustments used for a replaced line
+    repair_psm  : the page segmentation mode used for a replaced line
+    orig_conf   : the line's mean confidence before repair
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import os
+import json
+import pandas as pandas
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+
+from ocr_func import adjustImg, readTSV, getTesseract
+import ocr_use
+
+#Alternative adjustments to try on low confidence lines. The page's own
+#adjustments are always tried first.
+repairVariants = [{"color" : 0, "autocontrast" : 2},
+                  {"color" : 0, "contrast" : 1.5, "sharpen" : True},
+                  {"color" : 0, "autocontrast" : 1, "smooth" : True},
+                  {"color" : 0, "brightness" : 1.2, "xsmooth" : True}]
+
+#Page segmentation modes to try: single line, single block, raw line
+repairPsms = [7, 6, 13]
+
+#Share of the original line's characters a variant must keep to replace it
+minCoverage = 0.8
+
+
+def readSectionTSV(tsvpath):
+
+    """
+
+    Read a section's _data.tsv output, keeping words like "NA" as text.
+
+    """
+
+    return pandas.read_csv(tsvpath, sep = "\t", keep_default_na = False,
+                           na_values = [""], dtype = {"text" : str})
+
+
+def findLines(tdf):
+
+    """
+
+    Find the lines in TSV output and score them.
+
+    Arguments
+    --------------------------------------------------------------------------
+    tdf (data frame)     : Section TSV output (left, top, width, height, conf,
+                           text and name columns), in the order written.
+
+    Returns
+    --------------------------------------------------------------------------
+    (data frame) One row per line with words: the page name, the line's
+    bounding box, the positions of its first and last word rows in tdf,
+    the number of words and characters and the words' mean confidence.
+
+    """
+
+    struct = (tdf["conf"] == -1).to_numpy()
+    group = struct.cumsum()
+    pos = pandas.RangeIndex(tdf.shape[0])
+
+    #each structure row starts a group. The last structure row before a run
+    #of words is the line's row.
+    words = pandas.DataFrame({"group" : group[~struct],
+                              "pos" : pos[~struct],
+                              "conf" : tdf["conf"].to_numpy()[~struct],
+                              "chars" : tdf["text"].fillna("").astype(str).str.len().to_numpy()[~struct]})
+    lines = words.groupby("group").agg(first = ("pos", "min"),
+                                       last = ("pos", "max"),
+                                       words = ("pos", "size"),
+                                       chars = ("chars", "sum"),
+                                       mean_conf = ("conf", "mean"))
+
+    heads = pandas.Series(pos[struct], index = group[struct])
+    box = tdf.iloc[heads[lines.index].to_numpy()]
+
+    lines["name"] = box["name"].to_numpy()
+    for col in ["left", "top", "width", "height"]:
+        lines[col] = box[col].to_numpy()
+
+    return lines.reset_index(drop = True)
+
+
+def ocrLine(img, box, adjustments, psm, pad = 8):
+
+    """
+
+    OCR one line from a cut page.
+
+    Arguments
+    --------------------------------------------------------------------------
+    img (PIL image)      : The cut page, before adjustments.
+
+    box (tuple)          : (left, top, width, height) of the line.
+
+    adjustments (dict)   : Arguments for adjustImg.
+
+    psm (int)            : Tesseract page segmentation mode.
+
+    pad (int)            : Pixels to add around the line.
+
+    Returns
+    --------------------------------------------------------------------------
+    (tuple) The word rows, with coordinates on the page, and their mean
+    confidence (-1 if no words were found).
+
+    """
+
+    left, top, width, height = box
+    x0 = max(left - pad, 0)
+    y0 = max(top - pad, 0)
+    crop = img.crop((x0, y0, min(left + width + pad, img.width), min(top + height + pad, img.height)))
+    crop.info = {"name" : img.info.get("name", "")}
+
+    crop = adjustImg(crop, **adjustments)
+    tdf = readTSV(getTesseract().image_to_data(crop, config = "--psm " + str(psm) + " --oem 3"))
+
+    words = tdf[(tdf["conf"] >= 0) & tdf["text"].notna()]
+    words = words[["left", "top", "width", "height", "conf", "text"]].copy()
+    words["left"] += x0
+    words["top"] += y0
+
+    if words.shape[0] == 0:
+        return words, -1
+    return words, float(words["conf"].mean())
+
+
+def repairPage(job):
+
+    """
+
+    Re-OCR the low confidence lines of one page. Runs in a worker process.
+
+    Arguments
+    --------------------------------------------------------------------------
+    job (dict)           : "task" (page task from ocr_use.getTasks), "cut"
+                           (path to the cached cut page, or None) and "lines"
+                           (records from findLines).
+
+    Returns
+    --------------------------------------------------------------------------
+    (list) (line, words, adjustments, psm) for each line that was improved:
+    the variant with the highest mean confidence among those that keep
+    minCoverage of the line's characters, if it beats the original.
+
+    """
+
+    task = job["task"]
+    if job["cut"] is not None and os.path.exists(job["cut"]):
+        img = Image.open(job["cut"])
+        img.info = {"name" : task["name"]}
+    else:
+        img = ocr_use.cutPage(task)
+
+    variants = [task["adjustments"]] + repairVariants
+
+    fixes = []
+    for line in job["lines"]:
+        box = (line["left"], line["top"], line["width"], line["height"])
+        best = (None, line["mean_conf"], None, None)
+        for adjustments in variants:
+            for psm in repairPsms:
+                words, conf = ocrLine(img, box, adjustments, psm)
+                if words["text"].astype(str).str.len().sum() < minCoverage * line["chars"]:
+                    continue
+                if conf > best[1]:
+                    best = (words, conf, adjustments, psm)
+        if best[0] is not None:
+            fixes.append((line, best[0], best[2], best[3]))
+
+    return fixes
+
+
+def spliceRepairs(tdf, fixes):
+
+    """
+
+    Replace the words of repaired lines in TSV output and add provenance
+    columns.
+
+    Arguments
+    --------------------------------------------------------------------------
+    tdf (data frame)     : Section TSV output.
+
+    fixes (list)         : Results from repairPage.
+
+    Returns
+    --------------------------------------------------------------------------
+    (data frame) The TSV output with repaired lines, in the original order.
+
+    """
+
+    tdf = tdf.assign(source = "ocr", repair_adj = "", repair_psm = pandas.NA, orig_conf = pandas.NA)
+    tdf["order"] = range(tdf.shape[0])
+
+    drop = []
+    parts = []
+    for line, words, adjustments, psm in fixes:
+        drop.extend(range(line["first"], line["last"] + 1))
+        #place the new words where the old ones were
+        parts.append(words.assign(name = line["name"],
+                                  source = "repair",
+                                  repair_adj = json.dumps(adjustments, sort_keys = True, default = str),
+                                  repair_psm = psm,
+                                  orig_conf = round(line["mean_conf"], 3),
+                                  order = line["first"] + (pandas.RangeIndex(words.shape[0]) + 1) / (words.shape[0] + 1)))
+
+    parts.insert(0, tdf.drop(index = tdf.index[drop]))
+    out = pandas.concat(parts, ignore_index = True).sort_values("order", kind = "stable")
+
+    return out.drop(columns = "order")[list(tdf.columns.drop("order"))].reset_index(drop = True)
+
+
+def repairSection(vol, sec, tasks, threshold = 60, minWords = 2, executor = None):
+
+    """
+
+    Re-OCR the low confidence lines of a section and write the repaired TSV.
+
+    Arguments
+    --------------------------------------------------------------------------
+    vol, sec (str)       : The volume and section type.
+
+    tasks (dict)         : Page tasks from ocr_use.getTasks, by page name.
+
+    threshold (float)    : Lines with a mean word confidence below this are
+                           re-OCR'd.
+
+    minWords (int)       : Lines with fewer words are skipped. Single
+                           characters and stray marks often score low and
+                           aren't worth repairing.
+
+    executor (Executor)  : If given, pages are repaired in parallel.
+
+    Returns
+    --------------------------------------------------------------------------
+    (data frame) A summary of the repair: lines checked, lines re-OCR'd and
+    lines improved.
+
+    """
+
+    tsvpath = ocr_use.sectionFiles(vol, sec)[1]
+    tdf = readSectionTSV(tsvpath)
+    lines = findLines(tdf)
+    low = lines[(lines["mean_conf"] < threshold) & (lines["words"] >= minWords)]
+
+    jobs = []
+    for name, pdf in low.groupby("name", sort = False):
+        cut = os.path.normpath(os.path.join(ocr_use.outDir, vol, "cuts", os.path.splitext(name)[0] + ".png"))
+        jobs.append({"task" : tasks[name], "cut" : cut, "lines" : pdf.to_dict("records")})
+
+    mapper = map if executor is None else executor.map
+    fixes = [fix for page in mapper(repairPage, jobs) for fix in page]
+
+    out = spliceRepairs(tdf, fixes)
+    out.to_csv(tsvpath[:-4] + "_repaired.tsv", index = False, sep = "\t")
+
+    return pandas.DataFrame([{"volume" : vol, "section" : sec, "lines" : lines.shape[0],
+                              "reocr" : low.shape[0], "improved" : len(fixes)}])
+
+
+def main():
+
+    #Read csvs and build page tasks the same way as ocr_use.py
+    mastercsv = pandas.read_csv(ocr_use.masterlist)
+    margcsv = pandas.read_csv(ocr_use.margdata)
+    adjcsv = pandas.read_csv(ocr_use.adjdata)
+
+    mastercsv["volume"] = mastercsv["filename"].str.split("_").str[0]
+    mastercsv["filename"] = mastercsv["filename"] + ".jp2"
+    mcsv = mastercsv.merge(margcsv, left_on="filename", right_on="file")
+    fcsv = mcsv.merge(adjcsv, on = "volume", how = "right")
+
+    tasks = ocr_use.getTasks(fcsv)
+    sections = {}
+    for task in tasks:
+        sections.setdefault((task["vol"], task["sec"]), {})[task["name"]] = task
+
+    summary = []
+    with ProcessPoolExecutor(max_workers = ocr_use.workers, initializer = ocr_use.initWorker,
+                             initargs = (ocr_use.ompThreads, False, ocr_use.memBudget)) as executor:
+        for (vol, sec), secTasks in sections.items():
+            if os.path.exists(ocr_use.sectionFiles(vol, sec)[1]):
+                summary.append(repairSection(vol, sec, secTasks, executor = executor))
+
+    print(pandas.concat(summary).to_string(index = False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Score readability for existing OCR output.
+
+Readability is normally scored while a page is OCR'd (see scoreText in
+ocr_func.py). This script scores output that is already on disk, so the
+corpus can be re-scored (for example after a word list changes) without
+running OCR again.
+
+Every (volume)_(section)_data.tsv file under the output directory is read
+and scored by page, using the name column. Sections with only a .txt file
+are scored as a single page. Files are scored in parallel, one file per
+process.
+
+Scores follow scoreText: tokens are runs of letters, words split by a
+hyphen at the end of a line are joined, and a page's unknown count is the
+number of distinct words not in the word list (see lexicon.py).
+Readability is 100 minus the unknown count as a percentage of tokens.
+Section and volume scores add up the page counts.
+
+Output is written to the output directory as ocr_scores_pages.tsv,
+ocr_scores_sections.tsv and ocr_scores_volumes.tsv.
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import os
+import re
+import glob
+import pandas as pandas
+from multiprocessing import Pool
+
+from lexicon import loadLexicon
+
+#Set up locations
+outDir = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/output/"
+workers = os.cpu_count()
+
+#a token is a run of letters that isn't joined to digits, underscores or
+#a hyphenated word, like a token from nltk's word_tokenize that passes 
+#isalpha(). Initials ("W.") are left out, as word_tokenize keeps their 
+#periods.
+tokenPattern = re.compile(r"(?<!\w)(?<!\w-)(?:[^\W\d_]{2,}|[^\W\d_](?!\.))(?!\w)(?!-\w)")
+
+known = None
+
+
+def initScorer():
+
+    """
+
+    Load the word list once in each worker process.
+
+    """
+
+    global known
+    known = pandas.Index(list(loadLexicon().keys()))
+
+
+def scoreTokens(tokens, names):
+
+    """
+
+    Score the tokens of each page.
+
+    Arguments
+    --------------------------------------------------------------------------
+    tokens (data frame)  : "name" and "token" columns, one row per token.
+
+    names (list)         : Names of all the pages, in order. Pages without
+                           tokens get a token_count of 0.
+
+    Returns
+    --------------------------------------------------------------------------
+    (data frame) token_count and unknown_count by page name.
+
+    """
+
+    tokens = tokens.assign(unknown = ~tokens["token"].str.lower().isin(known))
+
+    pages = tokens.groupby("name", sort = False).agg(token_count = ("token", "size"))
+    pages = pages.reindex(pandas.Index(names, name = "name"), fill_value = 0)
+    unknown = tokens[tokens["unknown"]]
+    pages["unknown_count"] = (unknown.assign(token = unknown["token"].str.lower())
+                              .groupby("name", sort = False)["token"].nunique())
+    pages["unknown_count"] = pages["unknown_count"].fillna(0).astype(int)
+
+    return pages.reset_index()
+
+
+def readability(df):
+
+    """
+
+    Add a readability column to a data frame of token and unknown counts.
+
+    """
+
+    df = df.assign(readability = (100 - df["unknown_count"] / df["token_count"] * 100).round(3))
+    df.loc[df["unknown_count"] == 0, "readability"] = 100
+    return df
+
+
+def tsvTokens(path):
+
+    """
+
+    Tokenize a section's _data.tsv output. Returns the tokens and the names
+    of all the pages, including those without words.
+
+    Word rows are in reading order, and tesseract's structure rows (conf of
+    -1) mark where each line starts. A word ending in a hyphen is joined
+    to the first word of the next line.
+
+    """
+
+    tdf = pandas.read_csv(path, sep = "\t", usecols = ["conf", "text", "name"],
+                          keep_default_na = False, na_values = [""], dtype = {"text" : str})
+
+    struct = tdf["conf"] == -1
+    block = struct.cumsum()
+    keep = tdf["text"].notna() & ~struct
+    words = tdf.loc[keep, ["text", "name"]].reset_index(drop = True)
+    block = block[keep].reset_index(drop = True)
+
+    #join words split across lines
+    nextText = words["text"].shift(-1, fill_value = "")
+    joined = (words["text"].str.endswith("-")
+              & (block.shift(-1) != block)
+              & (words["name"].shift(-1) == words["name"]))
+    cont = joined.shift(1, fill_value = False)
+    words.loc[joined, "text"] = words.loc[joined, "text"].str[:-1] + nextText[joined]
+    words = words[~cont]
+
+    tokens = words.assign(token = words["text"].str.findall(tokenPattern)).explode("token")
+    return tokens.loc[tokens["token"].notna(), ["name", "token"]], list(tdf["name"].unique())
+
+
+def txtTokens(path):
+
+    """
+
+    Tokenize a section's .txt output as one page. Returns the tokens and the
+    page name.
+
+    """
+
+    with open(path, encoding = "utf-8", errors = "replace") as f:
+        text = f.read().replace("-\n", "")
+
+    name = os.path.basename(path)
+    return pandas.DataFrame({"name" : name, "token" : tokenPattern.findall(text)}), [name]
+
+
+def scoreFile(path):
+
+    """
+
+    Score one output file by page. Runs in a worker process.
+
+    """
+
+    if path.endswith("_data.tsv"):
+        tokens, names = tsvTokens(path)
+        sec = os.path.basename(path)[:-len("_data.tsv")]
+    else:
+        tokens, names = txtTokens(path)
+        sec = os.path.basename(path)[:-len(".txt")]
+
+    pages = scoreTokens(tokens, names)
+    vol, sec = sec.split("_", 1)
+    return pages.assign(volume = vol, section = sec)
+
+
+def findOutput(root):
+
+    """
+
+    Find output files to score: each section's _data.tsv, or its .txt if
+    there is no TSV.
+
+    """
+
+    files = []
+    for vdir in sorted(glob.glob(os.path.join(root, "*", ""))):
+        vol = os.path.basename(os.path.normpath(vdir))
+        tsvs = glob.glob(os.path.join(vdir, vol + "_*_data.tsv"))
+        files.extend(sorted(tsvs))
+        for txt in sorted(glob.glob(os.path.join(vdir, vol + "_*.txt"))):
+            if txt[:-4] + "_data.tsv" not in tsvs and not txt.endswith("_adjustments.txt"):
+                files.append(txt)
+
+    return files
+
+
+def main():
+
+    files = findOutput(outDir)
+
+    with Pool(workers, initializer = initScorer) as pool:
+        pages = pandas.concat(pool.imap(scoreFile, files, chunksize = 1), ignore_index = True)
+
+    pages = readability(pages[["volume", "section", "name", "token_count", "unknown_count"]])
+    sections = readability(pages.groupby(["volume", "section"], as_index = False)
+                           [["token_count", "unknown_count"]].sum())
+    volumes = readability(pages.groupby("volume", as_index = False)
+                          [["token_count", "unknown_count"]].sum())
+
+    pages.to_csv(os.path.join(outDir, "ocr_scores_pages.tsv"), index = False, sep = "\t")
+    sections.to_csv(os.path.join(outDir, "ocr_scores_sections.tsv"), index = False, sep = "\t")
+    volumes.to_csv(os.path.join(outDir, "ocr_scores_volumes.tsv"), index = False, sep = "\t")
+
+    print(volumes.to_string(index = False))
+
+
+if __name__ == "__main__":
+    main()
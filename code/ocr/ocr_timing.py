@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-stage timing for the OCR functions.
+
+Stages in ocr_func.py (image decode, rotate, crop, each adjustImg step,
+tesseract, TSV parsing, scoring and writing) are wrapped in stage() timers.
+Times are collected into a histogram for each volume and stage, which can
+be saved as a CSV or as a Prometheus textfile.
+
+Timing is off by default. When it is off, stage() returns a shared
+do-nothing context, so the timers cost next to nothing. When it is on, each
+timer costs about a microsecond, against page stages that take from
+milliseconds to seconds.
+
+Usage:
+
+    import ocr_timing
+    ocr_timing.enable()
+    ocr_timing.setVolume("lawsresolutionso1891nort")
+    ...run OCR functions...
+    ocr_timing.toCSV("timing.csv")
+
+Worker processes keep their own timings. Send them back with snapshot()
+and add them to the main process with merge().
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import os
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext
+from time import perf_counter
+
+#upper bounds of the histogram buckets in seconds. The last bucket has no
+#upper bound.
+buckets = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+enabled = False
+timings = {}
+lock = threading.Lock()
+local = threading.local()
+noTimer = nullcontext()
+
+
+class stageTimer():
+
+    """
+
+    Context manager that adds its run time to the histogram for a stage.
+
+    """
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        add(self.name, perf_counter() - self.start)
+
+
+def stage(name):
+
+    """
+
+    Time a stage:
+
+        with stage("tesseract"):
+            ...
+
+    Returns a do-nothing context if timing is not enabled.
+
+    """
+
+    if enabled == False:
+        return noTimer
+    return stageTimer(name)
+
+
+def enable(on = True):
+
+    """
+
+    Turn timing on or off.
+
+    """
+
+    global enabled
+    enabled = on
+
+
+def setVolume(volume):
+
+    """
+
+    Set the volume that timings in the current thread are recorded under.
+
+    """
+
+    local.volume = volume
+
+
+def add(name, seconds):
+
+    """
+
+    Add a time to the histogram for a stage in the current volume.
+
+    """
+
+    key = (getattr(local, "volume", ""), name)
+    with lock:
+        rec = timings.get(key)
+        if rec is None:
+            rec = timings[key] = [0, 0.0, [0] * (len(buckets) + 1)]
+        rec[0] += 1
+        rec[1] += seconds
+        rec[2][bisect_left(buckets, seconds)] += 1
+
+
+def snapshot(clear = True):
+
+    """
+
+    Return the timings collected so far, for sending from a worker process
+    to merge(). Timings are cleared unless clear is False, so the same times
+    aren't sent twice.
+
+    """
+
+    global timings
+    with lock:
+        snap = timings
+        if clear == True:
+            timings = {}
+        else:
+            snap = {k : [v[0], v[1], list(v[2])] for k, v in snap.items()}
+    return snap
+
+
+def merge(snap):
+
+    """
+
+    Add timings from snapshot() to the timings in this process.
+
+    """
+
+    with lock:
+        for key, (count, total, hist) in snap.items():
+            rec = timings.get(key)
+            if rec is None:
+                timings[key] = [count, total, list(hist)]
+            else:
+                rec[0] += count
+                rec[1] += total
+                rec[2] = [a + b for a, b in zip(rec[2], hist)]
+
+
+def summary():
+
+    """
+
+    Timings as a data frame with one row per volume and stage: the count,
+    total and mean seconds, and the count in each histogram bucket.
+
+    """
+
+    rows = []
+    with lock:
+        for (volume, name), (count, total, hist) in sorted(timings.items()):
+            row = {"volume" : volume,
+                   "stage" : name,
+                   "count" : count,
+                   "total_s" : round(total, 4),
+                   "mean_s" : round(total / count, 4)}
+            for b, n in zip(buckets + ["inf"], hist):
+                row["le_" + str(b)] = n
+            rows.append(row)
+    import pandas as pandas
+    return pandas.DataFrame(rows)
+
+
+def toCSV(path):
+
+    """
+
+    Save timings as a CSV file (see summary).
+
+    """
+
+    summary().to_csv(path, index = False)
+
+
+def toProm(path, metric = "ocr_stage_seconds"):
+
+    """
+
+    Save timings as a Prometheus textfile, with a histogram for each volume
+    and stage.
+
+    """
+
+    lines = ["# HELP " + metric + " Time spent in each OCR stage.",
+             "# TYPE " + metric + " histogram"]
+
+    with lock:
+        for (volume, name), (count, total, hist) in sorted(timings.items()):
+            labels = 'volume="{}",stage="{}"'.format(volume, name)
+            cum = 0
+            for b, n in zip(buckets + ["+Inf"], hist):
+                cum += n
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(metric, labels, b, cum))
+            lines.append("{}_sum{{{}}} {}".format(metric, labels, round(total, 6)))
+            lines.append("{}_count{{{}}} {}".format(metric, labels, count))
+
+    #write to a temporary file first so a scraper never reads half a file
+    with open(path + ".tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
@@ -11,95 +11,535 @@ UNC Chapel Hill
 """
 
 import os, sys
-import pandas as pandas
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 #get ocr functions
 sys.path.insert(0, "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/OCR/")
-from ocr_func import cutMarg, adjustImg, tsvOCR
+from ocr_func import cutMarg, adjustImg, OCRpage, writePage, getTesseract
+from ocr_ledger import ocrLedger, shardWriter, fingerprint
+from ocr_pipeline import ocrPipeline, pipeStage
+import ocr_timing
 
 #Set up locations
 masterlist = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/xmljpegmerge_official.csv"
 margdata = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/marginalia_metadata_part2_fix.csv"
 adjdata = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/adjustments_fixed.csv"
-rootImgDir = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/1865-1968 jp2 files/"        
+rootImgDir = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/1865-1968 jp2 files/"
 outDir = "/Users/tuesday/Documents/_Projects/Research/OnTheBooks/output/"
+ledgerFile = os.path.join(outDir, "ocr_ledger.sqlite")
+
+#Set up workers
+runner = "process"              #"process" for a process pool, "pipeline" for staged threads,
+                                #"queue" for workers on other machines (see workqueue.py)
+queueDir = None                 #shared work queue directory ("queue" only; outDir must be shared too)
+workers = os.cpu_count()        #number of pages OCR'd at once
+prefetch = 2                    #threads decoding and adjusting images ("pipeline" only)
+ompThreads = 1                  #threads per tesseract process
+window = 4                      #pages queued ahead per worker
+memBudget = None                #bytes of address space each worker process may add to what it has
+                                #at startup, or None (Linux only; see initWorker)
+tessConfig = {"psm" : 1, "oem" : 3}   #tesseract settings for OCRpage
+grayscale = True                #keep pages in 8-bit grayscale when the volume's color is 0
+binarize = 0                    #threshold for black and white pages (1-255), or 0 to keep grays
+cacheCuts = False               #save cut pages to outDir/(volume)/cuts for ocr_repair.py
+planOnly = False                #only report which pages would be OCR'd
+timing = False                  #record per-stage timings (saved to outDir as ocr_timing.csv/.prom)
+
+
+def initWorker(threads, timed = False, memory = None):
+
+    """
+
+    Limit the threads used by each tesseract process started from a worker.
+    One single-threaded tesseract per core is faster overall than several
+    workers each trying to use every core.
+
+    If memory is given, the worker's address space (RLIMIT_AS) is limited
+    to what it has reserved at startup plus that many bytes, so a page that
+    needs more fails with a MemoryError instead of pushing the machine into
+    swap. This caps address space, not resident memory: libraries, thread
+    stacks and malloc arenas reserve much more than they use, so the cap
+    counts from the worker's size at startup and memory is roughly what one
+    page's images and results may take. The tesseract processes a worker
+    starts get the same limit, which leaves them more room as they start
+    out smaller.
+
+    """
+
+    os.environ["OMP_THREAD_LIMIT"] = str(threads)
+    ocr_timing.enable(timed)
+
+    if memory is not None:
+        import resource
+        limit = addressSpace() + memory
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def addressSpace():
+
+    """
+
+    Address space (bytes) this process has reserved, or 0 where it isn't 
+    known (outside Linux).
+
+    """
+
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmSize:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def cutPage(task):
+
+    """
+
+    Decode and cut one page image. Black and white pages stay single 
+    channel from decode to OCR.
+
+    """
+
+    if grayscale == True and (task["adjustments"]["color"] == 0 or binarize != 0):
+        return cutMarg(task["img"], mode = "L", **task["cuts"])
+    return cutMarg(task["img"], **task["cuts"])
+
+
+def prepPage(task):
+
+    """
+
+    Decode, cut and adjust one page image.
+
+    """
+
+    ocr_timing.setVolume(task["vol"])
+    img = cutPage(task)
+
+    #keep the cut page for re-OCR of low confidence lines (see ocr_repair.py)
+    if cacheCuts == True:
+        cutDir = os.path.normpath(os.path.join(outDir, task["vol"], "cuts"))
+        os.makedirs(cutDir, exist_ok = True)
+        img.save(os.path.join(cutDir, os.path.splitext(task["name"])[0] + ".png"))
+
+    return adjustImg(img, **task["adjustments"])
+
+
+def ocrPrepared(task, img):
+
+    """
+
+    OCR a prepared page image and write it to shard files, so the main 
+    process only has to append them to the section's output.
+
+    Returns
+    --------------------------------------------------------------------------
+    (dict) The page's quality stats from OCRpage and the paths of its shards.
+
+    """
+
+    ocr_timing.setVolume(task["vol"])
+    page = OCRpage(img, **tessConfig)
+
+    shards = shardWriter(os.path.normpath(os.path.join(outDir, task["vol"], "shards")), page["name"])
+    writePage(page, savpath = None, tsvfile = None, writer = shards)
+
+    return {"name" : page["name"],
+            "token_count" : page["token_count"],
+            "unknown_count" : page["unknown_count"],
+            "readability" : page["readability"],
+            "mean_conf" : page["mean_conf"],
+            "shards" : shards.shards}
+
+
+def ocrPage(task):
+
+    """
+
+    Decode, cut, adjust and OCR one page, and write it to shard files. Runs
+    in a worker process.
+
+    Arguments
+    --------------------------------------------------------------------------
+    task (dict)          : Page task from getTasks.
+
+    Returns
+    --------------------------------------------------------------------------
+    (dict) See ocrPrepared, with the worker's timings added if timing is on.
+
+    """
+
+    result = ocrPrepared(task, prepPage(task))
+    if ocr_timing.enabled == True:
+        result["timing"] = ocr_timing.snapshot()
+    return result
+
+
+def queuePage(task):
+
+    """
+
+    OCR a page task taken from a shared work queue (see workqueue.py). The 
+    task has been through json, which turns the background color into a 
+    list.
+
+    """
+
+    task["cuts"]["bkgcol"] = tuple(task["cuts"]["bkgcol"])
+    return ocrPage(task)
+
+
+def queueTask(queue, task):
+
+    """
+
+    Put a page task in a shared work queue and return its id. A finished
+    task whose shards are gone was already committed by an earlier run
+    (the fingerprint has changed back, or the ledger or outDir was reset),
+    so it is taken out of the queue and run again.
+
+    """
+
+    tid = os.path.splitext(task["name"])[0] + "_" + task["fingerprint"][:16]
+    result = queue.result(tid)
+    if result is not None and not all(os.path.exists(path) for path in result["shards"]):
+        queue.remove(tid)
+    return queue.put("ocr", task, tid = tid)
+
+
+def orderedMap(executor, func, tasks, ahead):
+
+    """
+
+    Like executor.map, but only keeps a limited number of tasks in flight
+    so results don't pile up in memory ahead of the writer. Results are
+    yielded in the same order as tasks.
+
+    """
+
+    pending = deque()
+    for task in tasks:
+        pending.append((task, executor.submit(func, task)))
+        if len(pending) >= ahead:
+            task, future = pending.popleft()
+            yield task, future.result()
+    while pending:
+        task, future = pending.popleft()
+        yield task, future.result()
+
+
+def getTasks(fcsv):
+
+    """
+
+    Create a page task for every page, in volume, section and page order.
+
+    Arguments
+    --------------------------------------------------------------------------
+    fcsv (data frame)    : Merged page, marginalia and adjustment metadata.
+
+    Returns
+    --------------------------------------------------------------------------
+    (list) A list of page task dictionaries.
+
+    """
+
+    tasks = []
+
+    for vol, voldf in fcsv.groupby("volume"):
+        for sec, secsdf in voldf.groupby("sectiontype"):
+            for seq, row in enumerate(secsdf.itertuples()):
+
+                #set up margin cutting
+                cuts = {"rotate" : row.angle,
+                        "left" : row.bbox1,
+                        "up" : row.bbox2,
+                        "right" : row.bbox3,
+                        "lower" : row.bbox4,
+                        "border" : 200,
+                        "bkgcol" : (row.backR, row.backG, row.backB)}
+
+                #set up image adjustment
+                adjustments = {"color": row.color,
+                               "autocontrast": row.autocontrast,
+                               "blur": row.blur,
+                               "sharpen": row.sharpen,
+                               "smooth": row.smooth,
+                               "xsmooth": row.xsmooth}
+                if binarize != 0:
+                    adjustments["binarize"] = binarize
+
+                tasks.append({"vol" : vol,
+                              "sec" : sec,
+                              "seq" : seq,
+                              "name" : row.file,
+                              "img" : os.path.normpath(os.path.join(rootImgDir, vol + "_jp2", row.file)),
+                              "cuts" : cuts,
+                              "adjustments" : adjustments})
+
+    return tasks
+
+
+def planTasks(tasks, ledger):
+
+    """
+
+    Find the pages that need to be OCR'd. Each task gets a fingerprint of 
+    its inputs: the image checksum, margin cuts, image adjustments and the
+    tesseract version and config. A page is OCR'd if it hasn't been 
+    committed yet, or if it was committed with a different fingerprint.
+
+    New pages can only be appended to a section after its committed pages.
+    A section is spliced instead if it has changed pages, new pages before
+    committed ones, committed pages that moved or are no longer in the
+    metadata. Sections of a volume that are no longer in its metadata at all
+    are spliced to nothing.
+
+    Arguments
+    --------------------------------------------------------------------------
+    tasks (list)         : Page tasks from getTasks.
+
+    ledger (ocrLedger)   : The job ledger.
+
+    Returns
+    --------------------------------------------------------------------------
+    (tuple) The tasks to run, and a dictionary of the (volume, section) 
+    pairs to splice rather than append to, with the names of each one's
+    pages in page order.
+
+    """
+
+    engine = [str(getTesseract().get_tesseract_version()), tessConfig]
+
+    todo = []
+    spliced = {}
+    counts = {}
+    fps = {}
+    seqs = {}
+    names = {}
+    firstNew = {}
+    lastOld = {}
+
+    for task in tasks:
+
+        key = (task["vol"], task["sec"])
+        if key not in fps:
+            fps[key] = ledger.fingerprints(*key)
+            seqs[key] = ledger.sequences(*key)
+            names[key] = []
+            counts[key] = {"new" : 0, "changed" : 0, "unchanged" : 0, "removed" : 0}
+        names[key].append(task["name"])
+
+        task["fingerprint"] = fingerprint(ledger.imageHash(task["img"]), task["cuts"],
+                                          task["adjustments"], engine)
+        old = fps[key].get(task["name"])
+
+        if old is None:
+            counts[key]["new"] += 1
+            firstNew.setdefault(key, task["seq"])
+        else:
+            lastOld[key] = task["seq"]
+            #committed pages keep their place only if nothing before them moved
+            if seqs[key][task["name"]] != task["seq"]:
+                spliced[key] = names[key]
+            if old != task["fingerprint"]:
+                counts[key]["changed"] += 1
+                spliced[key] = names[key]
+            else:
+                counts[key]["unchanged"] += 1
+                continue
+        todo.append(task)
+
+    for key in fps:
+        removed = set(fps[key]) - set(names[key])
+        counts[key]["removed"] = len(removed)
+        #new pages can't be appended before committed ones
+        if len(removed) > 0 or (key in firstNew and firstNew[key] < lastOld.get(key, -1)):
+            spliced[key] = names[key]
+
+    #sections with committed pages that are no longer in the metadata
+    for vol in set(k[0] for k in fps):
+        for sec in ledger.sections(vol):
+            if (vol, sec) not in fps:
+                counts[(vol, sec)] = {"new" : 0, "changed" : 0, "unchanged" : 0,
+                                      "removed" : len(ledger.fingerprints(vol, sec))}
+                spliced[(vol, sec)] = []
+
+    import pandas as pandas
+    print(pandas.DataFrame([dict(volume = k[0], section = k[1], **v) for k, v in counts.items()])
+          .to_string(index = False))
+
+    return todo, spliced
+
+
+def sectionFiles(vol, sec):
+
+    """
+
+    File paths of a section's text and TSV output.
+
+    """
+
+    return (os.path.normpath(os.path.join(outDir, vol, vol + "_" + sec + ".txt")),
+            os.path.normpath(os.path.join(outDir, vol, vol + "_" + sec + "_data.tsv")))
+
+
+def startVolume(vol, adjustments):
+
+    """
+
+    Create the volume's output folder and record its image adjustments.
+
+    """
 
-#Read csvs
-mastercsv = pandas.read_csv(masterlist)
-margcsv = pandas.read_csv(margdata)
-adjcsv = pandas.read_csv(adjdata)
-
-#Create column for volume
-for index, row in mastercsv.iterrows():
-    volume = row["filename"].split("_")[0]
-    mastercsv.at[index, "volume"] = volume  
-
-#Merge csvs
-mastercsv["filename"] = mastercsv["filename"] + ".jp2" 
-mcsv = mastercsv.merge(margcsv, left_on="filename", right_on="file")
-fcsv = mcsv.merge(adjcsv, on = "volume", how = "right")
-
-#get separate volumes
-volsGrouped = fcsv.groupby("volume")
-vols = volsGrouped.groups.keys()
-
-#loop through volumes
-for vol in vols:
-    
-    print("")
-    
     #create a folder for the volume in the output directory if it doesn't already exist
     newdir = os.path.normpath(os.path.join(outDir, vol))
     if os.path.exists(newdir) == False:
         os.mkdir(newdir)
-    
-    #select rows for volume
-    voldf = volsGrouped.get_group(vol)
-    
-    #get separate section types
-    secsGrouped = voldf.groupby("sectiontype")
-    secs = secsGrouped.groups.keys()
-    
-    #create seperate OCR files for each section
-    for sec in secs:
-            
-        #select rows for section type
-        secsdf = secsGrouped.get_group(sec)
-
-        print(datetime.now().strftime("%H:%M") + " Processing " + vol + " " + sec + "...")
-        
-        #Loop through section
-        for row in secsdf.itertuples():
-            
-            img = os.path.normpath(os.path.join(rootImgDir, vol + "_jp2", row.file))
-            
-            #set up margin cutting
-            cuts = {"rotate" : row.angle,
-                    "left" : row.bbox1,
-                    "up" : row.bbox2,
-                    "right" : row.bbox3,
-                    "lower" : row.bbox4,
-                    "border" : 200,
-                    "bkgcol" : (row.backR, row.backG, row.backB)}
-            
-            #set up image adjustment            
-            adjustments = {"color": row.color, 
-                           "autocontrast": row.autocontrast,
-                           "blur": row.blur,
-                           "sharpen": row.sharpen,
-                           "smooth": row.smooth,
-                           "xsmooth": row.xsmooth}
-            
-            #Record image adjustments
-            adjf = open(os.path.normpath(os.path.join(outDir, vol, vol + "_adjustments.txt")), "w")
-            adjf.write("IMAGE ADJUSTMENTS\n\n")
-            for key, value in adjustments.items():
-                adjf.write("{}: {}\n" .format(key, value))
-            adjf.close()
-            
-            #OCR the image
-            tsvOCR((adjustImg(cutMarg(img, **cuts), **adjustments)), 
-                   savpath = os.path.normpath(os.path.join(outDir, vol, vol + "_" + sec + ".txt")), 
-                   tsvfile = vol + "_" + sec + "_data.tsv")
- 
\ No newline at end of file
+
+    #Record image adjustments
+    adjf = open(os.path.normpath(os.path.join(outDir, vol, vol + "_adjustments.txt")), "w")
+    adjf.write("IMAGE ADJUSTMENTS\n\n")
+    for key, value in adjustments.items():
+        adjf.write("{}: {}\n" .format(key, value))
+    adjf.close()
+
+
+def endVolume(vol, ledger):
+
+    """
+
+    Record page quality scores for the volume. Scores are read back from the
+    ledger, so pages committed before a restart are included.
+
+    """
+
+    import pandas as pandas
+    pandas.DataFrame(ledger.pages(vol)).to_csv(os.path.normpath(os.path.join(outDir, vol, vol + "_quality.tsv")),
+                                     index = False, sep = "\t")
+
+
+def main():
+
+    #pandas is only needed here and in the main process, not in the workers
+    import pandas as pandas
+
+    #Read csvs
+    mastercsv = pandas.read_csv(masterlist)
+    margcsv = pandas.read_csv(margdata)
+    adjcsv = pandas.read_csv(adjdata)
+
+    #Create column for volume
+    mastercsv["volume"] = mastercsv["filename"].str.split("_").str[0]
+
+    #Merge csvs
+    mastercsv["filename"] = mastercsv["filename"] + ".jp2"
+    mcsv = mastercsv.merge(margcsv, left_on="filename", right_on="file")
+    fcsv = mcsv.merge(adjcsv, on = "volume", how = "right")
+
+    tasks = getTasks(fcsv)
+
+    #skip pages already committed by an earlier run with the same inputs
+    ledger = ocrLedger(ledgerFile)
+    tasks, spliced = planTasks(tasks, ledger)
+    if planOnly == True:
+        ledger.close()
+        return
+
+    vol = None
+    sec = None
+    replaced = []
+    started = set()
+
+    #OCR pages in parallel and commit them in page order. Each section's
+    #output is only written by the ledger in this process.
+    if runner == "pipeline":
+        #the memory budget is per process, so it isn't used for threads
+        initWorker(ompThreads, timing)
+        executor = None
+        pipe = ocrPipeline([pipeStage("prepare", prepPage, threads = prefetch, depth = workers),
+                            pipeStage("ocr", ocrPrepared, threads = workers, depth = workers)],
+                           window = workers * window)
+        results = pipe.run(tasks)
+    elif runner == "queue":
+        #pages are OCR'd by "workqueue.py worker" on any machine that can
+        #reach queueDir and outDir. Ids come from the page fingerprints, so a
+        #restart picks up results that are already done.
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+        from workqueue import workQueue, collect
+        executor = None
+        queue = workQueue(queueDir)
+        tids = [queueTask(queue, task) for task in tasks]
+        results = zip(tasks, collect(queue, tids))
+    else:
+        executor = ProcessPoolExecutor(max_workers = workers, initializer = initWorker,
+                                       initargs = (ompThreads, timing, memBudget))
+        results = orderedMap(executor, ocrPage, tasks, workers * window)
+
+    for task, page in results:
+
+        #start a new section (and volume) as needed
+        if (task["vol"], task["sec"]) != (vol, sec):
+
+            if (vol, sec) in spliced:
+                ledger.splice(vol, sec, *sectionFiles(vol, sec), replaced, spliced[(vol, sec)])
+            elif sec is not None:
+                ledger.closeSection(vol, sec)
+
+            if task["vol"] != vol:
+                vol = task["vol"]
+                print("")
+                startVolume(vol, task["adjustments"])
+
+            sec = task["sec"]
+            started.add((vol, sec))
+            print(datetime.now().strftime("%H:%M") + " Processing " + vol + " " + sec + "...")
+            if (vol, sec) in spliced:
+                replaced = []
+            else:
+                ledger.openSection(vol, sec, *sectionFiles(vol, sec))
+
+        #append the page's shards to the section and record it. Pages that
+        #replace committed ones are spliced in when the section is done.
+        ocr_timing.setVolume(vol)
+        if (vol, sec) in spliced:
+            replaced.append((task["seq"], page, page["shards"], task["fingerprint"]))
+        else:
+            with ocr_timing.stage("commit"):
+                ledger.commit(vol, sec, task["seq"], page, page["shards"], task["fingerprint"])
+
+        if "timing" in page:
+            ocr_timing.merge(page["timing"])
+
+    if (vol, sec) in spliced:
+        ledger.splice(vol, sec, *sectionFiles(vol, sec), replaced, spliced[(vol, sec)])
+
+    #sections that only lost or moved pages have nothing to OCR
+    for key, names in spliced.items():
+        if key not in started:
+            ledger.splice(*key, *sectionFiles(*key), [], names)
+
+    if executor is not None:
+        executor.shutdown()
+    elif runner == "pipeline":
+        print("")
+        print(pipe.report().to_string(index = False))
+
+    #record quality for every volume, including any finished before a restart
+    for v in fcsv["volume"].unique():
+        if os.path.exists(os.path.normpath(os.path.join(outDir, v))):
+            endVolume(v, ledger)
+    ledger.close()
+
+    if timing == True:
+        ocr_timing.toCSV(os.path.join(outDir, "ocr_timing.csv"))
+        ocr_timing.toProm(os.path.join(outDir, "ocr_timing.prom"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Spelling corrections from a precomputed symmetric delete index.
+
+SpellChecker.correction() makes every string within two edits of a word and
+looks each one up, which takes a long time for each of the hundreds of
+unknown words on a noisy page. A symmetric delete index (the SymSpell
+method) does the expensive part once: every string that can be made by
+deleting up to two letters from a dictionary word is stored with the word
+it came from. At lookup time, only the deletes of the unknown word are
+made. Any dictionary word that shares a delete with it is a candidate, and
+the candidates are ranked by edit distance and then by word frequency.
+
+Deletes are stored as 64-bit hashes in a sorted array next to the ids of
+their words. The index is saved as numpy files and memory-mapped when it is
+loaded, so loading is quick and worker processes share the pages.
+
+Usage:
+
+    from symspell import symSpell
+    from lexicon import loadLexicon
+    ss = symSpell.build(loadLexicon())
+    ss.save("symspell")
+    ss = symSpell.load("symspell")
+    ss.correct(["goverment", "Raleigh"])
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from array import array
+import numpy as numpy
+
+
+def hashKey(s):
+
+    """
+
+    64-bit hash of a string.
+
+    """
+
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size = 8).digest(), "little")
+
+
+def deletes(word, maxEdit):
+
+    """
+
+    All strings made by deleting up to maxEdit letters from a word,
+    including the word itself.
+
+    """
+
+    found = {word}
+    edge = [word]
+    for d in range(maxEdit):
+        nxt = []
+        for w in edge:
+            for i in range(len(w)):
+                s = w[:i] + w[i + 1:]
+                if s not in found:
+                    found.add(s)
+                    nxt.append(s)
+        edge = nxt
+    return found
+
+
+def distance(a, b, maxEdit):
+
+    """
+
+    Damerau-Levenshtein distance (optimal string alignment) between two
+    strings. Returns maxEdit + 1 if the distance is more than maxEdit.
+
+    """
+
+    if abs(len(a) - len(b)) > maxEdit:
+        return maxEdit + 1
+
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > maxEdit:
+            return maxEdit + 1
+        prev2, prev = prev, cur
+
+    return prev[-1]
+
+
+class symSpell():
+
+    """
+
+    Symmetric delete spelling corrector.
+
+    Attributes
+    --------------------------------------------------------------------------
+    words (list)         : Dictionary words, by id.
+
+    freqs (array)        : Word frequencies, by id.
+
+    keys (array)         : Sorted delete hashes.
+
+    ids (array)          : Word id for each delete hash.
+
+    maxEdit (int)        : Largest edit distance for a correction.
+
+    sources (dict)       : Hashes of the word lists the index was built from,
+                           saved with it (see lexicon.getCorrector), or None.
+
+    Methods
+    --------------------------------------------------------------------------
+    build                : Build an index from a word frequency dictionary.
+
+    save                 : Save the index to a directory.
+
+    load                 : Load a saved index, memory-mapped.
+
+    lookup               : Ranked corrections for one word.
+
+    correct              : Best correction for each of a list of words.
+
+    """
+
+    def __init__(self, words, freqs, keys, ids, maxEdit = 2):
+
+        self.words = words
+        self.freqs = freqs
+        self.keys = keys
+        self.ids = ids
+        self.maxEdit = maxEdit
+        self.sources = None
+        self.index = {w : i for i, w in enumerate(words)}
+
+    @classmethod
+    def build(cls, lexicon, maxEdit = 2):
+
+        """
+
+        Build an index from a dictionary of word frequencies (see
+        lexicon.loadLexicon). Words are lowercased.
+
+        """
+
+        freq = {}
+        for word, count in lexicon.items():
+            w = word.lower()
+            freq[w] = freq.get(w, 0) + int(count)
+
+        words = sorted(freq)
+        freqs = numpy.array([freq[w] for w in words], dtype = numpy.int64)
+
+        keys = array("Q")
+        ids = array("i")
+        for i, word in enumerate(words):
+            for d in deletes(word, maxEdit):
+                keys.append(hashKey(d))
+                ids.append(i)
+
+        keys = numpy.frombuffer(keys, dtype = numpy.uint64)
+        ids = numpy.frombuffer(ids, dtype = numpy.int32)
+        order = numpy.argsort(keys, kind = "stable")
+
+        return cls(words, freqs, keys[order], ids[order], maxEdit)
+
+    def save(self, path):
+
+        """
+
+        Save the index to a directory.
+
+        The files are written to a new directory next to it, which then
+        takes its place, so other processes never load a half-written
+        index. An old index is moved aside first; processes that have its
+        files memory-mapped can keep using them. If another process saves
+        an index at the same time, the first one in place is kept.
+
+        """
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok = True)
+        tmp = tempfile.mkdtemp(prefix = os.path.basename(path) + ".", dir = parent)
+
+        numpy.save(os.path.join(tmp, "keys.npy"), self.keys)
+        numpy.save(os.path.join(tmp, "ids.npy"), self.ids)
+        numpy.save(os.path.join(tmp, "freqs.npy"), self.freqs)
+        with open(os.path.join(tmp, "words.json"), "w", encoding = "utf-8") as f:
+            json.dump({"maxEdit" : self.maxEdit, "words" : self.words, "sources" : self.sources}, f)
+
+        old = tmp + ".old"
+        try:
+            os.replace(path, old)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            #another process's index got there first
+            shutil.rmtree(tmp, ignore_errors = True)
+        shutil.rmtree(old, ignore_errors = True)
+
+    @classmethod
+    def load(cls, path):
+
+        """
+
+        Load an index saved with save(). The hash arrays are memory-mapped.
+
+        """
+
+        with open(os.path.join(path, "words.json"), encoding = "utf-8") as f:
+            meta = json.load(f)
+
+        index = cls(meta["words"],
+                    numpy.load(os.path.join(path, "freqs.npy"), mmap_mode = "r"),
+                    numpy.load(os.path.join(path, "keys.npy"), mmap_mode = "r"),
+                    numpy.load(os.path.join(path, "ids.npy"), mmap_mode = "r"),
+                    meta["maxEdit"])
+        index.sources = meta.get("sources")
+        return index
+
+    def lookup(self, word, n = 5):
+
+        """
+
+        Ranked corrections for one word.
+
+        Arguments
+        --------------------------------------------------------------------------
+        word (str)           : The word to correct.
+
+        n (int)              : Most corrections to return.
+
+        Returns
+        --------------------------------------------------------------------------
+        (list) (word, distance, frequency) tuples, closest first and then most
+        frequent first.
+
+        """
+
+        w = word.lower()
+        if w in self.index:
+            i = self.index[w]
+            return [(w, 0, int(self.freqs[i]))]
+
+        hashes = numpy.array(sorted(hashKey(d) for d in deletes(w, self.maxEdit)), dtype = numpy.uint64)
+        lo = numpy.searchsorted(self.keys, hashes, side = "left")
+        hi = numpy.searchsorted(self.keys, hashes, side = "right")
+
+        cands = set()
+        for a, b in zip(lo, hi):
+            if b > a:
+                cands.update(self.ids[a:b].tolist())
+
+        found = []
+        for i in cands:
+            d = distance(w, self.words[i], self.maxEdit)
+            if d <= self.maxEdit:
+                found.append((self.words[i], d, int(self.freqs[i])))
+
+        found.sort(key = lambda x: (x[1], -x[2]))
+        return found[:n]
+
+    def correct(self, words):
+
+        """
+
+        Best correction for each of a list of words. Each distinct word is
+        only looked up once. Words with no correction within maxEdit are
+        returned as they are.
+
+        """
+
+        best = {}
+        for w in set(words):
+            found = self.lookup(w, n = 1)
+            best[w] = found[0][0] if len(found) > 0 else w
+
+        return [best[w] for w in words]
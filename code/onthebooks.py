@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Command line entry point for the On the Books workflow.
+
+Each subcommand runs one of the workflow scripts (see workflow.md) as if it
+were run directly. Only the chosen script's modules are loaded, so
+"onthebooks --help" and short commands start quickly, and an OCR run
+doesn't wait on the marginalia or split/cleanup code. Arguments after the
+subcommand are passed on to the script.
+
+Usage:
+    python onthebooks.py download
+    python onthebooks.py marginalia
+    python onthebooks.py adjrec
+    python onthebooks.py ocr
+    python onthebooks.py queue worker --queue /shared/queue
+    python onthebooks.py split 0 1 2
+    python onthebooks.py cleanup section_fixes final appraisal --input ./raw --out ./cleanup
+    python onthebooks.py geonames --state NC
+    python onthebooks.py startup
+
+"startup" checks that the command line, and the modules the subcommands and
+their workers import (ocr_func, ocr_use, cropfunctions, pipeline), start 
+within a time budget, and that importing them doesn't load modules they 
+only need for some of their work (scoring, OCR output, deskewing).
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import os
+import sys
+import argparse
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+#subcommand: (folder, script, description)
+commands = {
+    "download" : ("data_acquisition", "jp2_download.py", "download page images from the Internet Archive"),
+    "marginalia" : ("marginalia", "marginalia_determination.py", "find margins and skew for each page"),
+    "adjrec" : ("ocr", "adjRec.py", "recommend image adjustments for each volume"),
+    "ocr" : ("ocr", "ocr_use.py", "OCR every page"),
+    "repair" : ("ocr", "ocr_repair.py", "re-OCR low confidence lines"),
+    "score" : ("ocr", "ocr_score.py", "score readability of existing OCR output"),
+    "geonames" : ("ocr", "geonames.py", "build the place name word list"),
+    "queue" : (".", "workqueue.py", "run a worker for a shared work queue, or show its status"),
+    "split" : ("split_cleanup", None, "run split and cleanup steps (00-07) by number"),
+    "cleanup" : ("split_cleanup", "pipeline.py", "run automatic split/cleanup stages on each volume in memory"),
+}
+
+#modules ocr_func should only load when scoring or correcting text
+lazyModules = ["spellchecker", "nltk", "tqdm", "scipy"]
+
+#modules timed by "startup": (folder, modules they should not load, module 
+#whose import time is added to the budget)
+startupModules = {
+    "ocr_func" : ("ocr", lazyModules + ["pytesseract", "pandas"], None),
+    "ocr_use" : ("ocr", lazyModules + ["pytesseract", "pandas"], None),
+    "cropfunctions" : ("marginalia", ["scipy"], None),
+    "pipeline" : ("split_cleanup", [], "pandas"),
+}
+
+
+def runScript(folder, script, args):
+
+    """
+
+    Run a workflow script as __main__, with its folder on the import path
+    and args as its command line arguments.
+
+    """
+
+    import runpy
+
+    path = os.path.join(here, folder, script)
+    sys.path.insert(0, os.path.dirname(path))
+    sys.argv = [path] + list(args)
+    runpy.run_path(path, run_name = "__main__")
+
+
+def splitScripts(steps):
+
+    """
+
+    Paths of the split/cleanup scripts for step numbers.
+
+    """
+
+    folder = os.path.join(here, "split_cleanup")
+    scripts = sorted(f for f in os.listdir(folder) if f.endswith(".py"))
+
+    paths = []
+    for step in steps:
+        found = [f for f in scripts if f.startswith("{:02d}_".format(int(step)))]
+        if len(found) == 0:
+            raise SystemExit("No split/cleanup step " + str(step))
+        paths.append(found[0])
+
+    return paths
+
+
+def importTime(folder, module, lazy, runs):
+
+    """
+
+    Time importing a module in a new interpreter and find which of the lazy
+    modules it loads. Returns the median time in seconds and the lazy 
+    modules loaded, or None if the import failed.
+
+    """
+
+    import subprocess
+    import time
+
+    check = ("import sys; sys.path.insert(0, {!r}); import {}; "
+             "print(' '.join(m for m in {!r} if m in sys.modules))").format(os.path.join(here, folder), module, lazy)
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", check], capture_output = True, text = True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            print(module + " could not be imported:\n" + result.stderr)
+            return sorted(times)[0], None
+
+    return sorted(times)[runs // 2], result.stdout.split()
+
+
+def checkStartup(budget, runs = 5):
+
+    """
+
+    Time "onthebooks.py --help" and importing the modules the subcommands
+    (and their worker processes) start with, and check which modules each
+    of those loads. Exits with an error if a median start time is over 
+    budget (in seconds), a lazy module was loaded or a module could not be
+    imported.
+
+    The split/cleanup steps all work on pandas data frames, so pipeline is 
+    allowed the time it takes to import pandas on top of the budget.
+
+    """
+
+    import subprocess
+    import time
+
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--help"],
+                       stdout = subprocess.DEVNULL, check = True)
+        times.append(time.perf_counter() - start)
+    median = sorted(times)[runs // 2]
+    print("--help: {:.3f}s median over {} runs (budget {:.3f}s)".format(median, runs, budget))
+    failed = median > budget
+
+    for module, (folder, lazy, base) in startupModules.items():
+        allowed = budget
+        if base is not None:
+            allowed += importTime(".", base, [], runs)[0]
+        seconds, loaded = importTime(folder, module, lazy, runs)
+        if loaded is None:
+            failed = True
+            continue
+        print("import {}: {:.3f}s median (budget {:.3f}s), lazy modules loaded: {}".format(
+            module, seconds, allowed, " ".join(loaded) or "none"))
+        failed = failed or seconds > allowed or len(loaded) > 0
+
+    if failed:
+        sys.exit(1)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(prog = "onthebooks", description = "On the Books workflow scripts.")
+    sub = parser.add_subparsers(dest = "command", metavar = "command")
+    sub.required = True
+
+    #no -h/--help of their own, so "onthebooks <command> --help" shows the
+    #script's help
+    for name, (folder, script, desc) in commands.items():
+        cmd = sub.add_parser(name, help = desc, add_help = False)
+        if name == "split":
+            cmd.add_argument("steps", nargs = "+", help = "step numbers, e.g. 0 1 2")
+
+    startup = sub.add_parser("startup", help = "check start time and lazy imports")
+    startup.add_argument("--budget", type = float, default = 0.5, help = "seconds (default 0.5)")
+
+    #anything not parsed here is passed on to the script
+    opts, args = parser.parse_known_args()
+
+    if opts.command == "startup":
+        if len(args) > 0:
+            parser.error("unrecognized arguments: " + " ".join(args))
+        checkStartup(opts.budget)
+    elif opts.command == "split":
+        for script in splitScripts(opts.steps):
+            print("Running " + script)
+            runScript("split_cleanup", script, args)
+    else:
+        folder, script, desc = commands[opts.command]
+        runScript(folder, script, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,112 +18,102 @@ UNC Chapel Hill
 
 import pandas as pd
 import numpy as np
-import joblib
 import re
 import os
+from stage_io import write_stage, stage_ext
+from scheduler import run_volumes
 
 
+# Regex patterns used to identify chapters (match_chapter), abbreviated 
+# section headers (match_section), unabbreviated "Section 1" sections 
+# (match_section1), and the numbers that follow each of them
+match_chapter = re.compile(r'^(?:C|O)[A-Za-z]*(?:R|r)(?:\.|,|:|;)*$')
+match_section = re.compile(r'(?:S|s)[a-zA-Z]{2,3}(?:\.|,|:|;){0,2}$')
+match_section1 = re.compile(r'S[a-zA-Z]+$')
+chapter_number = re.compile(r'[0-9.]+(?:\.|,|:|;){0,2}')
+section_number = re.compile(r'^[0-9.\}]+(?:\.|,|:|;){0,2}$')
+section1_number = re.compile(r'^(?:1|.)(?:\.|,|:|;){0,2}$')
 
-def tsvparser(filename):
+
+def find_headers(text):
     """
     
-    Identifies chapters and sections within a raw OCR output .tsv file for
-    a single volume.
+    Identifies chapter and section headers in a volume's words and labels
+    every word with the chapter and section it belongs to.
     
-    Assigns chapter and section identifiers to rows in the raw file and
-    creates an aggregate pd.DataFrame object grouping text into 
-    individual sections.
-    
-    Outputs a new .csv version of the raw file and creates an initial .csv
-    version of the aggregate file.
+    Each pattern is checked once for the whole column. Conditions on the
+    words around a header (three blank rows above, a number below) are the
+    same checks shifted up or down a row. Rows before the first word count
+    as blank and the row after the last word counts as empty, so a header
+    at either end of the volume is handled like any other.
     
     Arguments
     --------------------------------------------------------------------------    
-    filepath (str)       : The filepath for a single volume's raw .tsv OCR
-                           output file.
+    text (pd.Series)     : The "text" column of a raw OCR output file, with
+                           blanks as empty strings.
                          
     
     Returns
     --------------------------------------------------------------------------
-    N/A
+    (tuple) Two pd.Series, the chapter and section label of each row ("" 
+    before the first chapter or section header).
     
     """
+    
+    after = text.shift(-1, fill_value='')
+    header = text + ' ' + after
+    
+    # Create a matching condition to check for three blank spaces above
+    # potential matches
+    blank = text == ''
+    blank3 = (blank.shift(1, fill_value=True) & blank.shift(2, fill_value=True) &
+              blank.shift(3, fill_value=True))
+    
+    # A chapter header followed by its number. The number marks the start of 
+    # a chapter title, so any section before it ends even when the header 
+    # doesn't follow three blanks.
+    is_chapter = text.str.match(match_chapter) & after.str.contains(chapter_number)
+    new_chapter = is_chapter & blank3
+    
+    # Check for new abbreviated sections and new unabbreviated "Section 1"
+    # sections
+    is_section = text.str.match(match_section)
+    new_section = ((is_section & (after.str.contains(section_number) | blank3)) |
+                   (text.str.match(match_section1) & after.str.contains(section1_number)))
+    
+    # Fill each header's label down to the next header of the same kind. 
+    # Text belonging to a chapter title gets a blank section.
+    chapter = header.where(new_chapter).ffill().fillna('')
+    section = header.where(new_section).mask(is_chapter, '').ffill().fillna('')
+    
+    return chapter, section
 
 
+def split_volume(raw):
+    """
     
-    # Import the raw .tsv file into a pd.DataFrame object
-    raw=pd.read_csv(filename)
-    raw['text'] = raw['text'].replace(np.nan, '')
+    Assigns chapter and section identifiers to rows in a single volume's raw
+    OCR output and creates an aggregate pd.DataFrame object grouping text
+    into individual sections.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    raw (pd.DataFrame)   : A single volume's raw OCR output, one row per word.
+                         
+    
+    Returns
+    --------------------------------------------------------------------------
+    raw (pd.DataFrame)   : The raw file, with chapter, section and
+                           chapter_index columns.
+    agg (pd.DataFrame)   : The aggregate file, one row per section.
+    
+    """
 
-    # Add columns to dataframe and create lists to which identified chapter
-    # and section headers will be appended
-    # Set the variables for chapter and section that will be used to fill out
-    # the above lists
-    chapter = '' 
-    chapter_column = []
-    raw['chapter'] = ''
-    section = ''
-    section_column = []
-    raw['section'] = ''
-
-    # Iterate through all rows in the raw file (word by word)
-    for i in range(0, raw.shape[0]):
-        
-        # Initialize as variables the regex patterns used to identify 
-        # chapters (match_chapter), abbreviate section headers 
-        # (match_section), and unabbreviated "Section 1" sections
-        # (match_section1)
-        match_chapter = re.match('^(C|O)[A-Za-z]*(R|r)(\.|,|:|;)*$', raw.iloc[i]['text'])
-        match_section = re.match('(S|s)[a-zA-Z]{2,3}(\.|,|:|;){0,2}$', raw.iloc[i]['text'])
-        match_section1 = re.match('S[a-zA-Z]+$', raw.iloc[i]['text'])
-        
-        # Create a matching condition to check for three blank spaces above
-        # potential matches
-        blank3 = (re.match('^$', raw.iloc[i-1]['text']) and
-                  re.match('^$', raw.iloc[i-2]['text']) and
-                  re.match('^$', raw.iloc[i-3]['text']))
-        
-        # The following conditional statements check for situations that
-        # indicate the beginning of a new chapter, a new section, or a new 
-        # first section. If any of these are satisfied, the 'chapter' or 
-        # 'section' variable is changed accordingly. Once all conditionals have
-        # been checked, the resulting 'chapter' and 'section' values for the
-        # word in question are added to their respective lists.
-        # The results are two lists, one for each column, with a chapter and
-        # section value for each row in the raw file.
-        
-        # Check for new chapters
-        if (match_chapter and
-            re.search('[0-9.]+(\.|,|:|;){0,2}', raw.iloc[i+1]['text']) and
-            blank3):
-            chapter = raw.iloc[i]['text'] +' '+ raw.iloc[i+1]['text']
-        
-        # Check for new abbreviated sections
-        if ((match_section and re.search('^[0-9.\}]+(\.|,|:|;){0,2}$', raw.iloc[i+1]['text'])) or
-            (match_section and blank3)):
-            section = raw.iloc[i]['text'] +' '+ raw.iloc[i+1]['text']
-            
-        # Check for new unabbreviated "Section 1" sections
-        if (match_section1 and
-            re.search('^(1|.)(\.|,|:|;){0,2}$', raw.iloc[i+1]['text'])):
-            section = raw.iloc[i]['text'] +' '+ raw.iloc[i+1]['text']
-            
-        # Set the "section" value to blank for areas of text belonging
-        # to a chapter title and not an actual section
-        if (match_chapter and
-            re.search('[0-9.]+(\.|,|:|;){0,2}', raw.iloc[i+1]['text']) and
-            blank3 !=  raw.iloc[i]['chapter']):
-            section = ''
-        
-        # Add the resulting 'section' and 'chapter' values to their respective
-        # lists.
-        section_column.append(section)    
-        chapter_column.append(chapter)
+    raw['text'] = raw['text'].replace(np.nan, '')
 
-    # Once all words in the raw file have been checked, add the lists as
-    # columns to the raw dataframe.
-    raw['chapter'] = chapter_column
-    raw['section'] = section_column
+    # Identify chapter and section headers and fill their labels down to
+    # every word that follows them
+    raw['chapter'], raw['section'] = find_headers(raw['text'])
 
     # Add a chapter index to differentiate duplicate chapter headers
     raw["chapter_index"] = ((raw["chapter"].notna()) & (raw["chapter"]!=raw["chapter"].shift(1))).cumsum()
@@ -137,12 +127,46 @@ def tsvparser(filename):
     # section assignments
     agg = raw[raw["text"]!=""].groupby(['chapter', 'section', 'chapter_index'], sort=False)['text'].apply(' '.join).reset_index()
 
-    # Output the raw and aggregate dataframes as .csv files
-    raw_outname = os.path.join("outputs","raw",filename.replace(".csv",'') + "_output.csv")
-    agg_outname = os.path.join("outputs","agg",filename.replace(".csv",'') + "_aggregated_ouput.csv")
+    return raw, agg
+
+
+def tsvparser(filename):
+    """
+    
+    Identifies chapters and sections within a raw OCR output .tsv file for
+    a single volume.
+    
+    Assigns chapter and section identifiers to rows in the raw file and
+    creates an aggregate pd.DataFrame object grouping text into 
+    individual sections (see split_volume).
+    
+    Outputs a new version of the raw file and an initial version of the
+    aggregate file, in the stage file format (see stage_io.py).
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    filepath (str)       : The filepath for a single volume's raw .tsv OCR
+                           output file.
+                         
+    
+    Returns
+    --------------------------------------------------------------------------
+    N/A
+    
+    """
+
+
+    
+    # Import the raw .tsv file into a pd.DataFrame object
+    raw=pd.read_csv(filename)
+    raw, agg = split_volume(raw)
+
+    # Output the raw and aggregate dataframes as stage files
+    raw_outname = os.path.join("outputs","raw",filename.replace(".csv",'') + "_output" + stage_ext())
+    agg_outname = os.path.join("outputs","agg",filename.replace(".csv",'') + "_aggregated_ouput" + stage_ext())
 
-    raw.to_csv(raw_outname, index=False, encoding="utf-8-sig")
-    agg.to_csv(agg_outname, index=False, encoding="utf-8-sig")
+    write_stage(raw, raw_outname, encoding="utf-8-sig")
+    write_stage(agg, agg_outname, encoding="utf-8-sig")
 
 
 def main():
@@ -159,8 +183,7 @@ def main():
     listdir = [f for f in os.listdir(ocr_path) if f.endswith(".tsv")]
     
     # Run "tsvparser" function in parallel to decrease compute time
-    with joblib.parallel_backend(n_jobs=7,backend='loky'):
-        joblib.Parallel(verbose=5)(joblib.delayed(tsvparser)(filename) for filename in listdir)
+    run_volumes(tsvparser, listdir)
         
 
 if __name__ == "__main__":
@@ -24,6 +24,8 @@ import os
 from string import punctuation
 import numpy as np
 import xlsxwriter
+from numbering_repair import repair_lags
+from stage_io import read_stage, is_stage_file
 csv.field_size_limit(600000)
 
 # Create a variable to store all automatic fix/recommendation data for each volume
@@ -31,35 +33,23 @@ csv.field_size_limit(600000)
 meta_list=[]
 
 
-def initial_chap_fixes(agg_folder, agg_file):
+def chapter_flags(vol_df):
     """    
-    This function identifies chapter split numbering errors, suggests corrections
-    for certain situtations, and outputs a volume-level list of chapters with
-    potential errors and suggested corrections flagged for manual review.
-    The function does not provide any return values. Instead, it outputs a
-    single Excel file for each volume and adds volume-level metadata to the 
-    corpus-level report list ("meta_list")
+    Lists the chapters in a volume's aggregate file, suggests corrections to
+    misread chapter numbers and flags chapters with potential errors.
     
     Arguments
     --------------------------------------------------------------------------    
-    agg_folder (str)         : The string filepath for the directory containing
-                               the corpus "aggregate" files
-    agg_file (str)           : The string base file name for an individual
-                               volume's "aggregate" file
+    vol_df (pd.DataFrame)    : An individual volume's "aggregate" file
                          
     Returns
     --------------------------------------------------------------------------
-    N/A
+    output (pd.DataFrame)    : The chapter list ("chapnumflags"), one row per
+                               chapter
+    meta (dict)              : The chapter count, flags and corrections for
+                               the corpus-level report
     
     """
-    
-    # Create path string variables and import the agg file into a Pandas dataframe
-    inpath = agg_folder + agg_file
-      
-    outpath = inpath.replace("chap_adjusted_agg", "chap_num_flags")
-    outpath = outpath.replace("aggregated_chapadjusted.csv", "chapnumflags.xlsx")
-    
-    vol_df = pd.read_csv(inpath, encoding = 'utf-8-sig')
 
     # Create lists to be converted to series for a chapter-level dataframe that
     # will be exported as an excel file
@@ -102,28 +92,9 @@ def initial_chap_fixes(agg_folder, agg_file):
 
 
 
-    # Complete all lag3, lag2, and lag1 fixes
-    for row_num in range(3,len(unq_ch)-3):
-        if unq_ch[row_num]!= (unq_ch[row_num+1]-1) and unq_ch[row_num]!= (unq_ch[row_num-1]+1):
-            lag1_test = (unq_ch[row_num+1]-unq_ch[row_num-1])==2
-            lag2_test = (unq_ch[row_num+2]-unq_ch[row_num-2])==4 and unq_ch[row_num+2]-unq_ch[row_num+1]==1
-            lag3_test = (unq_ch[row_num+3]-unq_ch[row_num-3])==6 and unq_ch[row_num+3]-unq_ch[row_num+2]==1
-
-            if lag1_test and lag2_test and lag3_test:
-                unq_ch[row_num] = unq_ch[row_num-3]+3 
-
-    for row_num in range(2,len(unq_ch)-2):
-        if unq_ch[row_num]!= (unq_ch[row_num+1]-1) and unq_ch[row_num]!= (unq_ch[row_num-1]+1):
-            lag1_test = (unq_ch[row_num+1]-unq_ch[row_num-1])==2
-            lag2_test = (unq_ch[row_num+2]-unq_ch[row_num-2])==4 and unq_ch[row_num+2]-unq_ch[row_num+1]==1
-            if lag1_test and lag2_test:
-                unq_ch[row_num] = unq_ch[row_num-2]+2
-
-    for row_num in range(1,len(unq_ch)-1):
-        if unq_ch[row_num]!= (unq_ch[row_num+1]-1) and unq_ch[row_num]!= (unq_ch[row_num-1]+1):
-            lag1_test = (unq_ch[row_num+1]-unq_ch[row_num-1])==2
-            if lag1_test:
-                unq_ch[row_num] = unq_ch[row_num-1]+1
+    # Complete all lag3, lag2, and lag1 fixes (see numbering_repair.py)
+    repaired, reason = repair_lags(unq_ch, sequential=True)
+    unq_ch = pd.Series(repaired).astype(unq_ch.dtype)
 
     # Parse chapter rows in groups of 5 to flag areas with potential errors
     # Mark those chapters that were corrected by the lag fix steps above
@@ -136,8 +107,34 @@ def initial_chap_fixes(agg_folder, agg_file):
     output = pd.concat([raw_titles, orig_num, indices_Series, unq_ch, corrected, flag], axis=1)
     output.columns = ['chap_title', 'raw_num', 'chapter_index', 'corrected_num', 'correction_made', 'flag']
 
-    # Create an excel workbook from the above dataframe, add formatting to make
-    # corrections an errors more easily findable, and save.
+    # Count fixes for the corpus-level report
+    try:
+        corrections = corrected.value_counts()[1]
+    except:
+        corrections = 0
+    meta = {"chap_count":output.shape[0], 
+            "flags":flag.value_counts()[1], 
+            "corrections":corrections}
+
+    return output, meta
+
+
+def write_flags(output, outpath):
+    """    
+    Saves a volume's chapter list as an Excel file, with formatting to make
+    flags and corrections easy to find.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    output (pd.DataFrame)    : The chapter list from chapter_flags
+    outpath (str)            : The .xlsx file path
+                         
+    Returns
+    --------------------------------------------------------------------------
+    N/A
+    
+    """
+
     with pd.ExcelWriter(outpath, engine='xlsxwriter') as writer:
 
         # create workbook object
@@ -173,25 +170,50 @@ def initial_chap_fixes(agg_folder, agg_file):
                                             'format':   corrected_format})
 
         writer.save()
-        
+
+
+def initial_chap_fixes(agg_folder, agg_file):
+    """    
+    This function identifies chapter split numbering errors, suggests corrections
+    for certain situtations, and outputs a volume-level list of chapters with
+    potential errors and suggested corrections flagged for manual review.
+    The function does not provide any return values. Instead, it outputs a
+    single Excel file for each volume and adds volume-level metadata to the 
+    corpus-level report list ("meta_list")
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    agg_folder (str)         : The string filepath for the directory containing
+                               the corpus "aggregate" files
+    agg_file (str)           : The string base file name for an individual
+                               volume's "aggregate" file
+                         
+    Returns
+    --------------------------------------------------------------------------
+    N/A
+    
+    """
+    
+    # Create path string variables and import the agg file into a Pandas dataframe
+    inpath = agg_folder + agg_file
+      
+    outpath = inpath.replace("chap_adjusted_agg", "chap_num_flags")
+    outpath = os.path.splitext(outpath)[0].replace("aggregated_chapadjusted", "chapnumflags") + ".xlsx"
+    
+    vol_df = read_stage(inpath, encoding = 'utf-8-sig')
+
+    output, meta = chapter_flags(vol_df)
+    write_flags(output, outpath)
     
     # Add fix metadata for the volume in question to the corpus-level list
     # This list will be saved as a report .csv file
-    try:
-        corrections = corrected.value_counts()[1]
-    except:
-        corrections = 0
-    meta_list.append({"agg_file":agg_file, 
-          "chap_count":output.shape[0], 
-          "flags":flag.value_counts()[1], 
-          "corrections":corrections})
-
+    meta_list.append(dict({"agg_file":agg_file}, **meta))
 
 
 def main():
     # Set the filepath variable for the directory containing the corpus
     # aggregate files
-    agg_filelist = os.listdir(r"C:\Users\npbyers\Desktop\OTB\ChapNumFixes\chap_adjusted_agg")
+    agg_filelist = [f for f in os.listdir(r"C:\Users\npbyers\Desktop\OTB\ChapNumFixes\chap_adjusted_agg") if is_stage_file(f)]
     agg_folder = "./chap_adjusted_agg/"
     
     # Perform chapter fix/report operations for each volume using the 
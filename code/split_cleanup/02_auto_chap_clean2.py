@@ -21,67 +21,33 @@ UNC Chapel Hill
 
 import csv
 import pandas as pd
-import joblib
 import os
 import numpy as np
+from relabel import run_slices
+from stage_io import read_stage, write_stage, stage_path, is_stage_file
+from scheduler import run_volumes
 csv.field_size_limit(600000)
 
 
-def skipfixes(raw_fix_pair):
+def fix_skips(raw_df, fix_df):
     """    
-    This function serves two purposes. First, it integrates changes made in the
-    manual review process following the first round of automatic fixes to the raw
-    file of each volume. It is important to note that the "chapnumfix" files were
-    converted from .xlsx to .csv before this step. 
-    
-    Second, the function identifies chapters preceded by 
-    numbering gaps and parses the text of the chapter immediately before them 
-    for chapter headers that may have been missed by the original splitting process. 
-    
-    Previous to this step, the gaps were identified and marked by manual 
-    reviewers. In short, the function receives as arguments both a raw file 
-    and a "chapnumfixes" file for a given volume. After integrating the manual
-    corrections made in this file, the function iterates through all chapters
-    marked as being preceded by gaps. It then parses the text of chapters directly
-    preceding each of these "gap" chapters and tries to identify chapter headers
-    that may have been missed by the original splitting script. It does so by
-    utilizing looser regular expressions and by searching for numbers that match
-    those of the missing chapters. If missing chapters are identified, changes
-    are made directly to the raw file of the volume in question.
-    
-    The function also collects metadata about chapters identified and corrections
-    made. This metadata is compiled for each volume into a dictionary. Each of
-    these volume-level dictionaries are then used to generate rows for a 
-    corpus-level report intended to document the outcomes of the script.
+    Integrates a volume's manual "chapnumfixes" corrections into its raw file
+    and looks for missed chapter headers in the chapters before numbering
+    gaps (see skipfixes).
     
     Arguments
     --------------------------------------------------------------------------    
-    raw_fix_pair (list)         : Contains the string filepaths for both the 
-                                  raw file and the "chapnumfixes" file for a 
-                                  given volume.
+    raw_df (pd.DataFrame)       : The volume's raw file
+    fix_df (pd.DataFrame)       : The volume's "chapnumfixes" file
 
     Returns
     --------------------------------------------------------------------------
-    gap_fix_dict (dict)         : A dictionary containing the following
-                                  information, to be included as a row 
-                                  in a corpus-level report: the volume filename
-                                  (str), and a list containing a description
-                                  of the gap (str - "gap_title"), the chapter
-                                  numbers of the missing chapters (list - 
-                                  "possible_cor_nums"), and a list of potential
-                                  correction candidates (list - "candidate_list"),
-                                  the latter containing the candidate's chapter's
-                                  title and starting index in the raw file.
+    adjusted_raw (pd.DataFrame) : The new raw file, with adjusted chapters
+    agg (pd.DataFrame)          : The new aggregate file
+    raw_gaps (list)             : For each gap, its description, the numbers
+                                  of the missing chapters and the correction
+                                  candidates (see skipfixes)
     """
-        
-    #load files & create dataframes
-    rawfile = raw_fix_pair[0]
-    fixfile = raw_fix_pair[1]
-    
-    print(os.path.basename(rawfile))
-    
-    raw_df = pd.read_csv(rawfile, encoding='utf-8', low_memory=False)
-    fix_df = pd.read_csv(fixfile, encoding='utf-8', low_memory=False)
 
     raw_df['chapter'] = raw_df['chapter'].replace(np.nan, '')
     raw_df['section'] = raw_df['section'].replace(np.nan, '')
@@ -96,15 +62,18 @@ def skipfixes(raw_fix_pair):
     raw_df["sug_cor_chap_num"] = raw_df["cor_chap_num"]
     
     # match manual/automatic changes from first round of "chap_num_fixes"
-    # match corrected chapter number and gap information from the chap_num_fixes file
-    # to all rows in the raw file
-
-    for i in range(0, fix_df.shape[0]):
-        idx = fix_df.iloc[i]["chapter_index"]
-        raw_df.loc[((raw_df["chapter_index"]==idx)), ["fix_chap_title"]] = fix_df.iloc[i]["chap_title"]
-        raw_df.loc[((raw_df["chapter_index"]==idx)), ["raw_chap_num"]] = fix_df.iloc[i]["raw_num"]
-        raw_df.loc[((raw_df["chapter_index"]==idx)), ["cor_chap_num"]] = fix_df.iloc[i]["corrected_num"]
-        raw_df.loc[((raw_df["chapter_index"]==idx)), ["chap_gap"]] = fix_df.iloc[i]["gap"]
+    # Join the corrected chapter number and gap information from the
+    # chap_num_fixes file onto all rows in the raw file by chapter_index. If
+    # an index is in the fix file more than once, its last row is used.
+    fixes = fix_df[fix_df["chapter_index"].notna()].drop_duplicates("chapter_index", keep="last")
+    fixes = fixes.set_index("chapter_index")
+    fix_rows = fixes.index.get_indexer(raw_df["chapter_index"])
+    matched = fix_rows >= 0
+    for raw_col, fix_col in [("fix_chap_title", "chap_title"), ("raw_chap_num", "raw_num"),
+                             ("cor_chap_num", "corrected_num"), ("chap_gap", "gap")]:
+        values = np.full(raw_df.shape[0], "", dtype=object)
+        values[matched] = fixes[fix_col].to_numpy(dtype=object)[fix_rows[matched]]
+        raw_df[raw_col] = values
 
     raw_df['chap_gap'] = raw_df['chap_gap'].replace('', '0')
     raw_df['chap_gap'] = raw_df['chap_gap'].astype(int)
@@ -120,26 +89,40 @@ def skipfixes(raw_fix_pair):
     gaps_df = gaps_df.drop_duplicates()
 
 
+    # Find the rows that look like a missed chapter header once for the
+    # whole volume: a "...HAPTER" row followed by a number on the next row
+    # with the same corrected chapter number. Candidates for a gap are then
+    # the header rows in the chapter before it.
+    chap_num_rows = run_slices(raw_df['cor_chap_num'])
+    next_row = np.arange(1, raw_df.shape[0]+1)
+    for ranges in chap_num_rows.values():
+        for (start, stop), (next_start, next_stop) in zip(ranges, ranges[1:]):
+            next_row[stop-1] = next_start
+        next_row[ranges[-1][1]-1] = raw_df.shape[0]
+    texts = np.append(raw_df['text'].to_numpy(dtype=object), np.nan)
+    shift_texts = texts[next_row]
+    titles = (raw_df['text'].str.match(r'[^"]*HAPTER(\.|,|:|;)*$')==True).to_numpy()
+    numbers = np.append((raw_df['text'].str.match(r'[0-9.]+(\.|,|:|;){0,2}')==True).to_numpy(), False)
+    header_rows = {}
+    cor_chap_nums = raw_df['cor_chap_num'].to_numpy(dtype=object)
+    for row in np.flatnonzero(titles & numbers[next_row]).tolist():
+        if cor_chap_nums[row] == cor_chap_nums[row]:
+            header_rows.setdefault(cor_chap_nums[row], []).append(row)
+    chapters = raw_df['chapter'].to_numpy(dtype=object)
+
     # for each gap found, compile a list of possible missing chapters
     # and search for them in the chapter preceding the gap.
-    for idx1, row in gaps_df.iterrows():
-        current_chap = row['cor_chap_num']
-        previous_chap = raw_df.iloc[idx1-1]['cor_chap_num']
+    for idx1, current_chap, chap_gap in zip(gaps_df.index, gaps_df['cor_chap_num'], gaps_df['chap_gap']):
+        previous_chap = cor_chap_nums[idx1-1]
         candidate_list = []
-        possible_cor_nums = [int(current_chap)-i for i in range(1,row['chap_gap']+1)]
+        possible_cor_nums = [int(current_chap)-i for i in range(1,chap_gap+1)]
         possible_cor_nums = list(reversed(possible_cor_nums))
         gap_title = "gap: " + str(previous_chap) + "-" + str(current_chap)
-        prev_chap_rows = raw_df[raw_df['cor_chap_num'] == previous_chap].copy()
-        prev_chap_rows['shift_text'] = prev_chap_rows.text.shift(-1)
-
-        chap_matches = prev_chap_rows[(prev_chap_rows['text'].str.match(r'[^"]*HAPTER(\.|,|:|;)*$')==True) &
-                                     (prev_chap_rows['shift_text'].str.match(r'[0-9.]+(\.|,|:|;){0,2}')==True)]
 
-        
         # Add all potential correction candidates to a list
-        for idx2, row in chap_matches.iterrows():
-            if row['chapter'] != row['text'] +' '+ row['shift_text']:
-                sug_chap_title = row['text'] +' '+ row['shift_text']
+        for idx2 in header_rows.get(previous_chap, []):
+            if chapters[idx2] != texts[idx2] +' '+ shift_texts[idx2]:
+                sug_chap_title = texts[idx2] +' '+ shift_texts[idx2]
                 missing_chap_start_index = idx2
                 candidate_list.append({"sug_chap_title":sug_chap_title, 
                                         "missing_chap_start_index":missing_chap_start_index})
@@ -174,20 +157,16 @@ def skipfixes(raw_fix_pair):
             if "sug_cor_chap_num" in c:
                 raw_df.loc[c["missing_chap_start_index"]:idx1-1, "sug_chap_title"] = c["sug_chap_title"]
                 raw_df.loc[c["missing_chap_start_index"]:idx1-1, "sug_cor_chap_num"] = c["sug_cor_chap_num"]
-                newchap_df =  raw_df[c["missing_chap_start_index"]:idx1]
-                for q in range(0, newchap_df.shape[0]):
-                    if newchap_df.index.values[q] != c["missing_chap_start_index"]:
-                        if newchap_df.iloc[q]['section'] != newchap_df.iloc[q-1]['section']:
-                            raw_df.loc[c["missing_chap_start_index"]:newchap_df.index.values[q-1], "section"] = "Chapter_Title"
-                            break
+                # the new chapter's title runs to its first section change
+                sections = raw_df["section"].to_numpy(dtype=object)[c["missing_chap_start_index"]:idx1]
+                changes = np.flatnonzero(sections[1:] != sections[:-1])
+                if len(changes) > 0:
+                    raw_df.loc[c["missing_chap_start_index"]:c["missing_chap_start_index"]+changes[0], "section"] = "Chapter_Title"
         
         # add gap information (list) for a given gap to a volume-level list
         raw_gaps.append([gap_title, possible_cor_nums, candidate_list])
     
-    # Add the filename and volume-level list of gap information to a dictionary
-    gap_fix_dict = {'file': rawfile, 'gaplist':raw_gaps}
-    
-    # create a new version of the raw file with adjusted chap numbers for output as .csv
+    # create a new version of the raw file with adjusted chap numbers for output
     # Normalize chapter title language
     chapters_new = "CHAPTER " + raw_df["sug_cor_chap_num"].astype(str)
     raw_df['chapters_new'] = chapters_new
@@ -211,18 +190,82 @@ def skipfixes(raw_fix_pair):
     adjusted_raw.loc[((adjusted_raw["chapter"]!="") & (adjusted_raw["section"]=="")), ["section"]] = "Chapter_Title"
     adjusted_raw.loc[((adjusted_raw["chapter"]=="") & (adjusted_raw["section"]!="")), ["chapter"]] = "Chapter_UNKNOWN"
     
-    # Create a new aggregate dataframe for output as a .csv
+    # Create a new aggregate dataframe for output
     agg = adjusted_raw[adjusted_raw["text"]!=""].groupby(['chapter', 'section', 'chapter_index'], sort=False)['text'].apply(' '.join).reset_index()
+
+    return adjusted_raw, agg, raw_gaps
+
+
+def skipfixes(raw_fix_pair):
+    """    
+    This function serves two purposes. First, it integrates changes made in the
+    manual review process following the first round of automatic fixes to the raw
+    file of each volume. It is important to note that the "chapnumfix" files were
+    converted from .xlsx to .csv before this step. 
+    
+    Second, the function identifies chapters preceded by 
+    numbering gaps and parses the text of the chapter immediately before them 
+    for chapter headers that may have been missed by the original splitting process. 
+    
+    Previous to this step, the gaps were identified and marked by manual 
+    reviewers. In short, the function receives as arguments both a raw file 
+    and a "chapnumfixes" file for a given volume. After integrating the manual
+    corrections made in this file, the function iterates through all chapters
+    marked as being preceded by gaps. It then parses the text of chapters directly
+    preceding each of these "gap" chapters and tries to identify chapter headers
+    that may have been missed by the original splitting script. It does so by
+    utilizing looser regular expressions and by searching for numbers that match
+    those of the missing chapters. If missing chapters are identified, changes
+    are made directly to the raw file of the volume in question.
+    
+    The function also collects metadata about chapters identified and corrections
+    made. This metadata is compiled for each volume into a dictionary. Each of
+    these volume-level dictionaries are then used to generate rows for a 
+    corpus-level report intended to document the outcomes of the script.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    raw_fix_pair (list)         : Contains the string filepaths for both the 
+                                  raw file and the "chapnumfixes" file for a 
+                                  given volume.
+
+    Returns
+    --------------------------------------------------------------------------
+    gap_fix_dict (dict)         : A dictionary containing the following
+                                  information, to be included as a row 
+                                  in a corpus-level report: the volume filename
+                                  (str), and a list containing a description
+                                  of the gap (str - "gap_title"), the chapter
+                                  numbers of the missing chapters (list - 
+                                  "possible_cor_nums"), and a list of potential
+                                  correction candidates (list - "candidate_list"),
+                                  the latter containing the candidate's chapter's
+                                  title and starting index in the raw file.
+    """
+        
+    #load files & create dataframes
+    rawfile = raw_fix_pair[0]
+    fixfile = raw_fix_pair[1]
+    
+    print(os.path.basename(rawfile))
+    
+    raw_df = read_stage(rawfile, encoding='utf-8')
+    fix_df = pd.read_csv(fixfile, encoding='utf-8', low_memory=False)
+
+    adjusted_raw, agg, raw_gaps = fix_skips(raw_df, fix_df)
+
+    # Add the filename and volume-level list of gap information to a dictionary
+    gap_fix_dict = {'file': rawfile, 'gaplist':raw_gaps}
     
-    #output new raw and agg files to .csv
-    raw_outname = rawfile.replace("_output.csv", "_output_chapadjusted.csv")
+    #output new raw and agg files
+    raw_outname = stage_path(rawfile, "_output", "_output_chapadjusted")
     raw_outname = raw_outname.replace("./agg_raw_indices/outputs/raw/", "./skip_fixes/raw/")
-    agg_outname = rawfile.replace("_output.csv", "_aggregated_chapadjusted.csv")
+    agg_outname = stage_path(rawfile, "_output", "_aggregated_chapadjusted")
     agg_outname = agg_outname.replace("./agg_raw_indices/outputs/raw/", "./skip_fixes/agg/")
     
     
-    adjusted_raw.to_csv(raw_outname, index=False, encoding="utf-8-sig")
-    agg.to_csv(agg_outname, index=False, encoding="utf-8-sig")
+    write_stage(adjusted_raw, raw_outname, encoding="utf-8-sig")
+    write_stage(agg, agg_outname, encoding="utf-8-sig")
     
     #return dictionary so that all can be written to file for future reference about which fixes were made, which weren't, etc.
     return gap_fix_dict
@@ -230,7 +273,7 @@ def skipfixes(raw_fix_pair):
 
 
 
-def generate_report(gap_fix_dict_list):
+def generate_report(gap_fix_dict_list, outname="skip_fixes_report.csv"):
     """    
     This function generates a corpus-level report file for the corrections made
     by the 'skipfixes' function. Each row contains an estimated total number 
@@ -246,6 +289,7 @@ def generate_report(gap_fix_dict_list):
                                   in each. The dictionaries contain information
                                   for each volume that will be used to compile
                                   an individual row for the report. 
+    outname (str)               : The report file path
 
     Returns
     --------------------------------------------------------------------------
@@ -260,7 +304,7 @@ def generate_report(gap_fix_dict_list):
         meta_d = {}
         #get the file name in which the fixes have been made. Shorten as much as possible
         file = os.path.basename(i['file'])
-        file = file.replace("_output.csv", "")
+        file = os.path.splitext(file)[0].replace("_output", "")
         meta_d['file']=file
 
         # get the total number of gaps found in that volume (CAN BE ZERO)
@@ -303,7 +347,7 @@ def generate_report(gap_fix_dict_list):
 
     # Output the compiled report to .csv
     meta_df = pd.DataFrame(meta_fixes)
-    meta_df.to_csv("skip_fixes_report.csv", index=False, encoding="utf-8-sig")
+    meta_df.to_csv(outname, index=False, encoding="utf-8-sig")
 
 
 
@@ -321,7 +365,7 @@ def main():
     fixfolder = "./new_chap_fixes_csv_indexed/"
     
     # Create filepath lists for both sets of files
-    raw_filelist = [(rawfolder + f) for f in os.listdir(raw_path) if f.endswith(".csv")]
+    raw_filelist = [(rawfolder + f) for f in os.listdir(raw_path) if is_stage_file(f)]
     fix_filelist = [(fixfolder + f) for f in os.listdir(fix_path) if f.endswith(".csv")]
     
     # Create a list of pairs, each containing the path for a raw file
@@ -331,9 +375,7 @@ def main():
         raw_fix_pairs.append([raw_filelist[i], fix_filelist[i]])
     
     # Run the 'skipfixes' function in parallel to reduce compute time
-    with joblib.parallel_backend(n_jobs=7,backend='loky'):
-        gap_fix_dict_list = joblib.Parallel(verbose=5)(
-        joblib.delayed(skipfixes)(pair) for pair in raw_fix_pairs)
+    gap_fix_dict_list = run_volumes(skipfixes, raw_fix_pairs, path_of=lambda pair: pair[0])
     
     # Generate the corpus-level report for this step
     generate_report(gap_fix_dict_list)
@@ -23,8 +23,71 @@ UNC Chapel Hill
 import pandas as pd
 import os
 import numpy as np
-import joblib
 import shutil
+from stage_io import read_stage, is_stage_file
+from scheduler import run_volumes
+
+def flag_rows(raw_df, fix_df):
+    """
+    Finds the rows of a volume's raw file that belong to chapters still
+    flagged in its "chapnumfixes" file, with their raw file index and the
+    Internet Archive jpeg/pdf urls of their pages.
+
+    Arguments
+    --------------------------------------------------------------------------
+    raw_df (pd.DataFrame)    : The volume's raw file
+    fix_df (pd.DataFrame)    : The volume's final "chapnumfixes" file
+
+    Returns
+    --------------------------------------------------------------------------
+    flag_df (pd.DataFrame)   : The "flag_rows" file (without its
+                               "rawfile_index" label), or None if no chapter
+                               is flagged
+    """
+
+    if not (fix_df['flag']==True).any():
+        return None
+
+    # Identify raw file rows assigned to "flagged" chapters and compile a new
+    # dataframe containing only these rows.
+    raw_df['chapter'] = raw_df['chapter'].replace(np.nan, '')
+    raw_df['section'] = raw_df['section'].replace(np.nan, '')
+    raw_df['text'] = raw_df['text'].replace(np.nan, '')
+    raw_df['chapter_index'] = raw_df['chapter_index'].replace(np.nan, '')
+    raw_df['flag'] = False
+
+    for i in range(0, fix_df.shape[0]):
+        idx = fix_df.iloc[i]["chapter_index"]
+        if fix_df.iloc[i]['flag']:
+            raw_df.loc[((raw_df["chapter_index"]==idx)), ["flag"]] = True
+
+    flag_df = raw_df[raw_df['flag']==True].copy()
+
+    # Add IA urls to flag_rows file
+    flag_df["vol"] = flag_df["name"].str.split(pat = "_")
+    flag_df["vol"] = flag_df["vol"].apply(lambda x: x[0])
+    flag_df['img_num'] = flag_df["name"].str.split(pat = "_")
+    flag_df['img_num'] = flag_df['img_num'].apply(lambda x: x[1].replace(".jp2", ""))
+    flag_df["jpg_url"] = "https://archive.org/download/" + flag_df["vol"] + "/" + flag_df["vol"] + "_jp2.zip/" + flag_df["vol"] + "_jp2%2F" + flag_df["name"] + "&ext=jpg"
+    flag_df["pdf_url"] = "https://archive.org/download/" + flag_df["vol"] + "/" + flag_df["vol"] + ".pdf#page=" + flag_df['img_num']
+
+    return flag_df[['text', 'name', 'chapter', 'section', 'jpg_url', 'pdf_url']]
+
+
+def write_manual_files(flag_df, fixfile, volume, outdir):
+    """
+    Writes a volume's "flag_rows" file to outdir/<volume>/ and copies its
+    "chapnumfixes" file next to it. Returns the files written.
+    """
+
+    outdir = os.path.join(outdir, volume)
+    os.makedirs(outdir, exist_ok=True)
+
+    fullname = os.path.join(outdir, volume + "_flag_rows.csv")
+    flag_df.to_csv(fullname, index_label="rawfile_index")
+    shutil.copy2(fixfile, outdir)
+    return [fullname, os.path.join(outdir, os.path.basename(fixfile))]
+
 
 def create_manual_files(raw_fix_pair):
     """    
@@ -64,53 +127,18 @@ def create_manual_files(raw_fix_pair):
     rawfile = raw_fix_pair[0]
     fixfile = raw_fix_pair[1]
     volume = (os.path.basename(rawfile))
-    volume = volume.replace("_output_chapadjusted_rd2.csv", "")
+    volume = os.path.splitext(volume)[0].replace("_output_chapadjusted_rd2", "")
 
-    raw_df = pd.read_csv(rawfile, encoding='utf-8', low_memory=False)
+    raw_df = read_stage(rawfile, encoding='utf-8')
     fix_df = pd.read_excel(fixfile, encoding='utf-8')
 
-    # Identify raw file rows assigned to "flagged" chapters and compile a new
-    # dataframe containing only these rows.
-    if (fix_df['flag']==True).any():
-
-        raw_df['chapter'] = raw_df['chapter'].replace(np.nan, '')
-        raw_df['section'] = raw_df['section'].replace(np.nan, '')
-        raw_df['text'] = raw_df['text'].replace(np.nan, '')
-        raw_df['chapter_index'] = raw_df['chapter_index'].replace(np.nan, '')
-        raw_df['flag'] = False
-
-        for i in range(0, fix_df.shape[0]):
-            idx = fix_df.iloc[i]["chapter_index"]
-            if fix_df.iloc[i]['flag']:
-                raw_df.loc[((raw_df["chapter_index"]==idx)), ["flag"]] = True
-
-        flag_df = raw_df[raw_df['flag']==True].copy()
-
-        # Add IA urls to flag_rows file
-        flag_df["vol"] = flag_df["name"].str.split(pat = "_")
-        flag_df["vol"] = flag_df["vol"].apply(lambda x: x[0])
-        flag_df['img_num'] = flag_df["name"].str.split(pat = "_")
-        flag_df['img_num'] = flag_df['img_num'].apply(lambda x: x[1].replace(".jp2", ""))
-        flag_df["jpg_url"] = "https://archive.org/download/" + flag_df["vol"] + "/" + flag_df["vol"] + "_jp2.zip/" + flag_df["vol"] + "_jp2%2F" + flag_df["name"] + "&ext=jpg"
-        flag_df["pdf_url"] = "https://archive.org/download/" + flag_df["vol"] + "/" + flag_df["vol"] + ".pdf#page=" + flag_df['img_num']
-
-
-        flag_df = flag_df[['text', 'name', 'chapter', 'section', 'jpg_url', 'pdf_url']]
-
-
-        # Output flag_rows file
-        # Copy the chapnumfixes file to the same location
-        outname = volume + "_flag_rows.csv"
-
-        outdir = "./manual_fixes/" + volume
-        if not os.path.exists(outdir):
-            os.mkdir(outdir)
-
-        fullname = os.path.join(outdir, outname)
-
-        flag_df.to_csv(fullname, index_label="rawfile_index")
-        shutil.copy2(fixfile, outdir)
+    # Output flag_rows file
+    # Copy the chapnumfixes file to the same location
+    flag_df = flag_rows(raw_df, fix_df)
+    if flag_df is not None:
+        write_manual_files(flag_df, fixfile, volume, "./manual_fixes/")
         
+
 def main():
     # Set directories for raw and "chapnumfixe" files
     raw_path = r"C:\Users\npbyers\Desktop\OTB\ChapNumFixes\chap_adjusted_raw_round2"
@@ -120,7 +148,7 @@ def main():
     fixfolder = "./chap_num_fixes_final/"
     
     # Create filepath lists for both sets of files
-    raw_filelist = [(rawfolder + f) for f in os.listdir(raw_path) if f.endswith(".csv")]
+    raw_filelist = [(rawfolder + f) for f in os.listdir(raw_path) if is_stage_file(f)]
     fix_filelist = [(fixfolder + f) for f in os.listdir(fix_path) if f.endswith(".xlsx")]
 
     # Create a list of pairs, each containing the path for a raw file
@@ -130,8 +158,7 @@ def main():
         raw_fix_pairs.append([raw_filelist[i], fix_filelist[i]])
     
     # Run the 'create_manual_files' function in parallel to reduce compute time
-    with joblib.parallel_backend(n_jobs=7,backend='loky'):
-        joblib.Parallel(verbose=5)(joblib.delayed(create_manual_files)(pair) for pair in raw_fix_pairs)
+    run_volumes(create_manual_files, raw_fix_pairs, path_of=lambda pair: pair[0])
 
 
 if __name__ == "__main__":
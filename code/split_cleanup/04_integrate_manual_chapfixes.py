@@ -22,48 +22,49 @@ UNC Chapel Hill
 
 import csv
 import pandas as pd
-import joblib
 import os
 import numpy as np
 from shutil import copyfile
+from stage_io import read_stage, write_stage, stage_path, is_stage_file, file_format
+from scheduler import run_volumes
 csv.field_size_limit(600000)
 
 
 
-def insert_tr_rows(insertion_idx, joined, transcribed_rows):
+def insert_tr_rows(joined, transcribed_rows, anchors):
     """    
     This function inserts new raw file rows created from transcribed text
-    into an existing raw file
+    into an existing raw file. All transcriptions are inserted at once: each
+    transcribed row is given a sort key that places it after its anchor row,
+    and the raw file and transcribed rows are put in that order together.
     
     Arguments
     --------------------------------------------------------------------------    
-    insertion_idx (int)                    : The original raw file index 
-                                             at which the new rows are to 
-                                             be inserted
-                                  
     joined (pandas.DataFrame)              : The new version of the raw 
                                              dataframe with "flag_rows" file 
-                                             edits and previous transcription 
-                                             insertions included
+                                             edits included
                                   
     transcribed_rows (pandas.DataFrame)    : A dataframe with rows
-                                             from transcribed text.
+                                             from transcribed text, in the
+                                             order they are inserted
+    anchors (numpy.ndarray)                : For each transcribed row, the
+                                             raw file index after which it
+                                             is inserted
     Returns
     --------------------------------------------------------------------------
-    N/A
+    df_result (pandas.DataFrame)           : The raw dataframe with the
+                                             transcribed rows inserted
     """
     
-    # Set the point at which the dataframe will be split
-    row_number = insertion_idx+1
-    
-    # Store the upper half of the original dataframe
-    df1 = joined[0:row_number] 
+    # Raw file rows keep their place; transcribed rows follow their anchor
+    # row, in the order they were given
+    rows = joined.shape[0]
+    position = np.concatenate([np.arange(rows), anchors])
+    after = np.concatenate([np.zeros(rows, dtype=int), np.arange(1, len(anchors)+1)])
+    order = np.lexsort((after, position))
    
-    # Store the lower half of the original dataframe
-    df2 = joined[row_number:] 
-   
-    # Concat the upper half, the newly transcribed rows, and the lower half
-    df_result = pd.concat([df1, transcribed_rows, df2]) 
+    # Concat the raw file and the newly transcribed rows, in sort key order
+    df_result = pd.concat([joined, transcribed_rows]).iloc[order]
    
     # Reassign the index labels 
     df_result.index = [*range(df_result.shape[0])] 
@@ -73,35 +74,29 @@ def insert_tr_rows(insertion_idx, joined, transcribed_rows):
 
 
 
-def fix_integration(fix_dict):
-    """    
-    This function adds all changes made in the flag_rows files to new versions
-    of the raw files. It then inserts all text transcribed by manual reviewers
-    as new rows in the raw file. It then outputs .csv versions of the new raw
-    and aggregate files.
-    
+def aggregate(raw_df):
+    """A volume's aggregate file: the text of each section of its raw file."""
+    return raw_df[raw_df["text"]!=""].groupby(['chapter', 'section', 'chapter_index'], sort=False)['text'].apply(' '.join).reset_index()
+
+
+def integrate_fixes(raw_df, flag_rows_df, fix_df):
+    """
+    Applies the changes manual reviewers made in a volume's flag_rows file to
+    its raw file, inserts their transcriptions as new rows and builds the new
+    aggregate file.
+
     Arguments
-    --------------------------------------------------------------------------    
-    fix_dict (dict)         : Contains filepaths for both the raw ('raw' - str)
-                              and flag_rows ('flag_rows' - str) files as well as
-                              the rows in the corpus-level manual fix file that
-                              relate to the volume in question
-                              ('fixes' - pandas.DataFrame)
+    --------------------------------------------------------------------------
+    raw_df (pd.DataFrame)    : The volume's raw file
+    flag_rows_df (pd.DataFrame): The volume's reviewed flag_rows file
+    fix_df (pd.DataFrame)    : The rows of the corpus-level manual fix file
+                               for the volume
+
     Returns
     --------------------------------------------------------------------------
-    N/A
-    """    
-    
-    # build/prep the three necessary dataframes from a given volume.
-    # fix_dict contains:
-    # 1. The path to the old raw file
-    # 2. The path to the flag_rows file
-    # 3. A slice of the fixes file with only the rows pertaining to that volume
-    raw_file = fix_dict['raw']
-    flag_rows_file = fix_dict['flag_rows']
-    fix_df = fix_dict['fixes']
-    raw_df = pd.read_csv(raw_file, encoding='utf-8', low_memory=False)
-    flag_rows_df = pd.read_csv(flag_rows_file, encoding='utf-8', low_memory=False)
+    joined (pd.DataFrame)    : The new raw file
+    agg (pd.DataFrame)       : The new aggregate file
+    """
 
     fix_df['transcription_ID'] = fix_df['transcription_ID'].replace(np.nan, '')
     fix_df['transcription_index'] = fix_df['transcription_index'].replace(np.nan, '')
@@ -133,75 +128,116 @@ def fix_integration(fix_dict):
     del joined["jpg_url"]
     del joined["pdf_url"]
     
-    # make a list of the unique transcription IDs so groups of multiple 
-    # transcribed chapters/transcriptions can be inserted into the new raw 
-    # dataframe in blocks
-    transcriptions = [i for i in list(fix_df.transcription_ID.unique()) if i != '']
-
     # Add markers at each index that requires a transcription directly beneath it BEFORE
     # any transcribed rows are added. That way the new rows can be added based on the markers
     # and not based on indices that will change with each insertion.
     transcription_ID_idx_pairs = fix_df.loc[:, ['transcription_index', 'transcription_ID']].copy().drop_duplicates()
     transcription_ID_idx_pairs = transcription_ID_idx_pairs[transcription_ID_idx_pairs['transcription_index']!='']
-    joined['transcription_here'] = ""
+    # Markers are written to an array and set as one column, rather than with
+    # a df.loc write per marker
+    markers = np.full(len(joined), "", dtype=object)
     for idx, row in transcription_ID_idx_pairs.iterrows():
-        insert_idx = row['transcription_index']
-        joined.loc[insert_idx, ['transcription_here']] = row['transcription_ID']
+        markers[int(row['transcription_index'])] = row['transcription_ID']
+    joined['transcription_here'] = markers
+
+    # Each transcription goes after the first row marked with its ID
+    first_marked = {}
+    for i in np.flatnonzero(markers != "").tolist():
+        first_marked.setdefault(markers[i], i)
 
         
         
     # Insert transcribed text into the new version of the raw file. Transcribed
-    # text strings are split into a dataframe with a row for each word. This new
-    # transcribed dataframe is then inserted into the raw file using the 
-    # 'insert_tr_rows' function     
-    for t in transcriptions:
-        insertion_idx = joined.index[joined['transcription_here']==t][0]
-        rows = []
-        for i in range(0, fix_df.shape[0]):
-            if fix_df.iloc[i]['transcription_ID']==t:
-
-                #reconstruct image name
-                vol_name = fix_df.iloc[i]['Volume']
-                vol_base = vol_name[:vol_name.find("_")+1]
-                img_url = fix_df.iloc[i]['Affected image jpg url']
-                img_num=img_url[img_url.rfind("_")+1:].replace('.jp2&ext=jpg', '')
-                img_name = vol_base+img_num+".jp2"
-
-                chap = fix_df.iloc[i]['transcription_chapter']
-                sec = fix_df.iloc[i]['transcription_section']
-                text = fix_df.iloc[i]['transcription_text']
-                word_list = text.split()
-                for word in word_list:
-                    rows.append({"left":"", 
-                                  "top":"", 
-                                  "width":"", 
-                                  "height":"", 
-                                  "conf":100, 
-                                  "text":word, 
-                                  "name":img_name, 
-                                  "chapter":chap, 
-                                  "section":sec, 
-                                  "chapter_index":""})
-
-        transcribed_rows = pd.DataFrame(rows)
-
-        joined = insert_tr_rows(insertion_idx, joined, transcribed_rows)
+    # text strings are split into a row for each word. Groups of multiple
+    # transcribed chapters/transcriptions with the same transcription ID are
+    # inserted together as a block, and all blocks are inserted with one
+    # call to the 'insert_tr_rows' function
+    columns = {"text": [], "name": [], "chapter": [], "section": []}
+    anchors = []
+    transcribed = fix_df[fix_df['transcription_ID'] != '']
+    for t, tr_fix_df in transcribed.groupby('transcription_ID', sort=False):
+        insertion_idx = first_marked[t]
+        for vol_name, img_url, chap, sec, text in zip(tr_fix_df['Volume'],
+                                                      tr_fix_df['Affected image jpg url'],
+                                                      tr_fix_df['transcription_chapter'],
+                                                      tr_fix_df['transcription_section'],
+                                                      tr_fix_df['transcription_text']):
+
+            #reconstruct image name
+            vol_base = vol_name[:vol_name.find("_")+1]
+            img_num=img_url[img_url.rfind("_")+1:].replace('.jp2&ext=jpg', '')
+            img_name = vol_base+img_num+".jp2"
+
+            word_list = text.split()
+            columns["text"].extend(word_list)
+            columns["name"].extend([img_name] * len(word_list))
+            columns["chapter"].extend([chap] * len(word_list))
+            columns["section"].extend([sec] * len(word_list))
+            anchors.extend([insertion_idx] * len(word_list))
+
+    if len(anchors) > 0:
+        transcribed_rows = pd.DataFrame({"left": "",
+                                         "top": "",
+                                         "width": "",
+                                         "height": "",
+                                         "conf": 100,
+                                         "text": columns["text"],
+                                         "name": columns["name"],
+                                         "chapter": columns["chapter"],
+                                         "section": columns["section"],
+                                         "chapter_index": ""})
+        joined = insert_tr_rows(joined, transcribed_rows, np.array(anchors))
     
     # reset the chapter indices
     joined["chapter_index"] = ((joined["chapter"]!="") & ((joined["chapter"]!=joined["chapter"].shift(1)) | ((joined["section"] == "Chapter_Title") & (joined["section"]!=joined["section"].shift(1))))).cumsum()
     
     #create new agg file
-    agg = joined[joined["text"]!=""].groupby(['chapter', 'section', 'chapter_index'], sort=False)['text'].apply(' '.join).reset_index()
+    agg = aggregate(joined)
+
+    return joined, agg
+
+
+def fix_integration(fix_dict):
+    """    
+    This function adds all changes made in the flag_rows files to new versions
+    of the raw files. It then inserts all text transcribed by manual reviewers
+    as new rows in the raw file. It then outputs .csv versions of the new raw
+    and aggregate files.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    fix_dict (dict)         : Contains filepaths for both the raw ('raw' - str)
+                              and flag_rows ('flag_rows' - str) files as well as
+                              the rows in the corpus-level manual fix file that
+                              relate to the volume in question
+                              ('fixes' - pandas.DataFrame)
+    Returns
+    --------------------------------------------------------------------------
+    N/A
+    """    
+    
+    # build/prep the three necessary dataframes from a given volume.
+    # fix_dict contains:
+    # 1. The path to the old raw file
+    # 2. The path to the flag_rows file
+    # 3. A slice of the fixes file with only the rows pertaining to that volume
+    raw_file = fix_dict['raw']
+    flag_rows_file = fix_dict['flag_rows']
+    fix_df = fix_dict['fixes']
+    raw_df = read_stage(raw_file, encoding='utf-8')
+    flag_rows_df = pd.read_csv(flag_rows_file, encoding='utf-8', low_memory=False)
+
+    joined, agg = integrate_fixes(raw_df, flag_rows_df, fix_df)
 
-    #output new raw and agg files to .csv
-    raw_outname = raw_file.replace("_output_chapadjusted_rd2.csv", "_cleaned.csv")
+    #output new raw and agg files
+    raw_outname = stage_path(raw_file, "_output_chapadjusted_rd2", "_cleaned")
     raw_outname = raw_outname.replace("/chap_adjusted_raw_round2/", "/chap_cleaned_new/raw/")
-    agg_outname = raw_file.replace("_output_chapadjusted_rd2.csv", "_aggregated_cleaned.csv")
+    agg_outname = stage_path(raw_file, "_output_chapadjusted_rd2", "_aggregated_cleaned")
     agg_outname = agg_outname.replace("/chap_adjusted_raw_round2/", "/chap_cleaned_new/agg/")
 
     #output new raw/agg to file
-    joined.to_csv(raw_outname, index=False, encoding="utf-8")
-    agg.to_csv(agg_outname, index=False, encoding="utf-8")
+    write_stage(joined, raw_outname, encoding="utf-8")
+    write_stage(agg, agg_outname, encoding="utf-8")
 
 
 def main():
@@ -231,7 +267,7 @@ def main():
                 vol_list.append(folder)
     
     # Create a list of all old raw files
-    all_raw = [f for f in os.listdir(raw_path) if f.endswith(".csv")]
+    all_raw = [f for f in os.listdir(raw_path) if is_stage_file(f)]
     
     # Create a list of raw files for those volumes with corresponding flag_rows
     # files. These are the raw files that will be sent to the 'fix_integration'
@@ -241,10 +277,12 @@ def main():
     # volume are simply copied and pasted to the new "chap_cleaned" destination
     # directory.
     for i in all_raw:
-        base = i.replace("_output_chapadjusted_rd2.csv", "")
-        raw_outname_new = i.replace("_output_chapadjusted_rd2.csv", "_cleaned.csv")
-        agg_outname_new = i.replace("_output_chapadjusted_rd2.csv", "_aggregated_cleaned.csv")
-        agg_inname_old = i.replace("_output_chapadjusted_rd2.csv", "_aggregated_chapadjusted_rd2.csv")
+        # copied files keep their format
+        fmt = file_format(i)
+        base = os.path.splitext(i)[0].replace("_output_chapadjusted_rd2", "")
+        raw_outname_new = stage_path(i, "_output_chapadjusted_rd2", "_cleaned", fmt)
+        agg_outname_new = stage_path(i, "_output_chapadjusted_rd2", "_aggregated_cleaned", fmt)
+        agg_inname_old = stage_path(i, "_output_chapadjusted_rd2", "_aggregated_chapadjusted_rd2", fmt)
         if base in vol_list:
             raw_filelist.append(rawfolder+i)
         else:
@@ -271,8 +309,7 @@ def main():
     # Call the 'fix_integration' function using the dictionaries created above,
     # one for each volume with manual fixes to be integrated. This operation
     # is run in parallel to reduce compute time.
-    with joblib.parallel_backend(n_jobs=7,backend='loky'):
-        joblib.Parallel(verbose=5)(joblib.delayed(fix_integration)(fix_dict) for fix_dict in raw_flag_fix_dicts)
+    run_volumes(fix_integration, raw_flag_fix_dicts, path_of=lambda fix_dict: fix_dict['raw'])
         
         
 if __name__ == "__main__":
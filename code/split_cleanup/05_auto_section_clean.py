@@ -26,7 +26,11 @@ import pandas as pd
 import os
 from string import punctuation
 import numpy as np
-import joblib
+from bisect import bisect_right
+from relabel import run_starts
+from numbering_repair import repair_lags, NOT_REPAIRED, LAG1, LAG2, LAG3
+from stage_io import read_stage, write_stage, stage_path, is_stage_file
+from scheduler import run_volumes
 csv.field_size_limit(600000)
 
 def get_nums_from_str(shift_text):
@@ -57,39 +61,177 @@ def get_nums_from_str(shift_text):
     return unbroken_num
 
 
-def run_fixes(raw_file):
+def section_raw_num(section):
+    """
+    Reads the number from a section header, e.g. "12" from "Sec. 12.". 
+    Chapter titles are numbered 0.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    section (str)            : The section header
+                         
+    Returns
+    --------------------------------------------------------------------------
+    raw_num (str)            : The section number as a string, 0 for a 
+                               chapter title or np.nan if there is no number
+    
+    """
+    
+    if section == "Chapter_Title":
+        return 0
+    words = section.strip().split()
+    if len(words) > 1 and words[1].rstrip(punctuation).isnumeric():
+        return words[1].rstrip(punctuation)
+    return np.nan
+
+
+class SectionTable:
+    """
+    The sections of a volume, kept as runs of consecutive raw file rows with 
+    the same chapter and section.
+    
+    The fix operations in run_fixes used to relabel rows in the raw file and
+    then rebuild the section list from every row. Here they relabel runs, 
+    and refresh() merges runs that end up with the same label and 
+    recomputes section_index, raw_num and gap from the runs alone. The rows 
+    are relabelled once, by materialize().
+    
+    section_index follows the raw file calculation: it counts changes of 
+    section from one row to the next, grouped by chapter title.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    raw_df (pd.DataFrame)    : The raw file, with "chapter", "chapter_index"
+                               and "section" columns and a default index
+    
+    Methods
+    --------------------------------------------------------------------------
+    relabel                  : Relabel the run starting at a row.
+    
+    relabel_rows             : Relabel a range of rows, splitting runs.
+    
+    refresh                  : Merge runs and recompute section_index.
+    
+    sections                 : One row per run, as a pd.DataFrame.
+    
+    materialize              : Write section labels back to the raw file.
+    
+    """
+    
+    def __init__(self, raw_df):
+        starts = run_starts(raw_df['chapter_index'], raw_df['section'])
+        
+        self.rows = raw_df.shape[0]
+        self.starts = starts.tolist()
+        self.chapter = raw_df['chapter'].to_numpy(dtype=object)[starts].tolist()
+        self.chapter_index = raw_df['chapter_index'].to_numpy()[starts].tolist()
+        self.section = raw_df['section'].to_numpy(dtype=object)[starts].tolist()
+        self.raw_nums = []
+        self.refresh()
+    
+    def find(self, row):
+        """Position of the run containing a row."""
+        return bisect_right(self.starts, row) - 1
+    
+    def split(self, row):
+        """Start a new run at a row, with the same labels as its run."""
+        k = self.find(row)
+        if row < self.rows and self.starts[k] != row:
+            for col in (self.starts, self.chapter, self.chapter_index, self.section):
+                col.insert(k+1, col[k])
+            self.starts[k+1] = row
+    
+    def relabel(self, start, section):
+        """Relabel the section of the run starting at row 'start'."""
+        self.section[self.find(start)] = section
+    
+    def relabel_rows(self, first, last, section, raw_num=None):
+        """
+        Relabel the section of rows 'first' to 'last' (inclusive), splitting 
+        the runs they start and end in. If raw_num is given, it is written 
+        to a "raw_num" column for those rows by materialize().
+        """
+        self.split(first)
+        self.split(last+1)
+        for k in range(self.find(first), self.find(last)+1):
+            self.section[k] = section
+        if raw_num is not None:
+            self.raw_nums.append((first, last, raw_num))
+    
+    def refresh(self):
+        """
+        Merge neighbouring runs with the same chapter and section, and 
+        recompute section_index.
+        """
+        keep = [k for k in range(len(self.starts)) if k == 0 or 
+                self.chapter_index[k] != self.chapter_index[k-1] or 
+                self.section[k] != self.section[k-1]]
+        if len(keep) < len(self.starts):
+            for col in ('starts', 'chapter', 'chapter_index', 'section'):
+                values = getattr(self, col)
+                setattr(self, col, [values[k] for k in keep])
+        
+        counts = {}
+        self.section_index = []
+        for k in range(len(self.starts)):
+            changed = k == 0 or self.section[k] != self.section[k-1]
+            counts[self.chapter[k]] = counts.get(self.chapter[k], 0) + changed
+            self.section_index.append(counts[self.chapter[k]])
+    
+    def sections(self, number_paratextual=True, gaps=False):
+        """
+        One row per run, indexed by the run's first row, with chapter, 
+        chapter_index, section, section_index and raw_num columns. 
+        Paratextual sections are numbered 0 if number_paratextual is True. 
+        If gaps is True, raw_num is converted to float and a "gap" column 
+        gives the difference from the previous section's number in the 
+        chapter.
+        """
+        sections = pd.DataFrame({'chapter': self.chapter,
+                                 'chapter_index': self.chapter_index,
+                                 'section': self.section,
+                                 'section_index': self.section_index},
+                                index=self.starts)
+        sections['raw_num'] = sections['section'].apply(section_raw_num)
+        if number_paratextual:
+            sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
+        if gaps:
+            sections['raw_num'] = sections['raw_num'].astype(float)
+            sections["gap"] = sections.groupby('chapter_index').raw_num.diff(1)
+        return sections
+    
+    def materialize(self, raw_df):
+        """
+        Write the runs' section and section_index to the raw file rows, and 
+        the section numbers given to relabel_rows to a "raw_num" column.
+        """
+        lengths = np.diff(self.starts + [self.rows])
+        raw_df['section'] = np.repeat(np.array(self.section, dtype=object), lengths)
+        raw_df['section_index'] = np.repeat(np.array(self.section_index, dtype=np.int64), lengths)
+        for first, last, raw_num in self.raw_nums:
+            raw_df.loc[first:last, "raw_num"] = raw_num
+
+
+def section_fixes(raw_df, vol):
     """    
-    Parses the section information in each volume. Attempts to identify and 
-    correct potential section split errors. The function consists of 10 
-    separate operations run in sequence, each of which attempts to solve a 
-    different type of potential section split error. Once all operations have 
-    run, new 'raw' and aggregate files are compiled and exported to .csv.
-    Along with these two new files (one set for each volume), information for 
-    two separate corpus-level report files is compiled during the processing 
-    of each volume. One consists of fix metadata detailing the number of 
-    corrections made by each operation, the number of remaining errors, etc. 
-    The second file consists of all section rows from the entire corpus for 
-    all chapters containing sections with suspicious gaps. This second file 
-    is used to identify areas where potentially easy manual corrections could 
-    be made following the automatic cleanup process.
+    Runs the 10 section fix operations on a single volume (see run_fixes).
     
     Arguments
     --------------------------------------------------------------------------    
-    raw_file (str)           : The "raw" file path for a single volume
+    raw_df (pd.DataFrame)    : The volume's raw file
+    vol (str)                : The volume name, for the reports
                          
     Returns
     --------------------------------------------------------------------------
-    report_row (dict)        : The fix report metadata for the entire volume. 
-                               Also contains a list of dictionaries containing 
-                               section information for chapters containing at 
-                               least one section with a suspicious gap.
+    raw_df (pd.DataFrame)    : The new raw file
+    agg (pd.DataFrame)       : The new aggregate file
+    report_row (dict)        : The fix report metadata for the volume (see
+                               run_fixes)
     
     """
     
     fixes = 0
 
-    raw_df = pd.read_csv(raw_file, encoding='utf-8', low_memory=False)
-
     raw_df['chapter'] = raw_df['chapter'].replace(np.nan, '')
     raw_df['section'] = raw_df['section'].replace(np.nan, '')
     if 'transcription_here' in raw_df.columns:
@@ -100,11 +242,10 @@ def run_fixes(raw_file):
     raw_df["chapter_index"] = (raw_df.chapter != raw_df.chapter.shift(1)).cumsum()
     raw_df['chapter_index'] = raw_df['chapter_index'].replace(np.nan, '')
 
-    #set section index
-    raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-
-    sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-    sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
+    #group rows into section runs and set section index. Fixes relabel runs
+    #in the table; the rows are only updated once all operations have run.
+    table = SectionTable(raw_df)
+    sections = table.sections(number_paratextual=False)
     chapters = sections.groupby('chapter_index')
 
     # Operation 1
@@ -126,17 +267,15 @@ def run_fixes(raw_file):
                             break
                         lag+=1
 
-                    raw_df.loc[((raw_df["section_index"]==chap_sects.iloc[i]['section_index']) & (raw_df["chapter_index"]==chap_sects.iloc[i]['chapter_index'])), ["section"]] = chap_sects.iloc[i-lag]['section']
+                    table.relabel(chap_sects.index[i], chap_sects.iloc[i-lag]['section'])
                     fixes+=1
                     non_numeric+=1
 
                 else:
                     continue
 
-    raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-    sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-    sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
-    sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
+    table.refresh()
+    sections = table.sections()
     chapters = sections.groupby('chapter_index')
 
     
@@ -156,15 +295,13 @@ def run_fixes(raw_file):
 
             if i!=0:
                 if section_full and not_one:
-                    raw_df.loc[((raw_df["section_index"]==chap_sects.iloc[i]['section_index']) & (raw_df["chapter_index"]==chap_sects.iloc[i]['chapter_index'])), ["section"]] = chap_sects.iloc[0]['section']
+                    table.relabel(chap_sects.index[i], chap_sects.iloc[0]['section'])
                     fixes += 1
                 else:
                     break
 
-    raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-    sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-    sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
-    sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
+    table.refresh()
+    sections = table.sections()
     chapters = sections.groupby('chapter_index')
 
     # 2.2 - Remove all "Section" splits following the first "Section 1"
@@ -185,16 +322,14 @@ def run_fixes(raw_file):
                             break
                         lag+=1
 
-                    raw_df.loc[((raw_df["section_index"]==chap_sects.iloc[i]['section_index']) & (raw_df["chapter_index"]==chap_sects.iloc[i]['chapter_index'])), ["section"]] = chap_sects.iloc[i-lag]['section']
+                    table.relabel(chap_sects.index[i], chap_sects.iloc[i-lag]['section'])
                     fixes += 1
                     external_refs+=1
 
 
 
-    raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-    sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-    sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
-    sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
+    table.refresh()
+    sections = table.sections()
     chapters = sections.groupby('chapter_index')
         
     # Operation 3
@@ -216,115 +351,34 @@ def run_fixes(raw_file):
                             break
                         lag+=1
 
-                    raw_df.loc[((raw_df["section_index"]==chap_sects.iloc[i]['section_index']) & (raw_df["chapter_index"]==chap_sects.iloc[i]['chapter_index'])), ["section"]] = chap_sects.iloc[i-lag]['section']
+                    table.relabel(chap_sects.index[i], chap_sects.iloc[i-lag]['section'])
                     fixes += 1
                     south_sept_fixes+=1
                 else:
                     continue
-    raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-    sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-    sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
-    sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
+    table.refresh()
+    sections = table.sections()
     chapters = sections.groupby('chapter_index')
 
     
-    # Operation 4
-    # Lag 3 fixes
-    lag3 = 0    
-    for b in chapters.groups.keys():
-        chap_sects = chapters.get_group(b)
-        if chap_sects.shape[0] > 7:
-            for row_num in range(3,chap_sects.shape[0]-3):
-
-                current_raw_num = int(chap_sects.iloc[row_num]['raw_num'])
-                minus_one = int(chap_sects.iloc[row_num-1]['raw_num'])
-                minus_two = int(chap_sects.iloc[row_num-2]['raw_num'])
-                minus_three = int(chap_sects.iloc[row_num-3]['raw_num'])
-                plus_one = int(chap_sects.iloc[row_num+1]['raw_num'])
-                plus_two = int(chap_sects.iloc[row_num+2]['raw_num'])
-                plus_three = int(chap_sects.iloc[row_num+3]['raw_num'])           
-
-                if current_raw_num != (plus_one-1) and current_raw_num != (minus_one+1):
-                    lag1_test = (plus_one-minus_one)==2
-                    lag2_test = (plus_two-minus_two)==4 and plus_two-plus_one==1
-                    lag3_test = (plus_three-minus_three)==6 and plus_three-plus_two==1
-
-                    if lag1_test and lag2_test and lag3_test:
-
-                        raw_df.loc[((raw_df["section_index"]==chap_sects.iloc[row_num]['section_index']) & (raw_df["chapter_index"]==chap_sects.iloc[row_num]['chapter_index'])), ["section"]] =  "Sec. " + str(minus_three+3) + "."
-                        fixes+=1
-                        lag3 += 1
-
-
-    raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-    sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-    sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
-    sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
-    chapters = sections.groupby('chapter_index')
-
-
-    # Operation 5
-    # Lag 2 fixes
-    lag2 = 0
-    for b in chapters.groups.keys():
-        chap_sects = chapters.get_group(b)
-        if chap_sects.shape[0] > 5:
-            for row_num in range(2,chap_sects.shape[0]-2):
-
-                current_raw_num = int(chap_sects.iloc[row_num]['raw_num'])
-                minus_one = int(chap_sects.iloc[row_num-1]['raw_num'])
-                minus_two = int(chap_sects.iloc[row_num-2]['raw_num'])
-                plus_one = int(chap_sects.iloc[row_num+1]['raw_num'])
-                plus_two = int(chap_sects.iloc[row_num+2]['raw_num'])        
-
-                if current_raw_num != (plus_one-1) and current_raw_num != (minus_one+1):
-                    lag1_test = (plus_one-minus_one)==2
-                    lag2_test = (plus_two-minus_two)==4 and plus_two-plus_one==1
-
-                    if lag1_test and lag2_test:
-
-                        raw_df.loc[((raw_df["section_index"]==chap_sects.iloc[row_num]['section_index']) & (raw_df["chapter_index"]==chap_sects.iloc[row_num]['chapter_index'])), ["section"]] =  "Sec. " + str(minus_two+2) + "."
-                        fixes+=1
-                        lag2+=1
-
-
-    raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-    sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-    sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
-    sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
-    chapters = sections.groupby('chapter_index')
-
-
-    # Operation 6
-    # Lag 1 fixes
-    lag1 = 0
-    for b in chapters.groups.keys():
-        chap_sects = chapters.get_group(b)
-        if chap_sects.shape[0] > 3:
-            for row_num in range(1,chap_sects.shape[0]-1):
-
-                current_raw_num = int(chap_sects.iloc[row_num]['raw_num'])
-                minus_one = int(chap_sects.iloc[row_num-1]['raw_num'])
-                plus_one = int(chap_sects.iloc[row_num+1]['raw_num'])
-                
-                if current_raw_num != (plus_one-1) and current_raw_num != (minus_one+1):
-                    lag1_test = (plus_one-minus_one)==2
-
-                    if lag1_test:
-                        raw_df.loc[((raw_df["section_index"]==chap_sects.iloc[row_num]['section_index']) & (raw_df["chapter_index"]==chap_sects.iloc[row_num]['chapter_index'])), ["section"]] =  "Sec. " + str(minus_one+1) + "."
-                        fixes+=1
-                        lag1+=1
-
-    raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-    sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-    sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
-    sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
-    chapters = sections.groupby('chapter_index')
-
+    # Operations 4-6
+    # Lag 3, lag 2 and lag 1 fixes, for the sections of all chapters at once
+    # (see numbering_repair.py). Each test sees the numbers fixed by the one
+    # before it, as when they ran as separate operations.
+    nums = pd.to_numeric(sections['raw_num'], errors="coerce")
+    repaired, reason = repair_lags(nums, sections['chapter_index'], skip_short=True)
+    for start, num in zip(sections.index[reason != NOT_REPAIRED], repaired[reason != NOT_REPAIRED]):
+        table.relabel(start, "Sec. " + str(int(num)) + ".")
+
+    lag3 = int((reason == LAG3).sum())
+    lag2 = int((reason == LAG2).sum())
+    lag1 = int((reason == LAG1).sum())
+    fixes += lag3 + lag2 + lag1
 
     # generate "gap" data to find missing chapters for Operations 7-10
-    sections['raw_num'] = sections['raw_num'].astype(float)
-    sections["gap"] = chapters.raw_num.diff(1)
+    table.refresh()
+    sections = table.sections(gaps=True)
+    chapters = sections.groupby('chapter_index')
 
     # Operation 7
     # Fix suspicious number inserts based on gap info
@@ -341,18 +395,14 @@ def run_fixes(raw_file):
             except:
                 gap_after = 1
             if gap != 1 and gap != 0 and gap_before == 1 and gap_after == (gap+(-2*gap)+1):
-                raw_df.loc[((raw_df["section_index"]==sections.iloc[r]['section_index']) & (raw_df["chapter_index"]==sections.iloc[r]['chapter_index'])), ["section"]] =  sections.iloc[r-1]['section']
+                table.relabel(sections.index[r], sections.iloc[r-1]['section'])
                 fixes+=1
                 run_fixes+=1
                 weird_inserts+=1
 
-        raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-        sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-        sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
-        sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
-        sections['raw_num'] = sections['raw_num'].astype(float)
+        table.refresh()
+        sections = table.sections(gaps=True)
         chapters = sections.groupby('chapter_index')
-        sections["gap"] = chapters.raw_num.diff(1)
 
 
 
@@ -370,17 +420,13 @@ def run_fixes(raw_file):
         sec_three_as_eight = ((gap == 6 and num == 8) or (gap == 36 and num == 38)) and num_before == 2
 
         if sec_three_as_eight:
-            raw_df.loc[((raw_df["section_index"]==sections.iloc[r]['section_index']) & (raw_df["chapter_index"]==sections.iloc[r]['chapter_index'])), ["section"]] =  "Sec. 3."
+            table.relabel(sections.index[r], "Sec. 3.")
             fixes+=1
             one_two_eight+=1
 
-    raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-    sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-    sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
-    sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
-    sections['raw_num'] = sections['raw_num'].astype(float)
-    chapters = sections.groupby('chapter_index')
-    sections["gap"] = chapters.raw_num.diff(1)        
+    table.refresh()
+    sections = table.sections(gaps=True)
+    chapters = sections.groupby('chapter_index')        
 
 
 
@@ -413,19 +459,15 @@ def run_fixes(raw_file):
 
 
 
-                        raw_df.loc[((raw_df["section_index"]==sections.iloc[r]['section_index']) & (raw_df["chapter_index"]==sections.iloc[r]['chapter_index'])), ["section"]] =  "Sec. " + new_string
+                        table.relabel(sections.index[r], "Sec. " + new_string)
                         fixes+=1
                         three_eight_gaps+=1
 
                         break
 
-    raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-    sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-    sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
-    sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
-    sections['raw_num'] = sections['raw_num'].astype(float)
+    table.refresh()
+    sections = table.sections(gaps=True)
     chapters = sections.groupby('chapter_index')
-    sections["gap"] = chapters.raw_num.diff(1)
 
 
     # Operation 10
@@ -441,15 +483,15 @@ def run_fixes(raw_file):
         current_sec_index = row['section_index']
         current_chapter_index = row['chapter_index']
 
-        previous_sec = sections.loc[((sections["section_index"]==current_sec_index-1) & (sections["chapter_index"]==current_chapter_index)), :].reset_index()['section'][0]
-        previous_sec_index = current_sec_index-1
+        previous = sections.loc[((sections["section_index"]==current_sec_index-1) & (sections["chapter_index"]==current_chapter_index)), :]
+        previous_sec = previous['section'].iloc[0]
 
         candidate_list = []
         possible_cor_nums = [int(current_sec_num)-i for i in range(1,int(current_gap))]
         possible_cor_nums = list(reversed(possible_cor_nums))
 
 
-        prev_sec_rows = raw_df.loc[((raw_df["section_index"]==previous_sec_index) & (raw_df["chapter_index"]==current_chapter_index)), :].copy()
+        prev_sec_rows = raw_df.loc[previous.index[0]:idx1-1, :].copy()
         prev_sec_rows['shift_text'] = prev_sec_rows.text.shift(-1)
 
         sec_matches = prev_sec_rows[(prev_sec_rows['text'].str.match(r'(S|s)[a-zA-Z]{1,3}(\.|,|:|;){0,2}$')==True) &
@@ -488,35 +530,21 @@ def run_fixes(raw_file):
 
         for c in candidate_list:
             if "sug_cor_sec_num" in c:
-                raw_df.loc[c["missing_sec_start_index"]:idx1-1, "section"] = c["sug_sec_title"]
-                raw_df.loc[c["missing_sec_start_index"]:idx1-1, "raw_num"] = c["sug_cor_sec_num"]
+                table.relabel_rows(c["missing_sec_start_index"], idx1-1, c["sug_sec_title"], c["sug_cor_sec_num"])
                 skip_fixes+=1
                 fixes+=1
 
 
-    raw_df["section_index"] = (raw_df.section != raw_df.section.shift(1)).groupby(raw_df.chapter).cumsum()
-    sections = raw_df.loc[:, ['chapter', 'chapter_index', 'section', 'section_index']].drop_duplicates()
-    sections['raw_num'] = sections['section'].apply(lambda x: 0 if x == "Chapter_Title" else (x.strip().split()[1].rstrip(punctuation) if " " in x.strip() and x.strip().split()[1].rstrip(punctuation).isnumeric() else np.nan))
-    sections.loc[sections["section"]=="Paratextual", "raw_num"] = 0
-    sections['raw_num'] = sections['raw_num'].astype(float)
+    table.refresh()
+    sections = table.sections(gaps=True)
     chapters = sections.groupby('chapter_index')
-    sections["gap"] = chapters.raw_num.diff(1)
-
 
+    #write the section labels back to the rows
+    table.materialize(raw_df)
 
     #create new agg file
     agg = raw_df[raw_df["text"]!=""].groupby(['chapter', 'chapter_index', 'section', 'section_index'], sort=False)['text'].apply(' '.join).reset_index()
 
-    #output new raw and agg files to .csv
-    raw_outname = raw_file.replace("_cleaned_new.csv", "_round2.csv")
-    raw_outname = raw_outname.replace("/chap_clean_raw_agg/raw_new/", "/sec_clean_test/raw/")
-    agg_outname = raw_file.replace("_cleaned_new.csv", "_round2_agg.csv")
-    agg_outname = agg_outname.replace("/chap_clean_raw_agg/raw_new/", "/sec_clean_test/agg/")
-    #output new raw/agg to file
-    raw_df.to_csv(raw_outname, index=False, encoding="utf-8")
-    agg.to_csv(agg_outname, index=False, encoding="utf-8")
-
-
     # calculate statistics, compile report row dict
     gaps_remaining = sections['gap'].value_counts().keys().tolist()
     gap_counts = sections['gap'].value_counts().tolist()
@@ -541,7 +569,6 @@ def run_fixes(raw_file):
     else:
          percent_fixed = 100.00
     errors_remaining = two_gaps_left+(2*three_gaps_left)+other_gaps_left
-    vol = os.path.basename(raw_file).replace("_data_cleaned_new.csv", "")
 
     # Compile "weird chaps" list for potentially easy manual fixes
     # these are chapters containing suspicious gaps
@@ -581,24 +608,71 @@ def run_fixes(raw_file):
                   "weird_chaps": total_weird_chaps,
                   "weird_chaps_list": weird_chaps}
 
+    return raw_df, agg, report_row
+
+
+def run_fixes(raw_file):
+    """    
+    Parses the section information in each volume. Attempts to identify and 
+    correct potential section split errors. The function consists of 10 
+    separate operations run in sequence, each of which attempts to solve a 
+    different type of potential section split error. Once all operations have 
+    run, new 'raw' and aggregate files are compiled and exported to .csv.
+    Along with these two new files (one set for each volume), information for 
+    two separate corpus-level report files is compiled during the processing 
+    of each volume. One consists of fix metadata detailing the number of 
+    corrections made by each operation, the number of remaining errors, etc. 
+    The second file consists of all section rows from the entire corpus for 
+    all chapters containing sections with suspicious gaps. This second file 
+    is used to identify areas where potentially easy manual corrections could 
+    be made following the automatic cleanup process.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    raw_file (str)           : The "raw" file path for a single volume
+                         
+    Returns
+    --------------------------------------------------------------------------
+    report_row (dict)        : The fix report metadata for the entire volume. 
+                               Also contains a list of dictionaries containing 
+                               section information for chapters containing at 
+                               least one section with a suspicious gap.
+    
+    """
+    
+    raw_df = read_stage(raw_file, encoding='utf-8')
+    vol = os.path.splitext(os.path.basename(raw_file))[0].replace("_data_cleaned_new", "")
+
+    raw_df, agg, report_row = section_fixes(raw_df, vol)
+
+    #output new raw and agg files
+    raw_outname = stage_path(raw_file, "_cleaned_new", "_round2")
+    raw_outname = raw_outname.replace("/chap_clean_raw_agg/raw_new/", "/sec_clean_test/raw/")
+    agg_outname = stage_path(raw_file, "_cleaned_new", "_round2_agg")
+    agg_outname = agg_outname.replace("/chap_clean_raw_agg/raw_new/", "/sec_clean_test/agg/")
+    #output new raw/agg to file
+    write_stage(raw_df, raw_outname, encoding="utf-8")
+    write_stage(agg, agg_outname, encoding="utf-8")
 
     return report_row
 
 
-def main():
-    # set path for directory containing raw files
-    raw_path = r"C:\Users\npbyers\Desktop\OTB\SectNumFixes\chap_clean_raw_agg\raw_new"
+def write_reports(report_rows, out_dir):
+    """    
+    Writes the corpus-level "weird chaps" and fix report files from the
+    volumes' report rows.
     
-    # create filepath list for all raw files in above directory
-    rawfolder = "./chap_clean_raw_agg/raw_new/"
-    raw_filelist = [(rawfolder + f) for f in os.listdir(raw_path) if f.endswith(".csv")]
+    Arguments
+    --------------------------------------------------------------------------    
+    report_rows (list)       : The "report_row" dictionaries from run_fixes,
+                               one for each volume
+    out_dir (str)            : The folder for the report files
+                         
+    Returns
+    --------------------------------------------------------------------------
+    N/A
     
-    # run the 'run_fixes' function in parallel to minimize compute time
-    # Generates new "raw" and "aggregate" ("agg") files for each volume
-    # Compiles a list of all "report_row" dictionaries, one for each volume
-    with joblib.parallel_backend(n_jobs=7,backend='loky'):
-        report_rows = joblib.Parallel(verbose=5)(
-        joblib.delayed(run_fixes)(raw_file) for raw_file in raw_filelist)    
+    """
     
     # create list of all sections for all chapters
     # containing sections with suspicious gaps
@@ -608,16 +682,31 @@ def main():
         for i in row['weird_chaps_list']:
             weird_chap_master.append(i)
     weird_chap_df=pd.DataFrame(weird_chap_master)
-    weird_chap_df.to_csv(r"C:\Users\npbyers\Desktop\OTB\SectNumFixes\weird_chaps.csv", index=False)
-    weird_chap_df['vol'].value_counts()  
+    weird_chap_df.to_csv(os.path.join(out_dir, "weird_chaps.csv"), index=False)
 
     # Create dataframe containing all automatic fix metadata for each volume
     # Export to .csv for manual review and future reference
     report_df=pd.DataFrame(report_rows)
     report_df = report_df.drop('weird_chaps_list', 1)
-    report_df.to_csv(r"C:\Users\npbyers\Desktop\OTB\SectNumFixes\sec_clean_report.csv", index=False)
-       
+    report_df.to_csv(os.path.join(out_dir, "sec_clean_report.csv"), index=False)
+
+
+def main():
+    # set path for directory containing raw files
+    raw_path = r"C:\Users\npbyers\Desktop\OTB\SectNumFixes\chap_clean_raw_agg\raw_new"
     
+    # create filepath list for all raw files in above directory
+    rawfolder = "./chap_clean_raw_agg/raw_new/"
+    raw_filelist = [(rawfolder + f) for f in os.listdir(raw_path) if is_stage_file(f)]
     
+    # run the 'run_fixes' function in parallel to minimize compute time
+    # Generates new "raw" and "aggregate" ("agg") files for each volume
+    # Compiles a list of all "report_row" dictionaries, one for each volume
+    report_rows = run_volumes(run_fixes, raw_filelist)
+    
+    # Write the corpus-level report files
+    write_reports(report_rows, r"C:\Users\npbyers\Desktop\OTB\SectNumFixes")
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -16,30 +16,29 @@ UNC Chapel Hill
 
 
 import csv
-import pandas as pd
 import os
 import numpy as np
-import joblib
+from stage_io import read_stage, write_stage, stage_path, is_stage_file
+from scheduler import run_volumes
 csv.field_size_limit(600000)
 
 
-def generate_new(raw_file):
+def final_files(raw_df):
     """    
-    This function generates new aggregate files to reflect changes made in the
-    manual section error correction process. The final versions of these files
-    contain 
+    Resets a volume's chapter and section indices and builds its final
+    aggregate file, with the Internet Archive page image urls for the first
+    page of each section.
     
     Arguments
     --------------------------------------------------------------------------    
-    raw_file (str)           : The "raw" file path for a single volume
+    raw_df (pd.DataFrame)    : The volume's raw file
 
     Returns
     --------------------------------------------------------------------------
-    N/A
+    raw_df (pd.DataFrame)    : The final raw file
+    agg (pd.DataFrame)       : The final aggregate file
     """
 
-    raw_df = pd.read_csv(raw_file, encoding='utf-8', low_memory=False)
-
     raw_df['chapter'] = raw_df['chapter'].replace(np.nan, '')
     raw_df['section'] = raw_df['section'].replace(np.nan, '')
     raw_df['text'] = raw_df['text'].replace(np.nan, '')
@@ -68,36 +67,64 @@ def generate_new(raw_file):
     agg['img_num'] = agg['img_num'].apply(lambda x: x[1].replace(".jp2", ""))
     agg["first_jpg_url"] = "https://archive.org/download/" + agg["vol"] + "/" + agg["vol"] + "_jp2.zip/" + agg["vol"] + "_jp2%2F" + agg["first_jpeg"] + "&ext=jpg"
     agg["pdf_url"] = "https://archive.org/download/" + agg["vol"] + "/" + agg["vol"] + ".pdf#page=" + agg['img_num']
-    
-    
-
 
     # Remove extraneous columns from aggregate dataframe
     agg = agg.drop(columns=['first_jpeg', 'vol', 'img_num'])
 
-    #output new raw and agg files to .csv
-    raw_outname = raw_file.replace("_output.csv", "_output_final.csv")
+    return raw_df, agg
+
+
+def generate_new(raw_file, export_csv=False):
+    """    
+    This function generates new aggregate files to reflect changes made in the
+    manual section error correction process. The final versions of these files
+    contain 
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    raw_file (str)           : The "raw" file path for a single volume
+    export_csv (bool)        : If True, also write .csv copies of the final
+                               raw and aggregate files
+
+    Returns
+    --------------------------------------------------------------------------
+    N/A
+    """
+
+    raw_df = read_stage(raw_file, encoding='utf-8')
+    raw_df, agg = final_files(raw_df)
+
+    #output new raw and agg files
+    raw_outname = stage_path(raw_file, "_output", "_output_final")
     raw_outname = raw_outname.replace("/sec_clean/raw1/", "/sec_clean_final/raw/")
-    agg_outname = raw_file.replace("_output.csv", "_aggregated_output_final.csv")
+    agg_outname = stage_path(raw_file, "_output", "_aggregated_output_final")
     agg_outname = agg_outname.replace("/sec_clean/raw1/", "/sec_clean_final/agg/")
 
 
     #output new raw/agg to file
-    raw_df.to_csv(raw_outname, index=False, encoding="utf-8")
-    agg.to_csv(agg_outname, index=False, encoding="utf-8")
-        
+    write_stage(raw_df, raw_outname, encoding="utf-8")
+    write_stage(agg, agg_outname, encoding="utf-8")
+
+    # .csv copies of the final files for publishing
+    if export_csv == True:
+        write_stage(raw_df, stage_path(raw_outname, "", "", "csv"), encoding="utf-8")
+        write_stage(agg, stage_path(agg_outname, "", "", "csv"), encoding="utf-8")
+
+
 def main():
     # Set directory path locations for raw files
     raw_path = r"C:\Users\npbyers\Desktop\OTB\SectNumFixes\sec_clean\raw1"
     rawfolder = "./sec_clean/raw1/"
     
     # Create a list of all raw files
-    raw_filelist = [(rawfolder + f) for f in os.listdir(raw_path) if f.endswith(".csv")]
+    raw_filelist = [(rawfolder + f) for f in os.listdir(raw_path) if is_stage_file(f)]
+
+    # Also write the final files as .csv
+    export_csv = True
     
     # Create a new aggregate file using the 'generate_new' function.
     # This operation is run in parallel to reduce compute time.
-    with joblib.parallel_backend(n_jobs=7,backend='loky'):
-        joblib.Parallel(verbose=5)(joblib.delayed(generate_new)(raw_file) for raw_file in raw_filelist)
+    run_volumes(generate_new, raw_filelist, args=(export_csv,))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
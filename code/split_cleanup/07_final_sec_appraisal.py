@@ -25,41 +25,26 @@ import pandas as pd
 import os
 from string import punctuation
 import numpy as np
-import joblib
+from stage_io import read_stage, is_stage_file
+from scheduler import run_volumes
 csv.field_size_limit(600000)
 
 
-def error_check(raw_file):
+def appraise(raw_df, vol):
     """    
-    This function compiles information related to the section 'gaps' present in
-    a single volume. This information (total sections, chapters containing errors,
-    types of errors remaining, etc.) is then used to compile two corpus-level
-    report files to aid in future rounds of manual review. One, the 'meta' section
-    errors file, contains metadata related to the remaining errors (gaps) in each
-    volume of the corpus. The second, 'final_error_chap_rows.csv' consists of 
-    rows for all sections of all chapters in the corpus which still contain
-    sections preceded by 'gaps' after all of the previous cleanup steps. These
-    files will be used in future rounds of manual and automatic review to complete
-    the section cleanup process for the entire corpus.
+    Compiles the remaining section gap information for a single volume (see
+    error_check).
     
     Arguments
     --------------------------------------------------------------------------    
-    raw_file (str)           : The "raw" file path for a single volume
+    raw_df (pd.DataFrame)    : The volume's raw file
+    vol (str)                : The volume name, for the reports
 
     Returns
     --------------------------------------------------------------------------
-    report_row               : A dictionary containing the title of the volume,
-                               the total number sections, the total number of 
-                               chapters, the number of remaining section errors,
-                               the number of chapters containing section errors,
-                               and a list of dictionaries, one for each section,
-                               for all sections in chapters that still contain
-                               sections with 'gaps'.
+    report_row               : The volume's report row (see error_check)
     """
     
-    # Read in raw file
-    raw_df = pd.read_csv(raw_file, encoding='utf-8', low_memory=False)
-
     # eliminate np.nan from the raw dataframe
     raw_df['chapter'] = raw_df['chapter'].replace(np.nan, '')
     raw_df['section'] = raw_df['section'].replace(np.nan, '')
@@ -123,9 +108,7 @@ def error_check(raw_file):
     # Calculate 'errors remaining' to include missing chapters and 'other' errors,
     # as indicated by gaps with values other than 1, 2, or 3.
     errors_remaining = two_gaps_left+(2*three_gaps_left)+other_gaps_left
-    
-    # Extract the volume title
-    vol = os.path.basename(raw_file).replace("_data_cleaned_new.csv", "")
+
 
 
 
@@ -163,19 +146,58 @@ def error_check(raw_file):
     return report_row
 
 
-def main():
+def error_check(raw_file):
+    """    
+    This function compiles information related to the section 'gaps' present in
+    a single volume. This information (total sections, chapters containing errors,
+    types of errors remaining, etc.) is then used to compile two corpus-level
+    report files to aid in future rounds of manual review. One, the 'meta' section
+    errors file, contains metadata related to the remaining errors (gaps) in each
+    volume of the corpus. The second, 'final_error_chap_rows.csv' consists of 
+    rows for all sections of all chapters in the corpus which still contain
+    sections preceded by 'gaps' after all of the previous cleanup steps. These
+    files will be used in future rounds of manual and automatic review to complete
+    the section cleanup process for the entire corpus.
     
-    # Set raw file directory variables and create a list of all raw files
-    raw_path = r"C:\Users\npbyers\Desktop\OTB\SectNumFixes\final\raw"   
-    rawfolder = "./final/raw/"    
-    raw_filelist = [(rawfolder + f) for f in os.listdir(raw_path) if f.endswith(".csv")]
+    Arguments
+    --------------------------------------------------------------------------    
+    raw_file (str)           : The "raw" file path for a single volume
 
+    Returns
+    --------------------------------------------------------------------------
+    report_row               : A dictionary containing the title of the volume,
+                               the total number sections, the total number of 
+                               chapters, the number of remaining section errors,
+                               the number of chapters containing section errors,
+                               and a list of dictionaries, one for each section,
+                               for all sections in chapters that still contain
+                               sections with 'gaps'.
+    """
     
-    # Call the error_check function above, once for each volume, in parallel
-    # to decrease compute time.
-    with joblib.parallel_backend(n_jobs=7,backend='loky'):
-        report_rows = joblib.Parallel(verbose=5)(
-        joblib.delayed(error_check)(raw_file) for raw_file in raw_filelist)
+    # Read in raw file
+    raw_df = read_stage(raw_file, encoding='utf-8')
+
+    # Extract the volume title
+    vol = os.path.splitext(os.path.basename(raw_file))[0].replace("_data_cleaned_new", "")
+
+    return appraise(raw_df, vol)
+
+
+def write_reports(report_rows, out_dir):
+    """    
+    Writes the corpus-level error chapter and remaining errors report files
+    from the volumes' report rows.
+    
+    Arguments
+    --------------------------------------------------------------------------    
+    report_rows (list)       : The "report_row" dictionaries from error_check,
+                               one for each volume
+    out_dir (str)            : The folder for the report files
+
+    Returns
+    --------------------------------------------------------------------------
+    N/A
+    """
     
     # Compile the .csv file with all sections from all chapters containing
     # sections with unusual gaps (gaps with values other than 1, or 0 in 
@@ -185,13 +207,29 @@ def main():
         for i in row['error_chaps_list']:
             error_chap_master.append(i)    
     error_chap_df=pd.DataFrame(error_chap_master)
-    error_chap_df.to_csv(r"C:\Users\npbyers\Desktop\OTB\SectNumFixes\final_error_chap_rows.csv", index=False)
+    error_chap_df.to_csv(os.path.join(out_dir, "final_error_chap_rows.csv"), index=False)
     
     # Compile the .csv file with volume-level information about remaining errors
     # in the corpus as whole.
     report_df = pd.DataFrame(report_rows)   
     meta_df = report_df.drop('error_chaps_list', 1)    
-    meta_df.to_csv(r"C:\Users\npbyers\Desktop\OTB\SectNumFixes\remaining_sec_errors.csv", index=False)
+    meta_df.to_csv(os.path.join(out_dir, "remaining_sec_errors.csv"), index=False)
+
+
+def main():
+    
+    # Set raw file directory variables and create a list of all raw files
+    raw_path = r"C:\Users\npbyers\Desktop\OTB\SectNumFixes\final\raw"   
+    rawfolder = "./final/raw/"    
+    raw_filelist = [(rawfolder + f) for f in os.listdir(raw_path) if is_stage_file(f)]
+
+    
+    # Call the error_check function above, once for each volume, in parallel
+    # to decrease compute time.
+    report_rows = run_volumes(error_check, raw_filelist)
+    
+    # Write the corpus-level report files
+    write_reports(report_rows, r"C:\Users\npbyers\Desktop\OTB\SectNumFixes")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+@summary: Repairs single misread numbers in a list of chapter or section
+    numbers ("lag fixes"). Chapter cleanup (01_auto_chap_clean1.py) and
+    section cleanup (05_auto_section_clean.py) both use it.
+
+    A number is repaired when it doesn't follow on from either neighbour
+    but the numbers around it do, e.g. 4-5-6-[9]-8-9-10 becomes
+    4-5-6-7-8-9-10. The lag 3 test needs three consecutive numbers on each
+    side, the lag 2 test two and the lag 1 test one. Tests run in that
+    order, each on the numbers repaired by the one before.
+
+    The tests are computed for every number at once by comparing the
+    numbers with shifted copies of themselves. Segments (e.g. the sections
+    of each chapter) are repaired separately: a test is only made where
+    all the numbers it needs are in the same segment.
+
+    Run this file to check the repairs against the loop versions and time
+    both on the 1899 sample:
+
+        python numbering_repair.py [initial_agg_csv] [--repeat N]
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from string import punctuation
+
+
+# Reason codes returned with the repaired numbers
+NOT_REPAIRED = 0
+LAG1 = 1
+LAG2 = 2
+LAG3 = 3
+
+sample_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "examples",
+                           "split_cleanup", "1899_public_initial_agg.csv")
+
+
+def shifted(nums, k):
+    """nums[i+k] for each i, with NaN past either end."""
+    out = np.full(nums.shape[0], np.nan)
+    if k > 0:
+        out[:-k] = nums[k:]
+    elif k < 0:
+        out[-k:] = nums[:k]
+    else:
+        out[:] = nums
+    return out
+
+
+def repair_lags(nums, segments=None, lags=(3, 2, 1), sequential=False, skip_short=False):
+    """
+    Repairs single misread numbers with the lag 3, lag 2 and lag 1 tests.
+
+    Arguments
+    --------------------------------------------------------------------------
+    nums (array-like)        : Chapter or section numbers, NaN where there is
+                               no number
+    segments (array-like)    : A segment label for each number, e.g. its
+                               chapter_index. Rows of a segment must be
+                               consecutive. None for one segment.
+    lags (tuple)             : The tests to run, in order
+    sequential (bool)        : If True, a repair is seen by the tests of the
+                               numbers after it, as when the list is
+                               repaired in place one number at a time. This
+                               only changes the lag 1 test: a number right
+                               after a repaired one is not repaired.
+                               If False, each test only sees the numbers
+                               from before the test, as section cleanup
+                               does.
+    skip_short (bool)        : If True, segments with only one number that
+                               could be tested (2 * lag + 1 numbers) are
+                               skipped, as section cleanup does
+
+    Returns
+    --------------------------------------------------------------------------
+    repaired (np.ndarray)    : The numbers after repair, as floats
+    reason (np.ndarray)      : The lag test that repaired each number, or
+                               NOT_REPAIRED
+
+    """
+
+    nums = np.array(nums, dtype=float)
+    n = nums.shape[0]
+    reason = np.zeros(n, dtype=np.int8)
+
+    # position of each number in its segment, and its segment's length
+    if segments is None:
+        starts = np.array([0] if n else [], dtype=int)
+    else:
+        segments = np.asarray(segments)
+        new_segment = np.ones(n, dtype=bool)
+        new_segment[1:] = segments[1:] != segments[:-1]
+        starts = np.flatnonzero(new_segment)
+    lengths = np.diff(np.append(starts, n))
+    pos = np.arange(n) - np.repeat(starts, lengths)
+    length = np.repeat(lengths, lengths)
+
+    for lag in lags:
+        at = {k: shifted(nums, k) for k in range(-lag, lag+1) if k != 0}
+
+        testable = (pos >= lag) & (pos < length - lag)
+        if skip_short:
+            testable &= length > 2*lag + 1
+
+        # doesn't follow on from either neighbour
+        candidate = (nums != at[1] - 1) & (nums != at[-1] + 1)
+
+        # the numbers around it do
+        test = (at[1] - at[-1]) == 2
+        if lag >= 2:
+            test &= ((at[2] - at[-2]) == 4) & ((at[2] - at[1]) == 1)
+        if lag >= 3:
+            test &= ((at[3] - at[-3]) == 6) & ((at[3] - at[2]) == 1)
+
+        repair = testable & candidate & test
+
+        # In place, a lag 1 repair makes the next number follow on from it,
+        # so of a run of repairable numbers only every other one is repaired.
+        # (A lag 2 or 3 repair already needs its next numbers to follow on.)
+        if sequential and lag == 1:
+            idx = np.arange(n)
+            run_pos = idx - np.maximum.accumulate(np.where(repair, -1, idx)) - 1
+            repair &= (run_pos % 2) == 0
+
+        nums[repair] = at[-lag][repair] + lag
+        reason[repair] = lag
+
+    return nums, reason
+
+
+def repair_lags_reference(nums, segments=None, sequential=False, skip_short=False):
+    """
+    The loop version of repair_lags, as chapter and section cleanup used to
+    run it. Used to check repair_lags.
+    """
+
+    nums = np.array(nums, dtype=float)
+    reason = np.zeros(nums.shape[0], dtype=np.int8)
+    if segments is None:
+        bounds = [(0, nums.shape[0])]
+    else:
+        segments = list(segments)
+        starts = [i for i in range(len(segments)) if i == 0 or segments[i] != segments[i-1]]
+        bounds = list(zip(starts, starts[1:] + [len(segments)]))
+
+    for lag in (3, 2, 1):
+        before = nums.copy()
+        for first, stop in bounds:
+            if skip_short and stop - first <= 2*lag + 1:
+                continue
+            for row_num in range(first+lag, stop-lag):
+                x = nums if sequential else before
+                if x[row_num] != (x[row_num+1]-1) and x[row_num] != (x[row_num-1]+1):
+                    ok = (x[row_num+1]-x[row_num-1]) == 2
+                    if lag >= 2:
+                        ok = ok and (x[row_num+2]-x[row_num-2]) == 4 and x[row_num+2]-x[row_num+1] == 1
+                    if lag >= 3:
+                        ok = ok and (x[row_num+3]-x[row_num-3]) == 6 and x[row_num+3]-x[row_num+2] == 1
+                    if ok:
+                        nums[row_num] = x[row_num-lag]+lag
+                        reason[row_num] = lag
+
+    return nums, reason
+
+
+def header_num(header):
+    """The number in a chapter or section header, e.g. 12 in "Sec. 12.", or NaN."""
+    words = str(header).strip().split()
+    if len(words) > 1 and words[1].rstrip(punctuation).isnumeric():
+        return float(words[1].rstrip(punctuation))
+    return np.nan
+
+
+def benchmark(agg_file, repeat=1):
+    """
+    Checks repair_lags against the loop version and times both, for the
+    chapter numbers and the section numbers in an aggregate file.
+    """
+
+    agg = pd.read_csv(agg_file, encoding='utf-8-sig', keep_default_na=False)
+    agg = pd.concat([agg.assign(copy=i) for i in range(repeat)], ignore_index=True)
+
+    chapters = agg.loc[(agg['chapter'] != agg['chapter'].shift(1)) | (agg['copy'] != agg['copy'].shift(1))]
+    chapter_nums = pd.to_numeric(chapters['chapter'].str.split().str[1].str.rstrip(punctuation), errors="coerce")
+    section_nums = agg['section'].map(header_num).to_numpy()
+    section_segments = ((agg['chapter'] != agg['chapter'].shift(1)) | (agg['copy'] != agg['copy'].shift(1))).cumsum().to_numpy()
+
+    cases = [("chapters", chapter_nums.to_numpy(), None, True, False),
+             ("sections", section_nums, section_segments, False, True)]
+
+    for name, nums, segments, sequential, skip_short in cases:
+        t0 = time.perf_counter()
+        ref, ref_reason = repair_lags_reference(nums, segments, sequential, skip_short)
+        t1 = time.perf_counter()
+        new, new_reason = repair_lags(nums, segments, sequential=sequential, skip_short=skip_short)
+        t2 = time.perf_counter()
+
+        same = np.array_equal(ref, new, equal_nan=True) and np.array_equal(ref_reason, new_reason)
+        print("{}: {} numbers, {} repaired (lag3 {}, lag2 {}, lag1 {}), same as loop: {}".format(
+              name, len(nums), int((new_reason > 0).sum()), int((new_reason == LAG3).sum()),
+              int((new_reason == LAG2).sum()), int((new_reason == LAG1).sum()), same))
+        print("    loop {:.4f}s, vectorized {:.4f}s".format(t1 - t0, t2 - t1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the lag fixes on an aggregate file.")
+    parser.add_argument("agg_file", nargs="?", default=sample_file, help="aggregate file (default: 1899 sample)")
+    parser.add_argument("--repeat", type=int, default=1, help="copies of the file to run on")
+    args = parser.parse_args()
+    benchmark(args.agg_file, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,614 @@
+# -*- coding: utf-8 -*-
+"""
+@summary: Runs a sequence of the automatic split cleanup steps on each volume
+    without writing and re-reading the word-level files between steps. Each
+    volume is loaded once and passed from step to step in memory. Volumes
+    are run in parallel.
+
+    Stages, in workflow order, and the functions they run:
+
+        split           00_initial_ch_sec_split.split_volume
+        chapter_flags   01_auto_chap_clean1.chapter_flags
+        skip_fixes      02_auto_chap_clean2.fix_skips
+        manual_files    03_gen_manual_chapfix_files.flag_rows
+        transcriptions  04_integrate_manual_chapfixes.integrate_fixes
+        section_fixes   05_auto_section_clean.section_fixes
+        final           06_gen_final_agg.final_files
+        appraisal       07_final_sec_appraisal.appraise
+
+    Manual passes come between some of these stages: reviewers check the
+    chapter flags (Step 3), fix the chapters still flagged in the
+    manual_files "flag_rows" files and record their transcriptions (Step 5),
+    and review the section fixes (Step 7). The raw and aggregate files are written
+    ("checkpointed") only after stages whose output a manual pass needs, and
+    after the last stage that changes them. Other stages pass their output
+    on as the next step would read it from the file (stage_io.reload).
+    Checkpoints and reports therefore match what the step scripts write.
+
+    Usage:
+
+        python pipeline.py split chapter_flags --input ./ocr --out ./cleanup
+        python pipeline.py skip_fixes --input ./raw --fixes ./chap_fixes --out ./cleanup
+        python pipeline.py manual_files --input ./raw_rd2 --final-fixes ./chap_fixes_final --out ./cleanup
+        python pipeline.py transcriptions section_fixes final appraisal --input ./raw_rd2
+            --flag-rows ./fix_mats --transcriptions ./fix_mats/Chap_Error_Fixes_for_script.csv --out ./cleanup
+        python pipeline.py section_fixes final appraisal --input ./raw --out ./cleanup
+        python pipeline.py skip_fixes --input ./raw --fixes ./chap_fixes --out ./cleanup --dry-run
+        python pipeline.py section_fixes final --input ./raw --out ./cleanup --format csv
+
+    Files are written to a folder for each stage in the output folder, named
+    after the volume with the same endings the step scripts use. The
+    manual_files stage writes each volume's files to a folder of its own, as
+    03 does; reviewers edit copies of them in the --flag-rows folder.
+    Corpus-level reports are written to the "reports" folder.
+
+    Each volume has a manifest in the "manifests" folder. For each stage it
+    records a key made from the hashes of the stage's inputs (the input
+    file, or the key of the stage whose files it takes, and the manual fix
+    files it reads: the chapnumfixes file for skip_fixes and manual_files,
+    and the flag_rows file and the volume's transcriptions for
+    transcriptions), its code (the step script and the modules in this
+    folder it imports) and its parameters, along with the hashes of the files it
+    wrote. Reruns only run the stages whose key changed, or whose files or
+    report are missing, and the stages needed to rebuild their input from
+    the nearest checkpoint. Volumes with nothing to run are skipped and
+    their cached reports are used in the corpus-level reports. --dry-run
+    prints the stages that would run for each volume, and why, without
+    running them.
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import os
+import ast
+import json
+import hashlib
+import argparse
+import importlib
+import joblib
+import pandas as pd
+import stage_io
+from stage_io import read_stage, write_stage, reload, stage_ext, stage_path, is_stage_file
+from scheduler import run_volumes
+
+
+# stage: (step script, input file, raw file ending, aggregate file ending,
+#         encoding the step script writes its files with)
+stages = {"split": ("00_initial_ch_sec_split", "tsv", "_output", "_aggregated_ouput", "utf-8-sig"),
+          "chapter_flags": ("01_auto_chap_clean1", "agg", None, None, None),
+          "skip_fixes": ("02_auto_chap_clean2", "raw", "_output_chapadjusted", "_aggregated_chapadjusted", "utf-8-sig"),
+          "manual_files": ("03_gen_manual_chapfix_files", "raw", None, None, None),
+          "transcriptions": ("04_integrate_manual_chapfixes", "raw", "_cleaned", "_aggregated_cleaned", "utf-8"),
+          "section_fixes": ("05_auto_section_clean", "raw", "_round2", "_round2_agg", "utf-8"),
+          "final": ("06_gen_final_agg", "raw", "_output_final", "_aggregated_output_final", "utf-8"),
+          "appraisal": ("07_final_sec_appraisal", "raw", None, None, None)}
+
+# Stages whose raw and aggregate files a manual pass or a later step needs
+review_inputs = ["split", "skip_fixes", "section_fixes"]
+
+# Stages with a volume report for a corpus-level report
+report_stages = ["chapter_flags", "skip_fixes", "section_fixes", "appraisal"]
+
+# Manual fix inputs of the stages, and why a stage runs when one changes
+fix_inputs = {"fixes": "fix file changed",
+              "final_fixes": "final fix file changed",
+              "flag_rows": "flag rows file changed",
+              "transcriptions": "transcriptions changed"}
+
+# Endings removed from input file names to get the volume name
+name_endings = sorted(["_output", "_output_chapadjusted", "_output_chapadjusted_rd2", "_cleaned",
+                       "_cleaned_new", "_round2", "_output_final", "_aggregated_ouput",
+                       "_aggregated_chapadjusted", "_aggregated_chapadjusted_rd2",
+                       "_aggregated_cleaned", "_round2_agg", "_aggregated_output_final"],
+                      key=len, reverse=True)
+
+
+def volume_name(path):
+    """The volume name of an input file: its name without the extension or a step's ending."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    for ending in name_endings:
+        if name.endswith(ending):
+            return name[:len(name)-len(ending)]
+    return name
+
+
+def load_step(stage):
+    """Imports a stage's step script (the script names start with a number)."""
+    return importlib.import_module(stages[stage][0])
+
+
+def file_hash(path):
+    """The sha256 hash of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def text_hash(*parts):
+    """The sha256 hash of some values, as text."""
+    return hashlib.sha256("\n".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def code_files(module):
+    """The .py files in this folder a module is made of: its own and those of the modules it imports."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    files, todo = [], [module]
+    while len(todo) > 0:
+        name = todo.pop()
+        if name + ".py" in files:
+            continue
+        files.append(name + ".py")
+        with open(os.path.join(here, name + ".py"), encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                todo += [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                todo.append(node.module)
+        todo = [m for m in todo if os.path.exists(os.path.join(here, m + ".py"))]
+    return sorted(files)
+
+
+def code_hash(stage):
+    """The hash of the code a stage runs: its step script and the modules in this folder it imports."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    return text_hash(*[f + " " + file_hash(os.path.join(here, f)) for f in code_files(stages[stage][0])])
+
+
+class VolumePipeline:
+    """
+    Runs a sequence of automatic split cleanup stages on each volume in
+    memory.
+
+    Arguments
+    --------------------------------------------------------------------------
+    stage_list (list)        : Stage names, in workflow order
+    out_dir (str)            : The folder for checkpoints, chapter flags and
+                               reports
+    checkpoints (list)       : Stages whose raw and aggregate files are
+                               written. Default: the stages whose files a
+                               manual pass needs, and the last stage that
+                               changes them.
+    fix_dir (str)            : The folder of "chapnumfixes" .csv files, for
+                               skip_fixes. Each file's name must start with
+                               its volume's name.
+    export_csv (bool)        : If True, .csv copies of the final files are
+                               written too
+    final_fix_dir (str)      : The folder of final "chapnumfixes" .xlsx
+                               files, for manual_files. Each file's name must
+                               start with its volume's name.
+    flag_dir (str)           : The folder of reviewed flag_rows files, for
+                               transcriptions: <volume>/<volume>_flag_rows.csv
+    transcription_file (str) : The corpus-level manual fix file of
+                               transcriptions, for transcriptions
+    stage_format (str)       : The format of the raw and aggregate files
+                               written, "parquet", "arrow" or "csv". Default:
+                               stage_io.stage_format. Stages pass their
+                               output on as read back from this format.
+
+    Methods
+    --------------------------------------------------------------------------
+    plan                     : Find the stages that need to run for one
+                               volume.
+
+    run_volume               : Run the stages that need to run on one volume.
+
+    run                      : Run the stages on many volumes in parallel and
+                               write the corpus-level reports.
+
+    dry_run                  : Print the stages that would run for each
+                               volume.
+
+    """
+
+    def __init__(self, stage_list, out_dir, checkpoints=None, fix_dir=None, export_csv=False,
+                 final_fix_dir=None, flag_dir=None, transcription_file=None, stage_format=None):
+        unknown = [s for s in stage_list if s not in stages]
+        if len(unknown) > 0:
+            raise ValueError("Unknown stages: " + ", ".join(unknown))
+        positions = [list(stages).index(s) for s in stage_list]
+        if positions != sorted(set(positions)) or len(positions) == 0:
+            raise ValueError("Stages must be given once each, in workflow order: " + ", ".join(stages))
+        # Each stage needs the file its step script reads: the first stage
+        # reads the input file, later stages the files of the last stage
+        # before them that writes raw and aggregate files
+        available = {"agg"} if stages[stage_list[0]][1] == "agg" else {"raw"}
+        for i, stage in enumerate(stage_list):
+            if i > 0 and stages[stage][1] not in available:
+                raise ValueError(stage + " needs a " + stages[stage][1] + " file, which no stage before it makes. "
+                                 "Start the stages from " + stage + " instead.")
+            if stages[stage][2] is not None:
+                available = {"raw", "agg"}
+        if "skip_fixes" in stage_list and fix_dir is None:
+            raise ValueError("skip_fixes needs a folder of chapnumfixes files (fix_dir)")
+        if "manual_files" in stage_list and final_fix_dir is None:
+            raise ValueError("manual_files needs a folder of final chapnumfixes files (final_fix_dir)")
+        if "transcriptions" in stage_list and (flag_dir is None or transcription_file is None):
+            raise ValueError("transcriptions needs a folder of flag_rows files (flag_dir) and a manual fix file (transcription_file)")
+        if stage_format is None:
+            stage_format = stage_io.stage_format
+        if stage_format not in stage_io.extensions:
+            raise ValueError("Unknown stage format: " + stage_format)
+
+        self.stage_list = list(stage_list)
+        self.out_dir = out_dir
+        if checkpoints is None:
+            changes = [s for s in stage_list if stages[s][2] is not None]
+            checkpoints = [s for s in stage_list if s in review_inputs or s in changes[-1:]]
+        self.checkpoints = checkpoints
+        self.fix_dir = fix_dir
+        self.export_csv = export_csv
+        self.final_fix_dir = final_fix_dir
+        self.flag_dir = flag_dir
+        self.transcription_file = transcription_file
+        self.transcription_df = None
+        self.stage_format = stage_format
+        self.code = {s: code_hash(s) for s in stage_list}
+
+    def input_files(self, in_dir):
+        """The input files in a folder for the first stage."""
+        if stages[self.stage_list[0]][1] == "tsv":
+            return [os.path.join(in_dir, f) for f in sorted(os.listdir(in_dir)) if f.endswith(".tsv")]
+        return [os.path.join(in_dir, f) for f in sorted(os.listdir(in_dir)) if is_stage_file(f)]
+
+    def out_path(self, stage, vol, ending):
+        folder = os.path.join(self.out_dir, stage)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, vol + ending + stage_ext(self.stage_format))
+
+    def fix_file(self, vol, folder=None, ext=".csv"):
+        """A volume's chapnumfixes file in fix_dir (or another folder)."""
+        folder = self.fix_dir if folder is None else folder
+        for f in sorted(os.listdir(folder)):
+            if f.startswith(vol) and f.endswith(ext):
+                return os.path.join(folder, f)
+        raise FileNotFoundError("No chapnumfixes file for " + vol + " in " + folder)
+
+    def flag_rows_file(self, vol):
+        """A volume's reviewed flag_rows file in flag_dir, or None if it has none."""
+        path = os.path.join(self.flag_dir, vol, vol + "_flag_rows.csv")
+        return path if os.path.exists(path) else None
+
+    def transcriptions(self, vol):
+        """The rows of the manual fix file for a volume, as 04 passes them."""
+        if self.transcription_df is None:
+            self.transcription_df = pd.read_csv(self.transcription_file, encoding='utf-8', low_memory=False)
+        fix_df = self.transcription_df
+        return fix_df[fix_df['Volume']==vol].copy().reset_index()
+
+    def checkpoint(self, stage, vol, raw, agg):
+        """Write a stage's raw and aggregate files. Returns the files written."""
+        step, kind, raw_ending, agg_ending, encoding = stages[stage]
+        raw_outname = self.out_path(stage, vol, raw_ending)
+        agg_outname = self.out_path(stage, vol, agg_ending)
+        write_stage(raw, raw_outname, encoding=encoding)
+        write_stage(agg, agg_outname, encoding=encoding)
+        written = [raw_outname, agg_outname]
+        if self.export_csv == True and stage == "final":
+            written.append(stage_path(raw_outname, "", "", "csv"))
+            written.append(stage_path(agg_outname, "", "", "csv"))
+            write_stage(raw, written[2], encoding=encoding)
+            write_stage(agg, written[3], encoding=encoding)
+        return written
+
+    def manifest_path(self, vol, ending=".json"):
+        folder = os.path.join(self.out_dir, "manifests")
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, vol + ending)
+
+    def read_manifest(self, vol):
+        """A volume's manifest and cached reports (empty if it has none)."""
+        manifest = {"input_file": None, "stages": {}}
+        if os.path.exists(self.manifest_path(vol)):
+            with open(self.manifest_path(vol), encoding="utf-8") as f:
+                manifest = json.load(f)
+        reports = {}
+        if os.path.exists(self.manifest_path(vol, "_reports.pkl")):
+            reports = joblib.load(self.manifest_path(vol, "_reports.pkl"))
+        return manifest, reports
+
+    def write_manifest(self, vol, manifest, reports):
+        # Write to temporary files first so an interrupted run can't leave
+        # half a manifest
+        path = self.manifest_path(vol)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+        joblib.dump(reports, self.manifest_path(vol, "_reports.pkl.tmp"))
+        os.replace(self.manifest_path(vol, "_reports.pkl.tmp"), self.manifest_path(vol, "_reports.pkl"))
+        os.replace(path + ".tmp", path)
+
+    def stage_keys(self, path, vol):
+        """
+        The manifest entry each stage would have for a volume: the hashes of
+        its inputs, code and parameters, and a key made from them. A stage's
+        data input is the key of the last stage before it that changes the
+        raw and aggregate files, or the input file for the first stage.
+        """
+
+        data = file_hash(path)
+        entries = {}
+        for stage in self.stage_list:
+            inputs = {"data": data}
+            if stage == "skip_fixes":
+                inputs["fixes"] = file_hash(self.fix_file(vol))
+            elif stage == "manual_files":
+                inputs["final_fixes"] = file_hash(self.fix_file(vol, self.final_fix_dir, ".xlsx"))
+            elif stage == "transcriptions":
+                flag_file = self.flag_rows_file(vol)
+                inputs["flag_rows"] = None if flag_file is None else file_hash(flag_file)
+                inputs["transcriptions"] = text_hash(self.transcriptions(vol).to_csv(index=False))
+            params = {"stage_format": self.stage_format}
+            if stage == "final":
+                params["export_csv"] = self.export_csv
+            key = text_hash(stage, self.code[stage], json.dumps(inputs, sort_keys=True), json.dumps(params, sort_keys=True))
+            entries[stage] = {"key": key, "inputs": inputs, "code": self.code[stage], "params": params}
+            if stages[stage][2] is not None:
+                data = key
+        return entries
+
+    def stale_reason(self, stage, entry, old, reports):
+        """Why a stage needs to run for a volume, or None if it doesn't."""
+        if old is None:
+            return "not run before"
+        if old["code"] != entry["code"]:
+            return "code changed"
+        if old["params"] != entry["params"]:
+            return "parameters changed"
+        for name, reason in fix_inputs.items():
+            if old["inputs"].get(name) != entry["inputs"].get(name):
+                return reason
+        if old["inputs"]["data"] != entry["inputs"]["data"]:
+            return "input file changed" if stage == self.stage_list[0] else "earlier stage changed"
+        for f, h in old["outputs"].items():
+            f = os.path.join(self.out_dir, f)
+            if not os.path.exists(f) or file_hash(f) != h:
+                return "output missing or changed"
+        if stage in self.checkpoints and stages[stage][2] is not None and len(old["outputs"]) == 0:
+            return "not checkpointed"
+        if stage in report_stages and stage not in reports:
+            return "report missing"
+        return None
+
+    def plan(self, path):
+        """
+        Finds the stages that need to run for one volume.
+
+        Arguments
+        --------------------------------------------------------------------------
+        path (str)               : The volume's input file for the first stage
+
+        Returns
+        --------------------------------------------------------------------------
+        vol (str)                : The volume name
+        entries (dict)           : Stage -> its new manifest entry
+        run_list (list)          : The stages to run, in order
+        reasons (dict)           : Stage -> why it runs
+
+        """
+
+        vol = volume_name(path)
+        entries = self.stage_keys(path, vol)
+        manifest, reports = self.read_manifest(vol)
+
+        reasons = {}
+        for stage in self.stage_list:
+            reason = self.stale_reason(stage, entries[stage], manifest["stages"].get(stage), reports)
+            if reason is not None:
+                reasons[stage] = reason
+        if len(reasons) == 0:
+            return vol, entries, [], reasons
+
+        # Start from the files of the nearest stage before the first one to
+        # run that are up to date, or from the input file
+        positions = [self.stage_list.index(s) for s in reasons]
+        first, last = min(positions), max(positions)
+        run_from = 0
+        for i in range(first-1, -1, -1):
+            stage = self.stage_list[i]
+            if stages[stage][2] is not None and stage not in reasons and len(manifest["stages"][stage]["outputs"]) > 0:
+                run_from = i + 1
+                break
+
+        # Stages in between that change the files are run again to rebuild
+        # the later stages' input
+        run_list = []
+        for i in range(run_from, len(self.stage_list)):
+            stage = self.stage_list[i]
+            if stage not in reasons and stages[stage][2] is not None and i < last:
+                reasons[stage] = "input for a later stage"
+            if stage in reasons:
+                run_list.append(stage)
+
+        return vol, entries, run_list, reasons
+
+    def run_volume(self, path):
+        """
+        Runs the stages that need to run (see plan) on one volume and updates
+        its manifest.
+
+        Arguments
+        --------------------------------------------------------------------------
+        path (str)               : The volume's input file for the first stage:
+                                   a .tsv OCR output file for split, an
+                                   aggregate file for chapter_flags and a raw
+                                   file otherwise
+
+        Returns
+        --------------------------------------------------------------------------
+        reports (dict)           : Stage -> the volume's report for the
+                                   corpus-level report of that stage
+
+        """
+
+        vol, entries, run_list, reasons = self.plan(path)
+        manifest, reports = self.read_manifest(vol)
+        if len(run_list) == 0:
+            print(vol + ": up to date")
+            return {s: reports[s] for s in self.stage_list if s in reports}
+        print(vol + ": " + ", ".join(run_list))
+
+        # Load the files of the last stage before the first one to run that
+        # changes them, or the input file
+        before = [s for s in self.stage_list[:self.stage_list.index(run_list[0])] if stages[s][2] is not None]
+        raw, agg = None, None
+        if len(before) > 0:
+            step, kind, raw_ending, agg_ending, encoding = stages[before[-1]]
+            raw = read_stage(self.out_path(before[-1], vol, raw_ending), encoding=encoding)
+            agg = read_stage(self.out_path(before[-1], vol, agg_ending), encoding=encoding)
+        elif stages[self.stage_list[0]][1] == "tsv":
+            raw = pd.read_csv(path)
+        elif stages[self.stage_list[0]][1] == "agg":
+            agg = read_stage(path, encoding="utf-8-sig")
+        else:
+            raw = read_stage(path, encoding="utf-8")
+
+        manifest["input_file"] = os.path.abspath(path)
+        for stage in run_list:
+            step = load_step(stage)
+            written = []
+
+            if stage == "split":
+                raw, agg = step.split_volume(raw)
+            elif stage == "chapter_flags":
+                output, meta = step.chapter_flags(agg)
+                written.append(self.out_path(stage, vol, "_chapnumflags").replace(stage_ext(self.stage_format), ".xlsx"))
+                step.write_flags(output, written[0])
+                reports[stage] = dict({"agg_file": vol}, **meta)
+            elif stage == "skip_fixes":
+                fix_df = pd.read_csv(self.fix_file(vol), encoding='utf-8', low_memory=False)
+                raw, agg, raw_gaps = step.fix_skips(raw, fix_df)
+                reports[stage] = {'file': vol, 'gaplist': raw_gaps}
+            elif stage == "manual_files":
+                fixfile = self.fix_file(vol, self.final_fix_dir, ".xlsx")
+                # flag_rows changes the raw file it is given
+                flag_df = step.flag_rows(raw.copy(), pd.read_excel(fixfile))
+                if flag_df is not None:
+                    written = step.write_manual_files(flag_df, fixfile, vol, os.path.join(self.out_dir, stage))
+            elif stage == "transcriptions":
+                flag_file = self.flag_rows_file(vol)
+                if flag_file is not None:
+                    flag_df = pd.read_csv(flag_file, encoding='utf-8', low_memory=False)
+                    raw, agg = step.integrate_fixes(raw, flag_df, self.transcriptions(vol))
+                elif agg is None:
+                    # 04 copies the files of volumes without flag rows; the
+                    # aggregate file is rebuilt here as 02 built it
+                    agg = step.aggregate(raw.fillna({"chapter": "", "section": "", "text": "", "chapter_index": ""}))
+            elif stage == "section_fixes":
+                # 05 reports volumes without the "_data" ending
+                report_vol = vol[:-len("_data")] if vol.endswith("_data") else vol
+                raw, agg, reports[stage] = step.section_fixes(raw, report_vol)
+            elif stage == "final":
+                raw, agg = step.final_files(raw)
+            elif stage == "appraisal":
+                reports[stage] = step.appraise(raw, vol)
+
+            if stages[stage][2] is not None:
+                if stage in self.checkpoints:
+                    written = self.checkpoint(stage, vol, raw, agg)
+                # the next stage gets the files as it would read them
+                raw, agg = reload(raw, self.stage_format), reload(agg, self.stage_format)
+
+            outputs = {os.path.relpath(f, self.out_dir): file_hash(f) for f in written}
+            manifest["stages"][stage] = dict(entries[stage], outputs=outputs)
+
+        self.write_manifest(vol, manifest, reports)
+        return {s: reports[s] for s in self.stage_list if s in reports}
+
+    def run(self, paths, n_jobs=None, memory_budget=None):
+        """
+        Runs the stages on each volume in parallel, largest volume first (see
+        scheduler.run_volumes), then writes the corpus-level reports of the
+        stages that have them and the volumes' runtimes.
+
+        Arguments
+        --------------------------------------------------------------------------
+        paths (list)             : The volumes' input files (see run_volume)
+        n_jobs (int)             : Volumes run at once. Default: from the
+                                   cores and memory budget.
+        memory_budget (int)      : Memory (bytes) the workers may use together
+
+        Returns
+        --------------------------------------------------------------------------
+        N/A
+
+        """
+
+        report_dir = os.path.join(self.out_dir, "reports")
+        os.makedirs(report_dir, exist_ok=True)
+        results = run_volumes(self.run_volume, paths, n_jobs=n_jobs, memory_budget=memory_budget,
+                              report_file=os.path.join(report_dir, "volume_runtimes.csv"))
+
+        for stage in self.stage_list:
+            rows = [r[stage] for r in results if stage in r]
+            if len(rows) == 0:
+                continue
+            step = load_step(stage)
+            if stage == "chapter_flags":
+                pd.DataFrame(rows).to_csv(os.path.join(report_dir, "chap_nums_check.csv"))
+            elif stage == "skip_fixes":
+                step.generate_report(rows, os.path.join(report_dir, "skip_fixes_report.csv"))
+            else:
+                step.write_reports(rows, report_dir)
+
+    def dry_run(self, paths):
+        """
+        Prints the stages that would run for each volume, and why, without
+        running them.
+
+        Arguments
+        --------------------------------------------------------------------------
+        paths (list)             : The volumes' input files (see run_volume)
+
+        Returns
+        --------------------------------------------------------------------------
+        runs (dict)              : Volume -> the stages that would run
+
+        """
+
+        runs = {}
+        for path in paths:
+            vol, entries, run_list, reasons = self.plan(path)
+            runs[vol] = run_list
+            if len(run_list) == 0:
+                print(vol + ": up to date")
+            else:
+                print(vol + ": " + ", ".join(s + " (" + reasons[s] + ")" for s in run_list))
+        print(str(sum(len(r) > 0 for r in runs.values())) + " of " + str(len(runs)) + " volumes would run")
+        return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run automatic split cleanup stages on each volume in memory.")
+    parser.add_argument("stages", nargs="+", choices=list(stages), metavar="stage",
+                        help="stages to run, in order: " + ", ".join(stages))
+    parser.add_argument("--input", required=True, help="folder of input files for the first stage")
+    parser.add_argument("--out", required=True, help="output folder")
+    parser.add_argument("--fixes", help="folder of chapnumfixes .csv files (skip_fixes)")
+    parser.add_argument("--final-fixes", help="folder of final chapnumfixes .xlsx files (manual_files)")
+    parser.add_argument("--flag-rows", help="folder of reviewed flag_rows files, one folder per volume (transcriptions)")
+    parser.add_argument("--transcriptions", help="manual fix file of transcriptions (transcriptions)")
+    parser.add_argument("--checkpoint", nargs="+", choices=list(stages), metavar="stage",
+                        help="stages whose raw and aggregate files are written (default: those a manual pass needs, and the last that changes them)")
+    parser.add_argument("--jobs", type=int, help="volumes run at once (default: from the cores and memory budget)")
+    parser.add_argument("--memory", type=float, help="memory budget for all workers, in GB (default: 75%% of available memory)")
+    parser.add_argument("--format", choices=list(stage_io.extensions), default=stage_io.stage_format,
+                        help="format of the raw and aggregate files written (default: " + stage_io.stage_format + ")")
+    parser.add_argument("--export-csv", action="store_true", help="also write .csv copies of the final files")
+    parser.add_argument("--dry-run", action="store_true", help="print the stages that would run for each volume and stop")
+    args = parser.parse_args()
+
+    pipeline = VolumePipeline(args.stages, args.out, args.checkpoint, args.fixes, args.export_csv,
+                              args.final_fixes, args.flag_rows, args.transcriptions, args.format)
+    if args.dry_run:
+        pipeline.dry_run(pipeline.input_files(args.input))
+    else:
+        budget = None if args.memory is None else int(args.memory * 2**30)
+        pipeline.run(pipeline.input_files(args.input), args.jobs, budget)
+
+
+if __name__ == "__main__":
+    main()
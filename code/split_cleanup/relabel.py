@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+@summary: Shared helpers for relabelling rows of a raw file by range. The
+    cleanup scripts relabel whole chapters or sections at a time. Selecting
+    those rows with a boolean mask over the whole raw file for every fix
+    makes a volume's cleanup cost grow with words times fixes. Chapters and
+    sections are contiguous runs of rows, so these helpers find each run's
+    row range once and write labels to ranges instead.
+
+    run_starts               : First row of each run of equal values.
+
+    run_slices               : Row ranges of each value's runs.
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import numpy as np
+
+
+def run_starts(*columns):
+    """
+    Finds the first row of each run of rows with equal values in all of the
+    given columns.
+
+    Arguments
+    --------------------------------------------------------------------------
+    columns (pd.Series)      : Columns of the same raw file
+
+    Returns
+    --------------------------------------------------------------------------
+    starts (np.ndarray)      : Row positions where a new run starts,
+                               beginning with 0
+
+    """
+
+    rows = len(columns[0])
+    new_run = np.zeros(rows, dtype=bool)
+    new_run[:1] = True
+    for column in columns:
+        values = column.to_numpy(dtype=object)
+        new_run[1:] |= values[1:] != values[:-1]
+
+    return np.flatnonzero(new_run)
+
+
+def run_slices(column):
+    """
+    Maps each value in a column to the row ranges where it appears. Rows
+    with a missing value (NaN) are left out, as they never compare equal.
+
+    Arguments
+    --------------------------------------------------------------------------
+    column (pd.Series)       : A column of a raw file, e.g. chapter_index
+
+    Returns
+    --------------------------------------------------------------------------
+    slices (dict)            : Value -> list of (start, stop) row positions,
+                               in row order
+
+    """
+
+    starts = run_starts(column)
+    stops = np.append(starts[1:], len(column))
+    values = column.to_numpy(dtype=object)[starts]
+
+    slices = {}
+    for value, start, stop in zip(values, starts.tolist(), stops.tolist()):
+        if value == value:
+            slices.setdefault(value, []).append((start, stop))
+
+    return slices
+
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+@summary: Runs a split cleanup step on many volumes in parallel. The steps
+    used to run a joblib pool of 7 workers over the volumes in os.listdir
+    order, so one very large volume started last could hold up the whole
+    run, and several large volumes at once could run out of memory.
+
+    run_volumes starts the largest volumes first, so the small ones fill in
+    around them at the end. It sizes the pool from the available cores and
+    a memory budget: each volume's peak memory is estimated from its word
+    count, and the pool is only as large as the largest volumes can run at
+    once within the budget. At the end it prints each volume's runtime and
+    peak memory, slowest first, and can save them to a .csv file.
+
+    volume_words             : Word count of a stage or OCR output file.
+
+    memory_estimate          : Estimated peak memory of a worker running a
+                               volume.
+
+    pool_size                : Number of workers for a set of volumes.
+
+    run_volumes              : Run a function on each volume in parallel.
+
+    Peak memory is measured on Linux. Elsewhere the peak of the worker
+    process so far is reported, or nothing on Windows.
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import os
+import time
+import joblib
+import pandas as pd
+
+
+# Estimated memory of a worker with pandas loaded, and per word of a
+# volume at the step's peak (measured on steps 05-07: 300-400 bytes)
+worker_memory = 150 * 2**20
+bytes_per_word = 500
+
+# Average bytes per word (row) of .csv and .tsv files, for counting words
+# without reading the file
+text_bytes_per_word = 60
+
+# Share of the available memory the workers may use, when no budget is given
+memory_fraction = 0.75
+
+
+def volume_words(path):
+    """
+    The number of words (rows) in a volume's file. Parquet files store their
+    row count; for other files it is estimated from the file size.
+    """
+
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+            return pq.ParquetFile(path).metadata.num_rows
+        except ImportError:
+            pass
+    return os.path.getsize(path) // text_bytes_per_word
+
+
+def memory_estimate(words):
+    """The estimated peak memory (bytes) of a worker running a volume."""
+    return worker_memory + bytes_per_word * words
+
+
+def available_memory():
+    """The memory (bytes) available for new processes, or None if unknown."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def available_cores():
+    """The number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def pool_size(estimates, memory_budget=None, max_jobs=None):
+    """
+    Finds the number of workers for a set of volumes: one per core, fewer if
+    the largest volumes running at once would go over the memory budget.
+
+    Arguments
+    --------------------------------------------------------------------------
+    estimates (list)         : Estimated peak memory (bytes) of each volume
+    memory_budget (int)      : Memory (bytes) the workers may use together.
+                               Default: memory_fraction of the available
+                               memory, or no limit if that isn't known.
+    max_jobs (int)           : Upper limit on the number of workers.
+                               Default: the available cores.
+
+    Returns
+    --------------------------------------------------------------------------
+    n_jobs (int)             : The number of workers, at least 1
+
+    """
+
+    n_jobs = min(available_cores() if max_jobs is None else max_jobs, len(estimates))
+    if memory_budget is None:
+        available = available_memory()
+        if available is not None:
+            memory_budget = int(available * memory_fraction)
+    if memory_budget is not None:
+        # Volumes start largest first, so the first workers hold the
+        # largest volumes at once
+        largest = sorted(estimates, reverse=True)
+        fits = 1
+        while fits < n_jobs and sum(largest[:fits+1]) <= memory_budget:
+            fits += 1
+        n_jobs = min(n_jobs, fits)
+    return max(n_jobs, 1)
+
+
+def reset_peak():
+    """Resets the peak memory of this process (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_memory():
+    """
+    The peak memory (bytes) of this process since reset_peak, on Linux.
+    Elsewhere the peak since the process started, or None on Windows.
+    """
+
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def timed_call(func, item, args):
+    """Runs func(item, *args) in a worker, with its runtime and peak memory."""
+    reset_peak()
+    start = time.perf_counter()
+    result = func(item, *args)
+    return result, time.perf_counter() - start, peak_memory()
+
+
+def run_volumes(func, items, args=(), path_of=None, n_jobs=None, memory_budget=None, report_file=None):
+    """
+    Runs a function on each volume in parallel, largest volume first, and
+    prints each volume's runtime and peak memory.
+
+    Arguments
+    --------------------------------------------------------------------------
+    func (function)          : The function run on each volume, as
+                               func(item, *args)
+    items (list)             : One item per volume: a file path, or anything
+                               path_of gets the volume's file path from
+    args (tuple)             : Other arguments passed to func
+    path_of (function)       : Gets the file path to size a volume by from
+                               its item. Default: the item is the path.
+    n_jobs (int)             : Number of workers. Default: see pool_size.
+    memory_budget (int)      : Memory (bytes) the workers may use together
+                               (see pool_size)
+    report_file (str)        : If given, the runtime and memory report is
+                               also saved to this .csv file
+
+    Returns
+    --------------------------------------------------------------------------
+    results (list)           : func's return value for each item, in the
+                               order of items
+
+    """
+
+    paths = [item if path_of is None else path_of(item) for item in items]
+    words = [volume_words(path) for path in paths]
+    estimates = [memory_estimate(w) for w in words]
+    if n_jobs is None:
+        n_jobs = pool_size(estimates, memory_budget)
+    order = sorted(range(len(items)), key=lambda i: words[i], reverse=True)
+    print("Running " + str(len(items)) + " volumes on " + str(n_jobs) + " workers")
+
+    with joblib.parallel_backend(n_jobs=n_jobs, backend='loky'):
+        output = joblib.Parallel(verbose=5)(joblib.delayed(timed_call)(func, items[i], args) for i in order)
+
+    results = [None] * len(items)
+    rows = []
+    for i, (result, seconds, peak) in zip(order, output):
+        results[i] = result
+        rows.append({"volume": os.path.basename(paths[i]),
+                     "words": words[i],
+                     "estimate_mb": round(estimates[i] / 2**20),
+                     "seconds": round(seconds, 2),
+                     "peak_mb": None if peak is None else round(peak / 2**20)})
+
+    report = pd.DataFrame(rows, columns=["volume", "words", "estimate_mb", "seconds", "peak_mb"])
+    report = report.sort_values("seconds", ascending=False)
+    print(report.head(10).to_string(index=False))
+    print("Total " + str(round(report["seconds"].sum(), 1)) + "s over " + str(len(rows)) + " volumes, highest peak "
+          + str(report["peak_mb"].max()) + " MB")
+    if report_file is not None:
+        report.to_csv(report_file, index=False)
+
+    return results
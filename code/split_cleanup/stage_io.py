@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+@summary: Reads and writes the word-level ("raw") and aggregate files passed
+    between the split cleanup steps. By default these are Parquet files with
+    a fixed schema:
+
+        left, top, width, height, conf    int32
+        chapter, section, name            dictionary-encoded (categorical)
+        text                              string
+
+    Columns not in the schema are stored as numbers if every non-blank value
+    is a number, and as strings otherwise. Blank labels are stored as
+    missing values.
+
+    read_stage returns the same data frame for a file in any of the formats:
+    categorical columns come back as plain object (str) columns and blank
+    labels as NaN. The steps can keep relabelling rows with new chapter and
+    section names, and keep their replace(np.nan, '') calls. Only blank
+    values are missing values. Unlike pd.read_csv's defaults, .csv files are
+    read with words such as "NA", "null" or "nan" kept as text, as Parquet
+    and Arrow keep them, so the steps no longer blank those words.
+
+    The file format follows the extension: .parquet, .arrow (Arrow IPC /
+    Feather) or .csv. stage_format sets the format the steps write. Set it
+    to "csv" to run the steps on .csv files as before (pipeline.py takes it
+    as --format).
+
+    .csv copies of stage files can be made at the end of the process, or
+    existing .csv files converted to the stage format:
+
+        python stage_io.py export <file or folder> [--out folder]
+        python stage_io.py convert <file or folder> [--out folder]
+        python stage_io.py benchmark [raw_csv] [--repeat N]
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import io
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+# Format written by the split cleanup steps: "parquet", "arrow" or "csv"
+stage_format = "parquet"
+
+extensions = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+# Storage types for the raw file columns
+raw_schema = {"left": "int32",
+              "top": "int32",
+              "width": "int32",
+              "height": "int32",
+              "conf": "int32",
+              "chapter": "category",
+              "section": "category",
+              "name": "category",
+              "text": "string"}
+
+sample_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "examples",
+                           "split_cleanup", "1899_public_sample_raw.csv")
+
+
+def stage_ext(fmt=None):
+    """The file extension for a stage format (default: stage_format)."""
+    return extensions[fmt or stage_format]
+
+
+def is_stage_file(filename):
+    """True if a file name has a stage file extension (.parquet, .arrow, .csv)."""
+    return os.path.splitext(filename)[1] in extensions.values()
+
+
+def stage_path(path, old, new, fmt=None):
+    """
+    Replaces the end of a stage file's name and sets its extension, e.g.
+    stage_path("vol_output.csv", "_output", "_output_chapadjusted") gives
+    "vol_output_chapadjusted.parquet".
+
+    Arguments
+    --------------------------------------------------------------------------
+    path (str)               : A stage file path, with any stage extension
+    old (str)                : The end of the file name to replace, without
+                               the extension
+    new (str)                : What to replace it with
+    fmt (str)                : The output format (default: stage_format)
+
+    Returns
+    --------------------------------------------------------------------------
+    path (str)               : The new file path
+
+    """
+
+    base, ext = os.path.splitext(path)
+    if ext not in extensions.values():
+        base = path
+    if base.endswith(old):
+        base = base[:len(base)-len(old)] + new
+    return base + stage_ext(fmt)
+
+
+def file_format(path):
+    """The stage format of a file, from its extension."""
+    ext = os.path.splitext(path)[1]
+    for fmt, fmt_ext in extensions.items():
+        if ext == fmt_ext:
+            return fmt
+    raise ValueError("Not a stage file (.parquet, .arrow or .csv): " + path)
+
+
+def as_int32(column):
+    """
+    A column as int32, or nullable Int32 if it has missing values. Columns
+    with fractional values (e.g. float confidences from newer Tesseract
+    versions) are kept as float32 rather than truncated.
+    """
+
+    values = pd.to_numeric(column, errors="coerce")
+    present = values.dropna()
+    if not (present == np.floor(present)).all():
+        return values.astype("float32")
+    if len(present) < len(values):
+        return values.astype("Int32")
+    return values.astype("int32")
+
+
+def as_labels(column):
+    """A column as str values, with blanks as missing values (None)."""
+    labels = column.to_numpy(dtype=object, copy=True)
+    blank = pd.isna(labels) | (labels == "")
+    labels[blank] = None
+    if pd.api.types.infer_dtype(labels, skipna=True) not in ("string", "empty"):
+        labels = labels.astype(str).astype(object)
+        labels[blank] = None
+    return pd.Series(labels, index=column.index)
+
+
+def as_category(column):
+    """A column as categorical str labels, with blanks as missing values."""
+    codes, uniques = pd.factorize(as_labels(column))
+    return pd.Series(pd.Categorical.from_codes(codes, uniques.astype(str)), index=column.index)
+
+
+def as_other(column):
+    """
+    A column not in the schema, stored as numbers if every non-blank value
+    is a number, as pd.read_csv would read it back, and as strings if not.
+    """
+
+    if column.dtype != object:
+        return column
+    values = column.to_numpy(dtype=object, copy=True)
+    blank = pd.isna(values) | (values == "")
+    values[blank] = np.nan
+    numbers = pd.Series(pd.to_numeric(values, errors="coerce"), index=column.index)
+    if numbers.isna().sum() > blank.sum():
+        return as_labels(column)
+    if not blank.any() and (numbers == np.floor(numbers)).all():
+        return numbers.astype("int64")
+    return numbers.astype("float64")
+
+
+def to_storage(df):
+    """
+    Casts a raw or aggregate data frame to the stage schema for writing.
+
+    Arguments
+    --------------------------------------------------------------------------
+    df (pd.DataFrame)        : A raw or aggregate data frame
+
+    Returns
+    --------------------------------------------------------------------------
+    stored (pd.DataFrame)    : A copy with the schema types, and a default
+                               index
+
+    """
+
+    stored = {}
+    for column in df.columns:
+        kind = raw_schema.get(column)
+        if kind == "int32":
+            stored[column] = as_int32(df[column])
+        elif kind == "category":
+            stored[column] = as_category(df[column])
+        elif kind == "string":
+            stored[column] = as_labels(df[column]).astype("string")
+        else:
+            stored[column] = as_other(df[column])
+
+    return pd.DataFrame(stored, columns=df.columns).reset_index(drop=True)
+
+
+def from_storage(df):
+    """
+    Turns a data frame read from Parquet or Arrow into what read_stage
+    returns for a .csv file: categorical and string columns as object
+    columns with NaN for blanks (stored as missing values by to_storage).
+    """
+
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            # look each row's code up in the categories, with code -1
+            # (missing) picking the NaN added at the end
+            labels = np.append(np.asarray(df[column].cat.categories, dtype=object), np.nan)
+            df[column] = labels.take(df[column].cat.codes.to_numpy())
+        elif isinstance(df[column].dtype, pd.StringDtype):
+            df[column] = df[column].to_numpy(dtype=object, na_value=np.nan)
+        elif isinstance(df[column].dtype, pd.Int32Dtype):
+            df[column] = df[column].astype("float64")
+
+    return df
+
+
+def reload(df, fmt=None):
+    """
+    The data frame read_stage would return for df after write_stage in a
+    format (default: stage_format), without writing it to disk. Used to pass
+    a step's output straight to the next step (see pipeline.py).
+    """
+    if (fmt or stage_format) == "csv":
+        return pd.read_csv(io.StringIO(df.to_csv(index=False)), low_memory=False, keep_default_na=False, na_values=[""])
+    return from_storage(to_storage(df))
+
+
+def read_stage(path, encoding="utf-8"):
+    """
+    Reads a raw or aggregate stage file.
+
+    Arguments
+    --------------------------------------------------------------------------
+    path (str)               : A .parquet, .arrow or .csv file
+    encoding (str)           : The encoding of a .csv file
+
+    Returns
+    --------------------------------------------------------------------------
+    df (pd.DataFrame)        : The file, with blanks as NaN
+
+    """
+
+    fmt = file_format(path)
+    if fmt == "csv":
+        return pd.read_csv(path, encoding=encoding, low_memory=False, keep_default_na=False, na_values=[""])
+    if fmt == "parquet":
+        return from_storage(pd.read_parquet(path))
+    return from_storage(pd.read_feather(path))
+
+
+def write_stage(df, path, encoding="utf-8"):
+    """
+    Writes a raw or aggregate stage file, without the data frame's index.
+
+    Arguments
+    --------------------------------------------------------------------------
+    df (pd.DataFrame)        : A raw or aggregate data frame
+    path (str)               : A .parquet, .arrow or .csv file
+    encoding (str)           : The encoding of a .csv file
+
+    Returns
+    --------------------------------------------------------------------------
+    N/A
+
+    """
+
+    fmt = file_format(path)
+    if fmt == "csv":
+        df.to_csv(path, index=False, encoding=encoding)
+    elif fmt == "parquet":
+        to_storage(df).to_parquet(path, index=False)
+    else:
+        to_storage(df).to_feather(path)
+
+
+def stage_files(target):
+    """Stage files in a folder, or a single file."""
+    if os.path.isdir(target):
+        return [os.path.join(target, f) for f in sorted(os.listdir(target)) if is_stage_file(f)]
+    return [target]
+
+
+def copy_to(files, out, fmt, encoding):
+    """Writes a copy of each file in another format, in out or next to it."""
+    for path in files:
+        if file_format(path) == fmt:
+            continue
+        out_path = stage_path(path, "", "", fmt)
+        if out is not None:
+            os.makedirs(out, exist_ok=True)
+            out_path = os.path.join(out, os.path.basename(out_path))
+        write_stage(read_stage(path, encoding), out_path, encoding)
+        print(out_path)
+
+
+def benchmark(raw_file, repeat=1):
+    """
+    Times writing and reading a raw file as .csv and in each stage format,
+    and checks that each format reads back the same data frame as the .csv.
+    """
+
+    raw = pd.read_csv(raw_file, encoding="utf-8-sig", low_memory=False)
+    raw = pd.concat([raw] * repeat, ignore_index=True)
+    print("{}: {} rows".format(os.path.basename(raw_file), raw.shape[0]))
+
+    folder = tempfile.mkdtemp()
+    try:
+        for fmt in ["csv", "parquet", "arrow"]:
+            path = os.path.join(folder, "raw" + stage_ext(fmt))
+            t0 = time.perf_counter()
+            write_stage(raw, path)
+            t1 = time.perf_counter()
+            df = read_stage(path)
+            t2 = time.perf_counter()
+            if fmt == "csv":
+                expected = df
+            same = df.astype(object).fillna("").equals(expected.astype(object).fillna(""))
+            print("    {:8} write {:.3f}s, read {:.3f}s, {:.1f} MB, same as csv: {}".format(
+                  fmt, t1 - t0, t2 - t1, os.path.getsize(path) / 1e6, same))
+    finally:
+        shutil.rmtree(folder)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert or export split cleanup stage files.")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    export = sub.add_parser("export", help="write .csv copies of stage files")
+    convert = sub.add_parser("convert", help="write .csv files in the stage format")
+    for cmd in [export, convert]:
+        cmd.add_argument("target", help="a stage file or a folder of them")
+        cmd.add_argument("--out", help="output folder (default: next to each file)")
+        cmd.add_argument("--encoding", default="utf-8", help=".csv encoding (default: utf-8)")
+    convert.add_argument("--format", choices=["parquet", "arrow"], default=stage_format)
+
+    bench = sub.add_parser("benchmark", help="time each format on a raw file")
+    bench.add_argument("raw_file", nargs="?", default=sample_file, help="raw .csv file (default: 1899 sample)")
+    bench.add_argument("--repeat", type=int, default=1, help="copies of the file to run on")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        copy_to(stage_files(args.target), args.out, "csv", args.encoding)
+    elif args.command == "convert":
+        files = [f for f in stage_files(args.target) if file_format(f) == "csv"]
+        copy_to(files, args.out, args.format, args.encoding)
+    else:
+        benchmark(args.raw_file, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File-based work queue for running marginalia determination, adjRec and OCR
+across several machines.
+
+The queue is a directory on storage every machine can reach. Each task is
+a small JSON file that moves between folders as it is worked on:
+
+    todo/     waiting to be picked up, spread over todoShards subfolders
+    leased/   being worked on
+    done/     finished; the result is in results/
+    failed/   failed too many times; the last error is in the task file
+
+A worker takes a task by renaming it from todo/ to leased/. A rename is
+atomic, so only one worker gets each task. Workers look through the todo/
+subfolders in a random order, so they don't all race for the same file
+or list every waiting task on each lease. The worker records its lease
+time in the leased file, and while it works it touches the file every so
+often (a heartbeat). A lease whose file hasn't been touched for that
+lease time is taken to belong to a worker that died, and the task goes
+back to todo/ to be retried, up to maxAttempts times. Machines' clocks
+need to agree to well within the lease time.
+
+Results are written to results/ under a temporary name and renamed into
+place. Task ids come from the task's inputs, so adding the same task again
+does nothing, and if a task runs twice (for example when a slow worker's
+lease was taken back) the second result just replaces the first.
+
+Usage:
+    python workqueue.py worker --queue /shared/queue [--kinds ocr]
+    python workqueue.py status --queue /shared/queue
+
+Tasks are added by the stage scripts: ocr_use.py (runner = "queue"),
+adjRec.py (queueDir) and marginalia_determination.py (queue_dir).
+
+Digital Research Services
+University Libraries
+UNC Chapel Hill
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import hashlib
+import argparse
+import threading
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+states = ["todo", "leased", "done", "failed", "results", "tmp"]
+
+#number of todo/ subfolders
+todoShards = 16
+
+
+def toJSON(obj):
+
+    """
+
+    Convert numpy numbers (from data frames) for json.
+
+    """
+
+    if hasattr(obj, "item"):
+        return obj.item()
+    return str(obj)
+
+
+class workQueue():
+
+    """
+
+    A work queue in a shared directory.
+
+    Arguments
+    --------------------------------------------------------------------------
+    root (str)           : The queue directory. Created if it doesn't exist.
+
+    leaseTime (float)    : Seconds without a heartbeat before a lease this
+                           queue object takes is taken back. It is recorded
+                           with each lease, so workers can use different
+                           lease times.
+
+    maxAttempts (int)    : Times a task is tried before it is moved to failed.
+
+    Methods
+    --------------------------------------------------------------------------
+    put                  : Add a task.
+
+    lease                : Take a task to work on.
+
+    heartbeat            : Renew a lease.
+
+    complete             : Save a task's result.
+
+    fail                 : Return a task for a retry, or mark it failed.
+
+    claim                : Take a leased task file if this worker holds it.
+
+    reap                 : Take back expired leases.
+
+    result               : Get a task's result.
+
+    remove               : Remove a finished task and its result.
+
+    state                : Where a task is in the queue.
+
+    status               : Number of tasks in each state.
+
+    """
+
+    def __init__(self, root, leaseTime = 300, maxAttempts = 3):
+
+        self.root = root
+        self.leaseTime = leaseTime
+        self.maxAttempts = maxAttempts
+        for state in states:
+            os.makedirs(os.path.join(root, state), exist_ok = True)
+        for n in range(todoShards):
+            os.makedirs(os.path.join(root, "todo", "{:02x}".format(n)), exist_ok = True)
+
+    def path(self, state, tid):
+        if state == "todo":
+            n = int(hashlib.sha1(tid.encode("utf-8")).hexdigest()[:8], 16) % todoShards
+            return os.path.join(self.root, "todo", "{:02x}".format(n), tid + ".json")
+        return os.path.join(self.root, state, tid + ".json")
+
+    def write(self, state, tid, data):
+
+        """
+
+        Write a file under a temporary name and rename it into place.
+
+        """
+
+        tmp = os.path.join(self.root, "tmp", "{}.{}.{}".format(tid, socket.gethostname(), os.getpid()))
+        with open(tmp, "w", encoding = "utf-8") as f:
+            json.dump(data, f, default = toJSON)
+        os.replace(tmp, self.path(state, tid))
+
+    def read(self, state, tid):
+        with open(self.path(state, tid), encoding = "utf-8") as f:
+            return json.load(f)
+
+    def put(self, kind, payload, tid = None):
+
+        """
+
+        Add a task. Adding a task that is already in the queue does nothing.
+
+        Arguments
+        --------------------------------------------------------------------------
+        kind (str)           : The kind of task ("marginalia", "adjrec" or "ocr").
+
+        payload (dict)       : Arguments for the task.
+
+        tid (str)            : Task id. If not given, made from the kind and
+                               payload, so the same task always gets the same
+                               id.
+
+        Returns
+        --------------------------------------------------------------------------
+        (str) The task id.
+
+        """
+
+        if tid is None:
+            tid = hashlib.sha1(json.dumps([kind, payload], sort_keys = True, default = toJSON)
+                               .encode("utf-8")).hexdigest()
+
+        if self.state(tid) is None:
+            self.write("todo", tid, {"id" : tid, "kind" : kind, "payload" : payload, "attempts" : 0})
+
+        return tid
+
+    def lease(self, worker, kinds = None):
+
+        """
+
+        Take the next task to work on.
+
+        Arguments
+        --------------------------------------------------------------------------
+        worker (str)         : Name of the worker, recorded for status.
+
+        kinds (list)         : Kinds of task to take, or None for any.
+
+        Returns
+        --------------------------------------------------------------------------
+        (dict) The task, or None if there is nothing to do.
+
+        """
+
+        shards = os.listdir(os.path.join(self.root, "todo"))
+        random.shuffle(shards)
+
+        for shard in shards:
+            with os.scandir(os.path.join(self.root, "todo", shard)) as entries:
+                for entry in entries:
+
+                    tid = entry.name[:-5]
+                    try:
+                        task = self.read("todo", tid)
+                        if kinds is not None and task["kind"] not in kinds:
+                            continue
+                        #touched first, so the lease doesn't look expired
+                        #before it is rewritten below. Only one worker's
+                        #rename can succeed.
+                        os.utime(self.path("todo", tid))
+                        os.rename(self.path("todo", tid), self.path("leased", tid))
+                    except (FileNotFoundError, ValueError):
+                        continue
+
+                    #rewriting the file also starts the lease
+                    task["worker"] = worker
+                    task["lease"] = self.leaseTime
+                    self.write("leased", tid, task)
+                    return task
+
+        return None
+
+    def heartbeat(self, task):
+
+        """
+
+        Renew a task's lease. Returns False if the lease was lost.
+
+        """
+
+        try:
+            os.utime(self.path("leased", task["id"]))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, task, result):
+
+        """
+
+        Save a task's result and mark it done. The result is saved even if
+        the lease was lost; a second run of the task replaces it. The task
+        is only marked done if this worker still holds its lease.
+
+        """
+
+        self.write("results", task["id"], result)
+        claim = self.claim(task, "done")
+        if claim is not None:
+            os.rename(claim, self.path("done", task["id"]))
+
+    def fail(self, task, error):
+
+        """
+
+        Return a task to todo/ for a retry, or move it to failed/ once it has
+        been tried maxAttempts times.
+
+        """
+
+        claim = self.claim(task, "fail")
+        if claim is not None:
+            self.requeue(claim, error)
+
+    def claim(self, task, action):
+
+        """
+
+        Move a task's leased file aside if this worker still holds the lease,
+        so nothing else can take it meanwhile. If the lease expired and
+        another worker has taken the task since, the file is put back, so
+        that worker's lease isn't ended or counted as a failed attempt.
+
+        Returns
+        --------------------------------------------------------------------------
+        (str) Path of the claimed file, or None if the lease was lost.
+
+        """
+
+        tid = task["id"]
+        claim = os.path.join(self.root, "tmp", "{}.{}.{}.{}".format(tid, action, socket.gethostname(), os.getpid()))
+        try:
+            os.rename(self.path("leased", tid), claim)
+        except FileNotFoundError:
+            return None
+
+        with open(claim, encoding = "utf-8") as f:
+            holder = json.load(f).get("worker")
+        if holder != task.get("worker"):
+            os.rename(claim, self.path("leased", tid))
+            return None
+        return claim
+
+    def requeue(self, claim, error):
+
+        """
+
+        Record an attempt for a claimed task file and move it on.
+
+        """
+
+        with open(claim, encoding = "utf-8") as f:
+            task = json.load(f)
+        task["attempts"] += 1
+        task["error"] = error
+        task.pop("worker", None)
+        task.pop("lease", None)
+
+        state = "failed" if task["attempts"] >= self.maxAttempts else "todo"
+        self.write(state, task["id"], task)
+        os.remove(claim)
+
+    def reap(self):
+
+        """
+
+        Take back leases that haven't had a heartbeat for the lease time
+        recorded with them.
+
+        Returns
+        --------------------------------------------------------------------------
+        (int) Number of leases taken back.
+
+        """
+
+        n = 0
+        now = time.time()
+        for name in os.listdir(os.path.join(self.root, "leased")):
+            tid = name[:-5]
+            try:
+                age = now - os.stat(self.path("leased", tid)).st_mtime
+                if age < self.read("leased", tid).get("lease", self.leaseTime):
+                    continue
+                claim = os.path.join(self.root, "tmp", tid + ".reap")
+                os.rename(self.path("leased", tid), claim)
+            except (FileNotFoundError, ValueError):
+                continue
+            self.requeue(claim, "lease expired")
+            n += 1
+
+        return n
+
+    def result(self, tid):
+
+        """
+
+        A task's result, or None if it isn't finished.
+
+        """
+
+        try:
+            return self.read("results", tid)
+        except FileNotFoundError:
+            return None
+
+    def remove(self, tid):
+
+        """
+
+        Remove a finished task and its result, so putting the task again
+        runs it again. Tasks that aren't finished are left alone.
+
+        """
+
+        for state in ["results", "done"]:
+            try:
+                os.remove(self.path(state, tid))
+            except FileNotFoundError:
+                pass
+
+    def state(self, tid):
+
+        """
+
+        Where a task is in the queue ("todo", "leased", "done" or "failed"),
+        or None if it isn't in the queue.
+
+        """
+
+        for state in ["done", "leased", "todo", "failed"]:
+            if os.path.exists(self.path(state, tid)):
+                return state
+        return None
+
+    def status(self):
+
+        """
+
+        Number of tasks in each state.
+
+        """
+
+        counts = {state : len(os.listdir(os.path.join(self.root, state)))
+                  for state in ["leased", "done", "failed"]}
+        counts["todo"] = sum(len(os.listdir(os.path.join(self.root, "todo", shard)))
+                             for shard in os.listdir(os.path.join(self.root, "todo")))
+        return {state : counts[state] for state in ["todo", "leased", "done", "failed"]}
+
+
+def collect(queue, tids, poll = 2):
+
+    """
+
+    Wait for tasks' results, in order.
+
+    Arguments
+    --------------------------------------------------------------------------
+    queue (workQueue)    : The queue.
+
+    tids (list)          : Task ids.
+
+    poll (float)         : Seconds between checks.
+
+    Returns
+    --------------------------------------------------------------------------
+    (generator) Each task's result, in the order of tids. Raises an error if
+    a task failed.
+
+    """
+
+    for tid in tids:
+        while True:
+            result = queue.result(tid)
+            if result is not None:
+                yield result
+                break
+            if queue.state(tid) == "failed":
+                raise RuntimeError("Task {} failed: {}".format(tid, queue.read("failed", tid).get("error")))
+            queue.reap()
+            time.sleep(poll)
+
+
+def getHandlers(kinds):
+
+    """
+
+    Load the functions that run each kind of task. Modules are only loaded
+    for the kinds a worker takes.
+
+    """
+
+    handlers = {}
+
+    if kinds is None or "marginalia" in kinds:
+        sys.path.insert(0, os.path.join(here, "marginalia"))
+        from cropfunctions import page_marginalia
+        handlers["marginalia"] = page_marginalia
+
+    if kinds is None or "adjrec" in kinds:
+        sys.path.insert(0, os.path.join(here, "ocr"))
+        import adjRec
+        handlers["adjrec"] = lambda p: adjRec.adjRec(p["vol"], adjRec.dirpath, adjRec.masterlist,
+                                                     adjRec.margdata, p["n"], p.get("strips", 0))
+
+    if kinds is None or "ocr" in kinds:
+        sys.path.insert(0, os.path.join(here, "ocr"))
+        import ocr_use
+        ocr_use.initWorker(ocr_use.ompThreads, False, ocr_use.memBudget)
+        handlers["ocr"] = ocr_use.queuePage
+
+    return handlers
+
+
+def runWorker(queue, kinds = None, idle = 10, once = False):
+
+    """
+
+    Take and run tasks until the queue is empty.
+
+    Arguments
+    --------------------------------------------------------------------------
+    queue (workQueue)    : The queue.
+
+    kinds (list)         : Kinds of task to take, or None for any.
+
+    idle (float)         : Seconds to wait when there is nothing to do.
+
+    once (bool)          : If True, stop when there is nothing to do
+                           instead of waiting for more tasks.
+
+    """
+
+    worker = "{}:{}".format(socket.gethostname(), os.getpid())
+    handlers = getHandlers(kinds)
+
+    while True:
+
+        queue.reap()
+        task = queue.lease(worker, list(handlers.keys()))
+
+        if task is None:
+            if once == True:
+                return
+            time.sleep(idle)
+            continue
+
+        #keep the lease alive while the task runs
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(queue.leaseTime / 3):
+                queue.heartbeat(task)
+        threading.Thread(target = beat, daemon = True).start()
+
+        try:
+            queue.complete(task, handlers[task["kind"]](task["payload"]))
+        except Exception as e:
+            print("{} failed: {!r}".format(task["id"], e))
+            queue.fail(task, repr(e))
+        finally:
+            stop.set()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Run or check a shared work queue.")
+    parser.add_argument("command", choices = ["worker", "status"])
+    parser.add_argument("--queue", required = True, help = "shared queue directory")
+    parser.add_argument("--kinds", nargs = "+", choices = ["marginalia", "adjrec", "ocr"],
+                        help = "kinds of task to run (default: all)")
+    parser.add_argument("--once", action = "store_true", help = "stop when the queue is empty")
+    parser.add_argument("--lease", type = float, default = 300, help = "lease time in seconds")
+    args = parser.parse_args()
+
+    queue = workQueue(args.queue, leaseTime = args.lease)
+
+    if args.command == "status":
+        print(queue.status())
+    else:
+        runWorker(queue, args.kinds, once = args.once)
+
+
+if __name__ == "__main__":
+    main()